@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# performance benchmarks for bombman, run without a display (headless maps)
+
+import bombman
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+map_file = open(os.path.join(bombman.Game.MAP_PATH,"classic"))
+map_data = map_file.read()
+map_file.close()
+
+play_setup = bombman.PlaySetup()
+play_setup.player_slots = [(-1,i) for i in range(10)]
+
+## Returns the size in bytes of given object including its attribute dictionary
+#  (if it has one), the attribute values themselves aren't counted.
+
+def object_size(obj):
+  result = sys.getsizeof(obj)
+
+  if hasattr(obj,"__dict__"):
+    result += sys.getsizeof(obj.__dict__)
+
+  return result
+
+#       ==============
+#       entity memory
+#       ==============
+
+print("simulating a match for 15 s of map time to get some bombs and flames on the map")
+
+game_map = bombman.GameMap(map_data,play_setup,0,0,headless=True,seed=0)
+simulation = bombman.Simulation(game_map,play_setup)
+
+bombs = []
+
+while game_map.get_map_time() < 15000:
+  simulation.step(10)
+
+  for bomb in game_map.get_bombs():
+    if not bomb in bombs:
+      bombs.append(bomb)
+
+players = game_map.get_players()
+tiles = [tile for line in game_map.get_tiles() for tile in line]
+flight_infos = [bomb.flight_info for bomb in bombs]
+flames = [flame for flames_at_tile in game_map.tile_grid.flames for flame in flames_at_tile]
+
+if len(flames) == 0:
+  flames = [bombman.Flame()]
+
+print("bytes per object (object + attribute dictionary):")
+
+for name, objects in (("Player",players),("Bomb",bombs),("BombFlightInfo",flight_infos),("MapTile",tiles),("Flame",flames)):
+  print("  " + name + ": " + str(object_size(objects[0])))
+
+map_entity_bytes = sum([object_size(obj) for obj in players + tiles]) + 30 * (object_size(bombs[0]) + object_size(flight_infos[0]))
+
+print("entity bytes per GameMap (10 players, " + str(len(tiles)) + " tiles, 30 bombs): " + str(map_entity_bytes))
+
+#       ================
+#       attribute access
+#       ================
+
+player = players[0]
+bomb = bombs[0]
+
+repeats = 1000000
+
+print("attribute access, " + str(repeats) + " repeats:")
+
+player_access_time = timeit.timeit(lambda: (player.position,player.state,player.speed,player.disease),number=repeats)
+print("  Player (4 attributes): " + str(round(player_access_time,3)) + " s")
+
+bomb_access_time = timeit.timeit(lambda: (bomb.movement,bomb.flame_length,bomb.has_exploded,bomb.position),number=repeats)
+print("  Bomb (4 attributes): " + str(round(bomb_access_time,3)) + " s")
+
+#       ===================
+#       simulation speed
+#       ===================
+
+print("simulating 4 seeded matches with 10 AI players")
+
+simulated_time = 0
+state_hashes = []
+time_before = time.time()
+
+for seed in range(4):
+  benchmark_map = bombman.GameMap(map_data,play_setup,0,0,headless=True,seed=seed)
+  bombman.Simulation(benchmark_map,play_setup).run(10,60000)
+  simulated_time += benchmark_map.get_map_time()
+  state_hashes.append(benchmark_map.get_state_hash())
+
+real_time = time.time() - time_before
+
+print("  " + str(simulated_time) + " ms of map time in " + str(round(real_time,2)) + " s (" + str(int(simulated_time / real_time)) + " ms of map time per second)")
+print("  final state hashes (should be the same on all machines and Python versions): " + " ".join(["%016x" % h for h in state_hashes]))
+
+#       ===================
+#       map size scaling
+#       ===================
+
+## Makes map data of a square arena of given size with the "classic" map in its
+#  top left corner and floor with a grid of walls everywhere else, so that the
+#  players, blocks and bombs stay about the same while the area grows.
+
+def make_arena(size):
+  classic_lines = [line.replace(" ","") for line in map_data.split(";")[3].split("\n") if line.strip() != ""]
+  lines = []
+
+  for y in range(size):
+    line = ""
+
+    for x in range(size):
+      if y < len(classic_lines) and x < len(classic_lines[y]):
+        line += classic_lines[y][x]
+      elif x % 2 == 1 and y % 2 == 1:
+        line += "#"
+      else:
+        line += "."
+
+    lines.append(line)
+
+  header = map_data.split(";")
+
+  return header[0] + ":" + str(size) + "x" + str(size) + ";" + header[1] + ";" + header[2] + ";\n" + "\n".join(lines)
+
+print("simulating 10 s of map time with 10 AI players on arenas of growing size")
+
+for size in (16,32,64,128):
+  arena_map = bombman.GameMap(make_arena(size),play_setup,0,0,headless=True,seed=0)
+  arena_simulation = bombman.Simulation(arena_map,play_setup)
+  steps = 0
+
+  time_before = time.time()
+
+  while arena_map.get_map_time() < 10000:
+    arena_simulation.step(10)
+    steps += 1
+
+  real_time = time.time() - time_before
+
+  print("  " + str(size) + " x " + str(size) + ": " + str(round(real_time / steps * 1000,3)) + " ms per step, " + str(len(arena_map.get_bombs())) + " bombs and " + str(len(arena_map.tile_grid.active_tiles)) + " active tiles at the end")
+
+
+#       ===================
+#       large lobbies
+#       ===================
+
+print("simulating 10 s of map time with growing numbers of AI players on a 64 x 64 arena")
+
+for number_of_players in (10,32,64):
+  lobby_play_setup = bombman.PlaySetup()
+  lobby_play_setup.set_ai_lobby(number_of_players,number_of_players)
+  lobby_map = bombman.GameMap(make_arena(64),lobby_play_setup,0,0,headless=True,seed=0)
+  lobby_simulation = bombman.Simulation(lobby_map,lobby_play_setup)
+  steps = 0
+  real_time = 0
+  state_hash_time = 0
+
+  while lobby_map.get_map_time() < 10000:
+    time_before = time.time()
+    lobby_simulation.step(10)
+    time_after_step = time.time()
+    lobby_map.get_state_hash()
+    real_time += time_after_step - time_before
+    state_hash_time += time.time() - time_after_step
+    steps += 1
+
+  print("  " + str(number_of_players) + " players: " + str(round(real_time / steps * 1000,3)) + " ms per step (" + str(round(real_time / steps * 1000 / number_of_players,4)) + " ms per player), state hash after each step: " + str(round(state_hash_time / steps * 1000000,1)) + " us")
+
+#       ===================
+#       snapshots
+#       ===================
+
+print("taking snapshots and hashing the match on \"classic\" after 15 s (" + str(len(game_map.get_bombs())) + " bombs, " + str(len(game_map.tile_grid.active_tiles)) + " active tiles):")
+
+repeats = 10000
+map_snapshot = game_map.snapshot()
+
+snapshot_time = timeit.timeit(lambda: game_map.snapshot(),number=repeats)
+print("  snapshot: " + str(round(snapshot_time / repeats * 1000000,1)) + " us")
+
+restore_time = timeit.timeit(lambda: game_map.restore(map_snapshot),number=repeats)
+print("  restore: " + str(round(restore_time / repeats * 1000000,1)) + " us")
+
+state_hash_time = timeit.timeit(lambda: game_map.get_state_hash(),number=repeats)
+print("  state hash: " + str(round(state_hash_time / repeats * 1000000,1)) + " us")
+
+#       ===================
+#       replays
+#       ===================
+
+print("recording a seeded match with 10 AI players into a replay and playing it back headless")
+
+replay_filename = os.path.join(tempfile.gettempdir(),"bombman_benchmark.replay")
+recorded_map = bombman.GameMap(map_data,play_setup,0,0,headless=True,seed=0)
+recorded_simulation = bombman.Simulation(recorded_map,play_setup)
+replay_recorder = bombman.ReplayRecorder(replay_filename,recorded_map,play_setup)
+
+time_before = time.time()
+
+while recorded_map.get_state() != bombman.GameMap.STATE_GAME_OVER and recorded_map.get_map_time() < 60000:
+  replay_recorder.record_tick(10,recorded_simulation.step(10))
+
+recording_time = time.time() - time_before
+replay_recorder.close()
+
+replay_player = bombman.ReplayPlayer(replay_filename)
+time_before = time.time()
+replay_player.run()
+playback_time = time.time() - time_before
+
+print("  " + str(recorded_map.get_map_time()) + " ms of map time, " + str(os.path.getsize(replay_filename)) + " bytes")
+print("  recording (with AIs): " + str(round(recording_time,2)) + " s, playback: " + str(round(playback_time,2)) + " s" + (", OUT OF SYNC" if replay_player.get_out_of_sync_time() != None else ""))
+
+seek_times = list(range(0,recorded_map.get_map_time(),3700))
+seek_times = seek_times + list(reversed(seek_times))
+time_before = time.time()
+
+for seek_time in seek_times:
+  replay_player.seek(seek_time)
+
+seeking_time = time.time() - time_before
+
+print("  seeking (" + str(len(replay_player.get_keyframes())) + " keyframes): " + str(round(seeking_time / len(seek_times) * 1000,1)) + " ms per seek")
+
+replay_player.close()
+os.remove(replay_filename)
+
+#       ===================
+#       tournament
+#       ===================
+
+number_of_cores = multiprocessing.cpu_count()
+number_of_matches = 2 * number_of_cores
+
+print("running a tournament of " + str(number_of_matches) + " AI matches in one process and in one process per core (" + str(number_of_cores) + " cores)")
+
+for number_of_processes in sorted(set((1,number_of_cores))):
+  tournament = bombman.Tournament(number_of_matches,number_of_processes)
+  tournament.run()
+  print("  " + str(number_of_processes) + " processes: " + str(round(tournament.get_matches_per_second(),2)) + " matches per second")
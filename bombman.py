@@ -80,9 +80,16 @@ import sys
 import pygame
 import os
 import math
-import copy
+import colorsys
 import random
 import time
+import array
+import heapq
+import operator
+import struct
+import mmap
+import zlib
+import multiprocessing
 
 DEBUG_PROFILING = False
 DEBUG_FPS = False
@@ -158,21 +165,160 @@ class Profiler(object):
         
     return result
 
+profiler = Profiler()   # profiler object is global, for simple access
+
+#==============================================================================
+
+## Computes keys for the state hash of a match (see GameMap.get_state_hash). The
+#  hash is the sum (modulo 2^64) of the keys of all parts of the state, so it can
+#  be kept up to date by subtracting the old key of a changed part and adding the
+#  new one. Unlike with XOR, equal parts (e.g. two flames on one tile) don't
+#  cancel out. Python's hash() isn't used, so the keys are the same on all
+#  platforms and Python versions.
+
+class StateHash(object):
+  MASK = 2 ** 64 - 1
+
+  TAG_MAP = 0        ##< first values of the keys, tell which part of the state the key is for
+  TAG_TILE = 1
+  TAG_FLAME = 2
+  TAG_PLAYER = 3
+  TAG_BOMB = 4
+
+  #----------------------------------------------------------------------------
+
+  ## Returns the key (64 bit integer) for given sequence of integers.
+
+  @staticmethod
+  def key(values):
+    result = 0x9e3779b97f4a7c15
+    
+    for value in values:
+      result = ((result ^ value) * 0xbf58476d1ce4e5b9) & StateHash.MASK
+      result ^= result >> 31
+      
+    return result
+
+#==============================================================================
+
+## Random number generator of seeded matches. The underlying generator (Mersenne
+#  Twister, also its getrandbits and state) is the same in all Python versions,
+#  but choice, randint and sample are implemented differently in Python 2 and 3,
+#  so they are reimplemented here on top of getrandbits. This way a seed gives
+#  the same match (and the same replay and state hashes) on all versions.
+
+class SeededRandom(random.Random):
+
+  #----------------------------------------------------------------------------
+
+  ## Returns a random integer from 0 to n - 1 (n > 0).
+
+  def randbelow(self, n):
+    bits = n.bit_length()
+    result = self.getrandbits(bits)
+    
+    while result >= n:
+      result = self.getrandbits(bits)
+      
+    return int(result)           # getrandbits gives a long in Python 2
+
+  #----------------------------------------------------------------------------
+
+  def choice(self, sequence):
+    if len(sequence) == 0:
+      raise IndexError("cannot choose from an empty sequence")
+    
+    return sequence[self.randbelow(len(sequence))]
+
+  #----------------------------------------------------------------------------
+
+  ## Returns a random integer from a to b, including both.
+
+  def randint(self, a, b):
+    return a + self.randbelow(b - a + 1)
+
+  #----------------------------------------------------------------------------
+
+  ## Returns k different random elements of given sequence (a partial shuffle
+  #  of its copy).
+
+  def sample(self, population, k):
+    pool = list(population)
+    
+    if not 0 <= k <= len(pool):
+      raise ValueError("sample larger than population")
+    
+    for i in range(k):
+      j = i + self.randbelow(len(pool) - i)
+      pool[i], pool[j] = pool[j], pool[i]
+      
+    return pool[:k]
+
 #==============================================================================
 
-## Something that has a float position on the map.
+## Something that has a position on the map. The position is stored in fixed
+#  point integer units (POSITION_UNITS per tile), chosen so that a speed in
+#  tiles per second times a time in ms gives a distance in these units. Float
+#  positions (in tiles) can still be used with get_position/set_position.
 
 class Positionable(object):
+  POSITION_UNITS = 1000               ##< fixed point position units per tile
+
+  __slots__ = ("x","y","tile_position","tick_start_position")
 
   #----------------------------------------------------------------------------
 
   def __init__(self):
-    self.position = (0.0,0.0)
+    self.x = 0                        ##< x position in fixed point units
+    self.y = 0                        ##< y position in fixed point units
+    self.tile_position = (0,0)        ##< cached tile coordinates of the position
+    self.tick_start_position = None   ##< fixed point position at the start of the last simulation tick, for render interpolation
+
+  #----------------------------------------------------------------------------
+
+  ## Float position in tiles.
+
+  @property
+  def position(self):
+    return (self.x / float(Positionable.POSITION_UNITS),self.y / float(Positionable.POSITION_UNITS))
+
+  @position.setter
+  def position(self, position):
+    self.set_position(position)
+
+  #----------------------------------------------------------------------------
+
+  ## Converts a float coordinate in tiles to fixed point units.
+
+  @staticmethod
+  def to_fixed(value):
+    return int(math.floor(value * Positionable.POSITION_UNITS + 0.5))
 
   #----------------------------------------------------------------------------
 
   def set_position(self,position):
-    self.position = position
+    self.set_fixed_position(Positionable.to_fixed(position[0]),Positionable.to_fixed(position[1]))
+
+  #----------------------------------------------------------------------------
+
+  def set_fixed_position(self, x, y):
+    self.x = x
+    self.y = y
+    
+    tile_x = x // Positionable.POSITION_UNITS
+    tile_y = y // Positionable.POSITION_UNITS
+    
+    if tile_x != self.tile_position[0] or tile_y != self.tile_position[1]:
+      self.tile_position = (tile_x,tile_y)
+    
+    self.position_changed()
+
+  #----------------------------------------------------------------------------
+
+  ## Called whenever the position is set, subclasses can override this.
+
+  def position_changed(self):
+    pass
 
   #----------------------------------------------------------------------------
 
@@ -180,6 +326,34 @@ class Positionable(object):
     return self.position
 
   #----------------------------------------------------------------------------
+
+  ## Remembers the current position as the position at the start of a simulation
+  #  tick so that the position can later be interpolated for rendering.
+
+  def start_tick(self):
+    self.tick_start_position = (self.x,self.y)
+
+  #----------------------------------------------------------------------------
+
+  ## Gets the position interpolated between the start of the last simulation tick
+  #  (alpha = 0) and the current position (alpha = 1). Jumps longer than one tile
+  #  (teleports, flying over the map border, ...) are not interpolated.
+
+  def get_interpolated_position(self, alpha):
+    if self.tick_start_position == None:
+      return self.position
+    
+    dx = self.x - self.tick_start_position[0]
+    dy = self.y - self.tick_start_position[1]
+    
+    if abs(dx) > Positionable.POSITION_UNITS or abs(dy) > Positionable.POSITION_UNITS:
+      return self.position
+    
+    units = float(Positionable.POSITION_UNITS)
+    
+    return ((self.tick_start_position[0] + alpha * dx) / units,(self.tick_start_position[1] + alpha * dy) / units)
+
+  #----------------------------------------------------------------------------
   
   def get_neighbour_tile_coordinates(self):
     tile_coordinates = self.get_tile_position()
@@ -194,17 +368,16 @@ class Positionable(object):
   #----------------------------------------------------------------------------
   
   def get_tile_position(self):
-    return Positionable.position_to_tile(self.position)
+    return self.tile_position
 
   #----------------------------------------------------------------------------
   
   ## Moves the object to center of tile (if not specified, objects current tile is used).
   
   def move_to_tile_center(self, tile_coordinates=None):
-    if tile_coordinates != None:
-      self.position = tile_coordinates
-    
-    self.position = (math.floor(self.position[0]) + 0.5,math.floor(self.position[1]) + 0.5)
+    tile = Positionable.position_to_tile(tile_coordinates) if tile_coordinates != None else self.tile_position
+    half_tile = Positionable.POSITION_UNITS // 2
+    self.set_fixed_position(tile[0] * Positionable.POSITION_UNITS + half_tile,tile[1] * Positionable.POSITION_UNITS + half_tile)
 
   #----------------------------------------------------------------------------
 
@@ -217,12 +390,10 @@ class Positionable(object):
   #----------------------------------------------------------------------------
   
   def is_near_tile_center(self):
-    position_within_tile = (self.position[0] % 1,self.position[1] % 1)
-    
-    limit = 0.2
-    limit2 = 1.0 - limit
+    limit = Positionable.POSITION_UNITS // 5
+    limit2 = Positionable.POSITION_UNITS - limit
     
-    return (limit < position_within_tile[0] < limit2) and (limit < position_within_tile[1] < limit2)
+    return (limit < self.x % Positionable.POSITION_UNITS < limit2) and (limit < self.y % Positionable.POSITION_UNITS < limit2)
 
 #==============================================================================
 
@@ -253,16 +424,43 @@ class Player(Positionable):
   INITIAL_SPEED = 3
   SLOW_SPEED = 1.5
   MAX_SPEED = 10
+  MAX_STEP_DISTANCE = 200         ##< longest distance (in fixed point units) the player moves between collision checks
   SPEEDUP_VALUE = 1
   DISEASE_TIME = 20000
   
   JUMP_DURATION = 2000
   TELEPORT_DURATION = 1500
 
+  __slots__ = ("game_map","tile_index","number","team_number","_state","state_time","speed","bombs_left",
+    "flame_length","items","has_spring","has_shoe","disease_ends_at","disease","has_multibomb",
+    "has_boxing_glove","has_throwing_glove","boxing","detonator_bombs_left","detonator_bombs",
+    "wait_for_special_release","wait_for_bomb_release","throwing_time_left","state_backup","jumping_to",
+    "teleporting_to","wait_for_tile_transition","invincible","info_board_update_needed","kills","wins",
+    "random","jumping_from","putting_bomb","throwing","putting_multibomb","items_hash_key","hash_key",
+    "hash_key_outdated")
+
+  SNAPSHOT_ATTRIBUTES = ("x","y","tile_position","tick_start_position","tile_index","state","state_time","speed",
+    "bombs_left","flame_length","has_spring","has_shoe","disease_ends_at","disease","has_multibomb","has_boxing_glove",
+    "has_throwing_glove","boxing","detonator_bombs_left","wait_for_special_release","wait_for_bomb_release",
+    "throwing_time_left","state_backup","jumping_to","teleporting_to","wait_for_tile_transition","invincible",
+    "kills","wins","items_hash_key","hash_key")   ##< attributes with immutable values saved by get_snapshot (items and detonator_bombs are copied separately)
+  SNAPSHOT_GETTER = operator.attrgetter(*SNAPSHOT_ATTRIBUTES)
+
+  STATE_FIELDS = (("x","i"),("y","i"),("tick_start_position","p"),("tile_index","n"),("state","B"),("state_time","i"),
+    ("speed","d"),("bombs_left","i"),("flame_length","i"),("has_spring","?"),("has_shoe","?"),("disease_ends_at","i"),
+    ("disease","B"),("has_multibomb","?"),("has_boxing_glove","?"),("has_throwing_glove","?"),("boxing","?"),
+    ("detonator_bombs_left","i"),("wait_for_special_release","?"),("wait_for_bomb_release","?"),("throwing_time_left","i"),
+    ("state_backup","B"),("jumping_to","p"),("teleporting_to","p"),("wait_for_tile_transition","?"),("invincible","?"),
+    ("kills","i"),("wins","i"))   ##< record of the snapshot attributes written by GameMap.save_state (see StateRecords), the tile position and hash keys are computed on load
+
   #----------------------------------------------------------------------------
 
   def __init__(self):
     super(Player,self).__init__()
+    self.game_map = None                  ##< map the player is on, it keeps the map's player index up to date
+    self.tile_index = None                ##< index of the tile under which the player is in the map's player index
+    self.hash_key = None                  ##< player's key included in the map's state hash, see GameMap.get_state_hash
+    self.hash_key_outdated = False        ##< whether the map has to recompute hash_key, see GameMap.hash_key_changed
     self.number = 0                       ##< player's number
     self.team_number = 0                  ##< team number, determines player's color
     self.state = Player.STATE_IDLE_DOWN
@@ -273,7 +471,7 @@ class Player(Positionable):
     self.items = {}                       ##< which items and how many the player has, format: [item code]: count
     self.has_spring = False               ##< whether player's bombs have springs
     self.has_shoe = False                 ##< whether player has a kicking shoe
-    self.disease_time_left = 0
+    self.disease_ends_at = 0              ##< absolute map time in ms at which the disease ends
     self.disease = Player.DISEASE_NONE
     self.has_multibomb = False
     self.has_boxing_glove = False
@@ -292,9 +490,90 @@ class Player(Positionable):
     self.info_board_update_needed = True
     self.kills = 0
     self.wins = 0
+    self.random = random                  ##< random number generator to use, the map sets its own seeded one
   
     self.items[GameMap.ITEM_BOMB] = 1
     self.items[GameMap.ITEM_FLAME] = 1
+    self.__update_items_hash_key()
+
+  #----------------------------------------------------------------------------
+
+  ## Player's state (see the STATE_* constants).
+
+  @property
+  def state(self):
+    return self._state
+
+  @state.setter
+  def state(self, value):
+    self._state = value
+    self.hash_changed()
+
+  #----------------------------------------------------------------------------
+
+  def position_changed(self):
+    if self.game_map != None:
+      self.game_map.update_player_index(self)
+      self.game_map.hash_key_changed(self)
+
+  #----------------------------------------------------------------------------
+
+  ## Has to be called whenever a value the player's state hash key is made from
+  #  changes (see GameMap.hash_key_changed).
+
+  def hash_changed(self):
+    if self.game_map != None:
+      self.game_map.hash_key_changed(self)
+
+  #----------------------------------------------------------------------------
+
+  ## Returns a tuple of values describing the player's current state, which can
+  #  later be given to restore_snapshot (used by GameMap.snapshot).
+
+  def get_snapshot(self):
+    return Player.SNAPSHOT_GETTER(self) + (dict(self.items),tuple(self.detonator_bombs))
+
+  #----------------------------------------------------------------------------
+
+  ## Returns the player's key for the map state hash (see StateHash).
+
+  def get_hash_key(self):
+    return StateHash.key((StateHash.TAG_PLAYER,self.number,self.x,self.y,self._state,self.disease,self.items_hash_key))
+
+  #----------------------------------------------------------------------------
+
+  ## Returns the part of the player's hash key made from given items (in format
+  #  of Player.items). Items change much less often than the position, so this
+  #  part is kept separately and only computed when they change.
+
+  @staticmethod
+  def get_items_hash_key(items):
+    values = []
+    
+    for item in sorted(items):
+      values.append(item)
+      values.append(items[item])
+    
+    return StateHash.key(values)
+
+  #----------------------------------------------------------------------------
+
+  def __update_items_hash_key(self):
+    self.items_hash_key = Player.get_items_hash_key(self.items)
+    self.hash_changed()
+
+  #----------------------------------------------------------------------------
+
+  ## Sets the player's state from a tuple returned by get_snapshot. The map's
+  #  player index isn't updated, GameMap.restore takes care of it.
+
+  def restore_snapshot(self, values):
+    for name, value in zip(Player.SNAPSHOT_ATTRIBUTES,values):
+      setattr(self,name,value)
+      
+    self.items = dict(values[-2])
+    self.detonator_bombs = list(values[-1])
+    self.info_board_update_needed = True
 
   #----------------------------------------------------------------------------
     
@@ -364,21 +643,23 @@ class Player(Positionable):
   #----------------------------------------------------------------------------
 
   def kill(self, game_map):
-    if self.invincible:
+    if self.invincible or self.state == Player.STATE_DEAD:
       return
     
     self.info_board_update_needed = True
     
     self.state = Player.STATE_DEAD
+    game_map.update_player_index(self)
+    game_map.player_killed(self)
     game_map.add_sound_event(SoundPlayer.SOUND_EVENT_DEATH)
     
-    random_animation = random.choice((
+    random_animation = self.random.choice((
       Renderer.ANIMATION_EVENT_DIE,
       Renderer.ANIMATION_EVENT_EXPLOSION,
       Renderer.ANIMATION_EVENT_RIP,
       Renderer.ANIMATION_EVENT_SKELETION))
     
-    game_map.add_animation_event(random_animation,Renderer.map_position_to_pixel_position(self.position,(0,-15)))
+    game_map.add_animation_event(random_animation,self.position,(0,-15))
     game_map.give_away_items(self.get_items())
 
   #----------------------------------------------------------------------------
@@ -444,10 +725,14 @@ class Player(Positionable):
 
   #----------------------------------------------------------------------------
 
+  ## Returns a list of the player's items (item codes, repeated by their count),
+  #  sorted so that the order doesn't depend on the history of the items dict
+  #  (the items are given away in this order when the player dies).
+
   def get_items(self):
     result = []
     
-    for item in self.items:
+    for item in sorted(self.items):
       result += [item for i in range(self.items[item])]
         
     return result
@@ -462,6 +747,7 @@ class Player(Positionable):
     
     self.state_backup = self.state
     self.state = Player.STATE_IN_AIR
+    game_map.update_player_index(self)
     self.jumping_from = self.get_tile_position()
     
     landing_tiles = []             # potential tiles to land on
@@ -478,7 +764,7 @@ class Player(Positionable):
     if len(landing_tiles) == 0:    # this should practically not happen
       self.jumping_to = (self.jumping_from[0],self.jumping_from[1] + 1)
     else:
-      self.jumping_to = random.choice(landing_tiles)
+      self.jumping_to = self.random.choice(landing_tiles)
     
     self.state_time = 0
 
@@ -538,11 +824,12 @@ class Player(Positionable):
 
   def give_item(self, item, game_map=None):
     self.items[item] = 1 if not item in self.items else self.items[item] + 1
+    self.__update_items_hash_key()
       
     self.info_board_update_needed = True
       
     if item == GameMap.ITEM_RANDOM:
-      item = random.choice((
+      item = self.random.choice((
         GameMap.ITEM_BOMB,
         GameMap.ITEM_FLAME,
         GameMap.ITEM_SUPERFLAME,
@@ -563,7 +850,7 @@ class Player(Positionable):
     elif item == GameMap.ITEM_FLAME:
       self.flame_length += 1
     elif item == GameMap.ITEM_SUPERFLAME:
-      self.flame_length = max(GameMap.MAP_WIDTH,GameMap.MAP_HEIGHT)
+      self.flame_length = max(self.game_map.get_width(),self.game_map.get_height()) if self.game_map != None else max(GameMap.MAP_WIDTH,GameMap.MAP_HEIGHT)
     elif item == GameMap.ITEM_MULTIBOMB:
       self.has_multibomb = True
     elif item == GameMap.ITEM_DETONATOR:
@@ -580,7 +867,7 @@ class Player(Positionable):
     elif item == GameMap.ITEM_THROWING_GLOVE:
       self.has_throwing_glove = True
     elif item == GameMap.ITEM_DISEASE:
-      chosen_disease = random.choice([
+      chosen_disease = self.random.choice([
         (Player.DISEASE_SHORT_FLAME,SoundPlayer.SOUND_EVENT_DISEASE),     
         (Player.DISEASE_SLOW,SoundPlayer.SOUND_EVENT_SLOW),
         (Player.DISEASE_DIARRHEA,SoundPlayer.SOUND_EVENT_DIARRHEA),
@@ -593,13 +880,13 @@ class Player(Positionable):
       
       if chosen_disease[0] == Player.DISEASE_SWITCH_PLAYERS:
         if game_map != None:
-          players = filter(lambda p: not p.is_dead(), game_map.get_players())
+          players = game_map.get_alive_players()
           
           player_to_switch = self
           
           if len(players) > 1:     # should always be true
             while player_to_switch == self:
-              player_to_switch = random.choice(players)
+              player_to_switch = self.random.choice(players)
           
           my_position = self.get_position()
           self.set_position(player_to_switch.get_position())
@@ -608,8 +895,7 @@ class Player(Positionable):
         if game_map != None:
           game_map.start_earthquake()
       else:
-        self.disease = chosen_disease[0]
-        self.disease_time_left = Player.DISEASE_TIME
+        self.set_disease(chosen_disease[0],Player.DISEASE_TIME)
     
       sound_to_make = chosen_disease[1]
     
@@ -625,7 +911,6 @@ class Player(Positionable):
       new_bomb.set_position(tile_coordinates)
       new_bomb.move_to_tile_center()
     
-    game_map.add_bomb(new_bomb)
     game_map.add_sound_event(SoundPlayer.SOUND_EVENT_BOMB_PUT)
     self.bombs_left -= 1
       
@@ -638,6 +923,8 @@ class Player(Positionable):
       new_bomb.detonator_time = Bomb.DETONATOR_EXPIRATION_TIME
       self.detonator_bombs.append(new_bomb)
       self.detonator_bombs_left -= 1
+      
+    game_map.add_bomb(new_bomb)      # only now, the map needs to know the bomb's final timing and flame length
 
   #----------------------------------------------------------------------------
     
@@ -657,13 +944,30 @@ class Player(Positionable):
   #----------------------------------------------------------------------------
   
   def get_disease_time(self):
-    return self.disease_time_left
+    if self.disease == Player.DISEASE_NONE or self.game_map == None:
+      return 0
+    
+    return max(0,self.disease_ends_at - self.game_map.get_map_time())
 
   #----------------------------------------------------------------------------
   
+  ## Sets the disease for given time in ms, the map then ends the disease with a
+  #  timer (see end_disease).
+  
   def set_disease(self, disease, time_left):
     self.disease = disease
-    self.disease_time_left = time_left
+    self.hash_changed()
+    
+    if self.game_map != None:
+      self.disease_ends_at = self.game_map.get_map_time() + time_left
+      self.game_map.schedule_timer(self.disease_ends_at,GameMap.TIMER_DISEASE_END,self)
+
+  #----------------------------------------------------------------------------
+
+  def end_disease(self):
+    self.disease = Player.DISEASE_NONE
+    self.hash_changed()
+    self.info_board_update_needed = True
 
   #----------------------------------------------------------------------------
       
@@ -745,8 +1049,12 @@ class Player(Positionable):
 
   #----------------------------------------------------------------------------
 
-  def __manage_input_actions(self, input_actions, game_map, distance_to_travel):
-    moved = False         # to allow movement along only one axis at a time
+  ## Handles the input actions except for the movement itself, which is left to
+  #  react_to_inputs. Returns the direction vector the player should move in or
+  #  None if the player shouldn't move.
+
+  def __manage_input_actions(self, input_actions, game_map):
+    direction_vector = None     # to allow movement along only one axis at a time
     detonator_triggered = False
     special_was_pressed = False
     bomb_was_pressed = False
@@ -760,28 +1068,24 @@ class Player(Positionable):
       if self.disease == Player.DISEASE_REVERSE_CONTROLS:
         input_action = PlayerKeyMaps.get_opposite_action(input_action)
           
-      if not moved:
+      if direction_vector == None:
         if input_action == PlayerKeyMaps.ACTION_UP:
-          self.position[1] -= distance_to_travel
           self.state = Player.STATE_WALKING_UP
-          moved = True
+          direction_vector = (0,-1)
         elif input_action == PlayerKeyMaps.ACTION_DOWN:
-          self.position[1] += distance_to_travel
           self.state = Player.STATE_WALKING_DOWN
-          moved = True
+          direction_vector = (0,1)
         elif input_action == PlayerKeyMaps.ACTION_RIGHT:
-          self.position[0] += distance_to_travel
           self.state = Player.STATE_WALKING_RIGHT
-          moved = True
+          direction_vector = (1,0)
         elif input_action == PlayerKeyMaps.ACTION_LEFT:
-          self.position[0] -= distance_to_travel
           self.state = Player.STATE_WALKING_LEFT
-          moved = True
+          direction_vector = (-1,0)
     
       if input_action == PlayerKeyMaps.ACTION_BOMB:
         bomb_was_pressed = True
         
-        if not self.wait_for_bomb_release and self.bombs_left >= 1 and not game_map.tile_has_bomb(self.position) and not self.disease == Player.DISEASE_NO_BOMB:
+        if not self.wait_for_bomb_release and self.bombs_left >= 1 and not game_map.tile_has_bomb(self.tile_position) and not self.disease == Player.DISEASE_NO_BOMB:
           self.putting_bomb = True
     
       if input_action == PlayerKeyMaps.ACTION_BOMB_DOUBLE:  # check multibomb
@@ -808,7 +1112,7 @@ class Player(Positionable):
           if not detonator_triggered and self.has_boxing_glove:
             self.boxing = True
       
-    if moved:
+    if direction_vector != None:
       game_map.add_sound_event(SoundPlayer.SOUND_EVENT_WALK)
 
     if not special_was_pressed:
@@ -816,6 +1120,8 @@ class Player(Positionable):
       
     if not bomb_was_pressed:
       self.wait_for_bomb_release = False
+      
+    return direction_vector
 
   #----------------------------------------------------------------------------
 
@@ -857,12 +1163,25 @@ class Player(Positionable):
  
   #----------------------------------------------------------------------------
 
+  ## Resolves collisions after the player has moved by given distance from given
+  #  previous position, returns True if the player collided with something.
+
   def __resolve_collisions(self, game_map, distance_to_travel, previous_position):
-    collision_type = game_map.get_position_collision_type(self.position)
+    current_tile = self.tile_position
+    previous_tile = (previous_position[0] // Positionable.POSITION_UNITS,previous_position[1] // Positionable.POSITION_UNITS)
+    transitioning_tiles = current_tile != previous_tile
+    
+    if transitioning_tiles:
+      self.wait_for_tile_transition = False
+    
+    if game_map.tile_has_bomb(current_tile) and not transitioning_tiles:
+      return False      # standing on a bomb without transition between tiles -> let the player move
+    
+    collision_type = game_map.get_fixed_position_collision_type(self.x,self.y)
     collision_happened = False
 
     if collision_type == GameMap.COLLISION_TOTAL:
-      self.position = previous_position
+      self.set_fixed_position(previous_position[0],previous_position[1])
       collision_happened = True
     else:
       helper_mapping = {
@@ -876,11 +1195,10 @@ class Player(Positionable):
         helper_values = helper_mapping[collision_type]
         
         if self.state == helper_values[0]:           # walking against the border won't allow player to pass
-          self.position = previous_position
+          self.set_fixed_position(previous_position[0],previous_position[1])
           collision_happened = True
         elif self.state in helper_values[1]:         # walking along the border will shift the player sideways
-          self.position[0] += helper_values[2][0]
-          self.position[1] += helper_values[2][1]
+          self.set_fixed_position(self.x + helper_values[2][0],self.y + helper_values[2][1])
 
     return collision_happened
 
@@ -913,12 +1231,10 @@ class Player(Positionable):
     
     current_speed = self.speed if self.disease != Player.DISEASE_SLOW else Player.SLOW_SPEED
     
-    distance_to_travel = dt / 1000.0 * current_speed
+    distance_to_travel = int(dt * current_speed)     # in fixed point position units
     
     self.throwing_time_left = max(0,self.throwing_time_left - dt)
 
-    self.position = list(self.position)    # in case position was tuple
-
     old_state = self.state
  
     if self.state in [Player.STATE_WALKING_UP,Player.STATE_IDLE_UP]:
@@ -930,8 +1246,6 @@ class Player(Positionable):
     else:
       self.state = Player.STATE_IDLE_LEFT
 
-    previous_position = copy.copy(self.position)    # in case of collision we save the previous position
-
     self.putting_bomb = False
     self.putting_multibomb = False
     self.throwing = False
@@ -940,28 +1254,37 @@ class Player(Positionable):
     if self.disease == Player.DISEASE_DIARRHEA:
       input_actions.append((self.number,PlayerKeyMaps.ACTION_BOMB))  # inject bomb put event
 
-    self.__manage_input_actions(input_actions, game_map, distance_to_travel)
-      
-    # resolve collisions:
-    check_collisions = True
-
-    current_tile = self.get_tile_position()  
-    previous_tile = Positionable.position_to_tile(previous_position)
-    transitioning_tiles = current_tile != previous_tile
+    direction_vector = self.__manage_input_actions(input_actions, game_map)
     
-    if transitioning_tiles:
-      self.wait_for_tile_transition = False
+    # Move in steps of at most MAX_STEP_DISTANCE and resolve collisions after each
+    # one, so that long time steps can't make the player skip a wall or a bomb. If
+    # the player isn't moving, collisions are still resolved once.
+    
+    if direction_vector == None:
+      distance_to_travel = 0
     
-    if game_map.tile_has_bomb(current_tile):   # first check if the player is standing on a bomb
-      if not transitioning_tiles:              
-        check_collisions = False               # no transition between tiles -> let the player move
-
     collision_happened = False
-
-    if check_collisions:
-      collision_happened = self.__resolve_collisions(game_map, distance_to_travel, previous_position)
     
-    if self.putting_bomb and not game_map.tile_has_bomb(self.get_tile_position()) and not game_map.tile_has_teleport(self.position):
+    while True:
+      step_distance = min(distance_to_travel,Player.MAX_STEP_DISTANCE)
+      distance_to_travel -= step_distance
+      previous_position = (self.x,self.y)    # in case of collision we save the previous position
+      
+      if step_distance > 0:
+        self.set_fixed_position(self.x + direction_vector[0] * step_distance,self.y + direction_vector[1] * step_distance)
+      
+      if self.__resolve_collisions(game_map,step_distance,previous_position):
+        collision_happened = True
+        break
+      
+      if distance_to_travel <= 0:
+        break
+    
+    current_tile = self.tile_position
+    
+    game_map.update_player_index(self)     # position for this step is final now
+    
+    if self.putting_bomb and not game_map.tile_has_bomb(self.tile_position) and not game_map.tile_has_teleport(self.tile_position):
       self.lay_bomb(game_map)
     
     # check if bomb kick or box happens
@@ -1001,15 +1324,6 @@ class Player(Positionable):
         self.lay_bomb(game_map,next_tile)
         i += 1
   
-    # check disease
-    
-    if self.disease != Player.DISEASE_NONE:
-      self.disease_time_left = max(0,self.disease_time_left - dt)
-      
-      if self.disease_time_left == 0:
-        self.disease = Player.DISEASE_NONE
-        self.info_board_update_needed = True
-    
     if old_state == self.state:
       self.state_time += dt
     else:
@@ -1020,6 +1334,7 @@ class Player(Positionable):
 ## Info about a bomb's flight (when boxed or thrown).
 
 class BombFlightInfo(object):
+  __slots__ = ("total_distance_to_travel","distance_travelled","direction")
 
   #----------------------------------------------------------------------------
 
@@ -1032,6 +1347,7 @@ class BombFlightInfo(object):
 
 class Bomb(Positionable):
   ROLLING_SPEED = 4
+  MAX_ROLLING_STEP = 100          ##< longest distance (in fixed point units) a rolling bomb moves between collision checks
   FLYING_SPEED = 5
   
   BOMB_ROLLING_UP = 0
@@ -1046,11 +1362,35 @@ class Bomb(Positionable):
   BOMB_EXPLODES_IN = 3000
   EXPLODES_IN_QUICK = 800     ##< for when the player has quick explosion disease
 
+  __slots__ = ("game_map","tile_index","placed_at","explodes_at","danger_tile","danger_tiles","chain_tiles",
+    "fires_at","flame_length","player","explodes_in","detonator_time","has_spring","_movement","has_exploded",
+    "flight_info","hash_key","hash_key_outdated")
+
+  SNAPSHOT_ATTRIBUTES = ("x","y","tile_position","tick_start_position","tile_index","placed_at","explodes_at",
+    "danger_tile","danger_tiles","chain_tiles","fires_at","flame_length","explodes_in","detonator_time","has_spring",
+    "movement","has_exploded","hash_key")    ##< attributes saved by get_snapshot (danger_tiles and chain_tiles are replaced, never modified, by GameMap)
+  SNAPSHOT_GETTER = operator.attrgetter(*SNAPSHOT_ATTRIBUTES)
+  SNAPSHOT_FLIGHT_ATTRIBUTES = ("total_distance_to_travel","distance_travelled","direction")  ##< flight info values get_snapshot appends
+
+  STATE_FIELDS = (("x","i"),("y","i"),("tick_start_position","p"),("tile_index","n"),("placed_at","i"),("explodes_at","n"),
+    ("danger_tile","p"),("fires_at","n"),("flame_length","i"),("explodes_in","i"),("detonator_time","i"),("has_spring","?"),
+    ("movement","B"),("has_exploded","?"),("total_distance_to_travel","i"),("distance_travelled","d"),
+    ("direction","p"))   ##< record of the snapshot values written by GameMap.save_state (see StateRecords), the lists of tiles are written after it
+
   #----------------------------------------------------------------------------
   
   def __init__(self, player):
     super(Bomb,self).__init__()
-    self.time_of_existence = 0                       ##< for how long (in ms) the bomb has existed
+    self.game_map = None                             ##< map the bomb has been added to, it keeps the map's bomb index up to date
+    self.tile_index = None                           ##< index of the tile under which the bomb is in the map's bomb index
+    self.hash_key = None                             ##< bomb's key included in the map's state hash, None if the bomb isn't on the map, see GameMap.get_state_hash
+    self.hash_key_outdated = False                   ##< whether the map has to recompute hash_key, see GameMap.hash_key_changed
+    self.explodes_at = None                          ##< absolute map time in ms at which the bomb explodes by itself, set by the map
+    self.danger_tile = None                          ##< tile from which the bomb's flame reach (danger_tiles) was computed
+    self.danger_tiles = []                           ##< indices of tiles the bomb's flame would reach, maintained by GameMap
+    self.chain_tiles = []                            ##< indices of tiles with bombs the bomb's flame would set off, maintained by GameMap
+    self.fires_at = None                             ##< absolute map time in ms of the expected explosion, including chain reactions (see GameMap.update_bomb_fire_times)
+    self.placed_at = 0                               ##< absolute map time in ms at which the bomb was added to the map
     self.flame_length = player.get_flame_length()    ##< how far the flame will go
     self.player = player                             ##< to which player the bomb belongs
     self.explodes_in = Bomb.BOMB_EXPLODES_IN         ##< time in ms in which the bomb explodes from the time it was created (detonator_time must expire before this starts counting down)
@@ -1063,6 +1403,62 @@ class Bomb(Positionable):
     self.flight_info = BombFlightInfo()
 
   #----------------------------------------------------------------------------
+
+  ## Bomb's movement (see the BOMB_* constants).
+
+  @property
+  def movement(self):
+    return self._movement
+
+  @movement.setter
+  def movement(self, value):
+    self._movement = value
+    self.hash_changed()
+
+  #----------------------------------------------------------------------------
+
+  def position_changed(self):
+    if self.game_map != None:
+      self.game_map.update_bomb_index(self)
+      self.game_map.hash_key_changed(self)
+
+  #----------------------------------------------------------------------------
+
+  ## Has to be called whenever a value the bomb's state hash key is made from
+  #  changes (see GameMap.hash_key_changed).
+
+  def hash_changed(self):
+    if self.game_map != None:
+      self.game_map.hash_key_changed(self)
+
+  #----------------------------------------------------------------------------
+
+  ## Returns a tuple of values describing the bomb's current state including its
+  #  flight info, which can later be given to restore_snapshot.
+
+  def get_snapshot(self):
+    flight_info = self.flight_info
+    return Bomb.SNAPSHOT_GETTER(self) + (flight_info.total_distance_to_travel,flight_info.distance_travelled,flight_info.direction)
+
+  #----------------------------------------------------------------------------
+
+  ## Returns the bomb's key for the map state hash (see StateHash).
+
+  def get_hash_key(self):
+    return StateHash.key((StateHash.TAG_BOMB,self.player.number,self.x,self.y,self._movement,self.explodes_at,1 if self.has_exploded else 0))
+
+  #----------------------------------------------------------------------------
+
+  ## Sets the bomb's state from a tuple returned by get_snapshot. The map's bomb
+  #  indices aren't updated, GameMap.restore takes care of them.
+
+  def restore_snapshot(self, values):
+    for name, value in zip(Bomb.SNAPSHOT_ATTRIBUTES,values):
+      setattr(self,name,value)
+      
+    self.flight_info.total_distance_to_travel, self.flight_info.distance_travelled, self.flight_info.direction = values[-len(Bomb.SNAPSHOT_FLIGHT_ATTRIBUTES):]
+
+  #----------------------------------------------------------------------------
       
   ## Sends the bomb flying from its currents position to given tile (can be outside the map boundaries, will fly over the border from the other side).
     
@@ -1079,11 +1475,22 @@ class Bomb(Positionable):
     self.flight_info.direction[axis] = -1 if current_tile[axis] > destination_tile_coords[axis] else 1
     self.flight_info.direction = tuple(self.flight_info.direction)
 
-    destination_tile_coords = (destination_tile_coords[0] % GameMap.MAP_WIDTH,destination_tile_coords[1] % GameMap.MAP_HEIGHT)
+    destination_tile_coords = (destination_tile_coords[0] % self.game_map.get_width(),destination_tile_coords[1] % self.game_map.get_height())
     self.move_to_tile_center(destination_tile_coords)
 
   #----------------------------------------------------------------------------
 
+  ## For how long (in ms) the bomb has existed.
+
+  @property
+  def time_of_existence(self):
+    if self.game_map == None:
+      return 0
+    
+    return self.game_map.get_map_time() - self.placed_at
+
+  #----------------------------------------------------------------------------
+
   def has_detonator(self):
     return self.detonator_time > 0 and self.time_of_existence < Bomb.DETONATOR_EXPIRATION_TIME
 
@@ -1100,19 +1507,23 @@ class Bomb(Positionable):
     if not self.has_exploded:
       self.player.bomb_exploded()
       self.has_exploded = True
+      self.hash_changed()
 
 #==============================================================================
 
 ## Represents a flame coming off of an exploding bomb.
 
 class Flame(object):
+  BURNING_TIME = 1000                ##< for how long (in ms) a flame burns
+
+  __slots__ = ("player","burns_out_at","direction")
 
   #----------------------------------------------------------------------------
 
-  def __init__(self):
-    self.player = None               ##< reference to player to which the exploding bomb belonged
-    self.time_to_burnout = 1000      ##< time in ms till the flame disappears
-    self.direction = "all"           ##< string representation of the flame direction
+  def __init__(self, player=None, burns_out_at=0, direction="all"):
+    self.player = player             ##< reference to player to which the exploding bomb belonged
+    self.burns_out_at = burns_out_at ##< absolute map time in ms at which the flame disappears
+    self.direction = direction       ##< string representation of the flame direction
 
 #==============================================================================
 
@@ -1130,111 +1541,686 @@ class MapTile(object):
   SPECIAL_OBJECT_ARROW_LEFT = 6
   SPECIAL_OBJECT_LAVA = 7
 
+  __slots__ = ("coordinates","tile_grid","index","destination_teleport")
+
   #----------------------------------------------------------------------------
 
-  def __init__(self, coordinates):
-    self.kind = MapTile.TILE_FLOOR
-    self.flames = []
+  ## The tile state itself is stored in tile_grid (see TileGrid), the tile object
+  #  only provides access to it.
+
+  def __init__(self, coordinates, tile_grid):
     self.coordinates = coordinates
-    self.to_be_destroyed = False     ##< Flag that marks the tile to be destroyed after the flames go out.
-    self.item = None                 ##< Item that's present on the file
-    self.special_object = None       ##< special object present on the tile, like trampoline or teleport
+    self.tile_grid = tile_grid
+    self.index = tile_grid.tile_index(coordinates)
     self.destination_teleport = None ##< in case of special_object equal to SPECIAL_OBJECT_TELEPORT_A or SPECIAL_OBJECT_TELEPORT_B holds the destionation teleport tile coordinates
 
-  def shouldnt_walk(self):
-    return self.kind in [MapTile.TILE_WALL,MapTile.TILE_BLOCK] or len(self.flames) >= 1 or self.special_object == MapTile.SPECIAL_OBJECT_LAVA
+  #----------------------------------------------------------------------------
 
-#==============================================================================
+  @property
+  def kind(self):
+    return self.tile_grid.kinds[self.index]
 
-## Holds and manipulates the map data including the players, bombs etc.
+  @kind.setter
+  def kind(self, value):
+    self.tile_grid.kinds[self.index] = value
+    self.tile_grid.update_walkability(self.index)
+    self.tile_grid.update_free_floor(self.index)
+    self.tile_grid.update_tile_hash(self.index)
 
-class GameMap(object):
-  MAP_WIDTH = 15
-  MAP_HEIGHT = 11
-  WALL_MARGIN_HORIZONTAL = 0.2
-  WALL_MARGIN_VERTICAL = 0.4
-  
-  COLLISION_BORDER_UP = 0       ##< position is inside upper border with non-walkable tile
-  COLLISION_BORDER_RIGHT = 1    ##< position is inside right border with non-walkable tile
-  COLLISION_BORDER_DOWN = 2     ##< position is inside bottom border with non-walkable tile
-  COLLISION_BORDER_LEFT = 3     ##< position is inside left border with non-walkable tile
-  COLLISION_TOTAL = 4           ##< position is inside non-walkable tile
-  COLLISION_NONE = 5            ##< no collision
+  #----------------------------------------------------------------------------
 
-  ITEM_BOMB = 0
-  ITEM_FLAME = 1
-  ITEM_SUPERFLAME = 2
-  ITEM_SPEEDUP = 3
-  ITEM_DISEASE = 4
-  ITEM_RANDOM = 5
-  ITEM_SPRING = 6
-  ITEM_SHOE = 7
-  ITEM_MULTIBOMB = 8
-  ITEM_BOXING_GLOVE = 9
-  ITEM_DETONATOR = 10
-  ITEM_THROWING_GLOVE = 11
-  
-  SAFE_DANGER_VALUE = 5000     ##< time in ms, used in danger map to indicate safe tile
-  
-  GIVE_AWAY_DELAY = 3000       ##< after how many ms the items of dead players will be given away
-  
-  START_GAME_AFTER = 2500      ##< delay in ms before the game begins
-  
-  STATE_WAITING_TO_PLAY = 0    ##< players can't do anything yet
-  STATE_PLAYING = 1            ##< game is being played
-  STATE_FINISHING = 2          ##< game is over but the map is still being updated for a while after
-  STATE_GAME_OVER = 3          ##< the game is definitely over and should no longer be updated
-  
-  EARTHQUAKE_DURATION = 10000
+  ## Flames on the tile (list of Flame objects).
+
+  @property
+  def flames(self):
+    return self.tile_grid.flames[self.index]
 
   #----------------------------------------------------------------------------
-  
-  ## Initialises a new map from map_data (string) and a PlaySetup object.
 
-  def __init__(self, map_data, play_setup, game_number, max_games, all_items_cheat=False):
-    # make the tiles array:
-    self.danger_map_is_up_to_date = False                    # to regenerate danger map only when needed
-    self.tiles = []
-    self.starting_positions = [(0.0,0.0) for i in range(10)] # starting position for each player
+  ## Flag that marks the tile to be destroyed after the flames go out.
 
-    map_data = map_data.replace(" ","").replace("\n","")     # get rid of white characters
+  @property
+  def to_be_destroyed(self):
+    return self.tile_grid.to_be_destroyed[self.index] != 0
 
-    string_split = map_data.split(";")
+  @to_be_destroyed.setter
+  def to_be_destroyed(self, value):
+    self.tile_grid.to_be_destroyed[self.index] = 1 if value else 0
+    self.tile_grid.update_walkability(self.index)
+    self.tile_grid.update_tile_hash(self.index)
 
-    self.environment_name = string_split[0]
+  #----------------------------------------------------------------------------
 
-    self.end_game_at = -1                          ##< time at which the map should go to STATE_GAME_OVER state
-    self.start_game_at = GameMap.START_GAME_AFTER
-    self.win_announced = False
-    self.announce_win_at = -1
-    self.state = GameMap.STATE_WAITING_TO_PLAY
-    self.winner_team = -1                          ##< if map state is GameMap.STATE_GAME_OVER, this holds the winning team (-1 = draw)
+  ## Item that's present on the tile (None = no item).
 
-    self.game_number = game_number
-    self.max_games = max_games
+  @property
+  def item(self):
+    return TileGrid.from_stored_value(self.tile_grid.items[self.index])
 
-    self.earthquake_time_left = 0
+  @item.setter
+  def item(self, value):
+    self.tile_grid.items[self.index] = TileGrid.to_stored_value(value)
+    self.tile_grid.update_free_floor(self.index)
+    self.tile_grid.update_tile_hash(self.index)
 
-    self.time_from_start = 0                       ##< time in ms from the start of the map, the time increases with each update (so time spent in game menu is excluded)
+  #----------------------------------------------------------------------------
 
-    block_tiles = []
+  ## Special object present on the tile, like trampoline or teleport (None = no object).
 
-    line = -1
-    column = 0
-    
-    teleport_a_tile = None       # helper variables used to pair teleports
+  @property
+  def special_object(self):
+    return TileGrid.from_stored_value(self.tile_grid.special_objects[self.index])
+
+  @special_object.setter
+  def special_object(self, value):
+    self.tile_grid.special_objects[self.index] = TileGrid.to_stored_value(value)
+    self.tile_grid.update_free_floor(self.index)
+
+  #----------------------------------------------------------------------------
+
+  def shouldnt_walk(self):
+    return self.tile_grid.tile_shouldnt_walk(self.index)
+
+#==============================================================================
+
+## State of all map tiles stored as flat arrays (structure of arrays) indexed by
+#  y * width + x, which makes queries and passes over the whole map cheaper than
+#  going through the MapTile objects.
+
+class TileGrid(object):
+  NO_VALUE = -1                                         ##< stored instead of None (no item, no special object)
+  DIRECTION_INCREMENTS = ((0,-1),(1,0),(0,1),(-1,0))    ##< tile coordinate increments for directions up, right, down, left
+
+  #----------------------------------------------------------------------------
+
+  def __init__(self, width, height):
+    self.width = width
+    self.height = height
+    
+    number_of_tiles = width * height
+    
+    self.kinds = array.array("b",[MapTile.TILE_FLOOR]) * number_of_tiles
+    self.special_objects = array.array("b",[TileGrid.NO_VALUE]) * number_of_tiles
+    self.items = array.array("b",[TileGrid.NO_VALUE]) * number_of_tiles
+    self.to_be_destroyed = array.array("b",[0]) * number_of_tiles
+    self.flames = [[] for i in range(number_of_tiles)]  ##< list of flames for each tile
+    self.bombs = [[] for i in range(number_of_tiles)]   ##< list of bombs (not flying) on each tile, maintained by GameMap
+    self.players = [[] for i in range(number_of_tiles)] ##< list of players (alive, not in air) on each tile, maintained by GameMap
+    self.danger_bombs = [[] for i in range(number_of_tiles)] ##< list of bombs whose flame would reach each tile, maintained by GameMap
+    self.active_tiles = set()                           ##< indices of tiles that have flames or are to be destroyed, only these need updating
+    self.padded_width = width + 2                       ##< width of the walkable bitmap, which has a border of unwalkable tiles around the map
+    self.walkable = array.array("b",[0]) * (self.padded_width * (height + 2))  ##< 1 for walkable tiles, indexed by padded_index, kept up to date by update_walkability
+    
+    for y in range(height):
+      for x in range(width):
+        self.walkable[self.padded_index(y * width + x)] = 1
+        
+    self.free_floor_tiles = list(range(number_of_tiles))  ##< indices of floor tiles with no special object, item or player (in no particular order), kept up to date by update_free_floor
+    self.free_floor_positions = array.array("i",range(number_of_tiles))  ##< position of each tile in free_floor_tiles, -1 for tiles that aren't there
+    
+    self.flame_rays = [[None for i in range(number_of_tiles)] for direction in (0,1,2,3)]  ##< lazily computed flame rays for each direction and tile, see get_flame_ray
+
+    self.tile_hash_keys = [self.get_tile_hash_key(index) for index in range(number_of_tiles)]  ##< state hash key of each tile, kept up to date by update_tile_hash
+    self.state_hash = sum(self.tile_hash_keys) & StateHash.MASK   ##< sum of the keys of the tiles and flames, see StateHash
+
+  #----------------------------------------------------------------------------
+
+  @staticmethod
+  def to_stored_value(value):
+    return TileGrid.NO_VALUE if value == None else value
+
+  #----------------------------------------------------------------------------
+
+  @staticmethod
+  def from_stored_value(value):
+    return None if value == TileGrid.NO_VALUE else value
+
+  #----------------------------------------------------------------------------
+
+  def get_number_of_tiles(self):
+    return len(self.kinds)
+
+  #----------------------------------------------------------------------------
+
+  ## Converts (integer) tile coordinates to index into the arrays.
+
+  def tile_index(self, tile_coordinates):
+    return tile_coordinates[1] * self.width + tile_coordinates[0]
+
+  #----------------------------------------------------------------------------
+
+  def index_to_coordinates(self, index):
+    return (index % self.width,index // self.width)
+
+  #----------------------------------------------------------------------------
+
+  def tile_shouldnt_walk(self, index):
+    return self.kinds[index] != MapTile.TILE_FLOOR or len(self.flames[index]) >= 1 or self.special_objects[index] == MapTile.SPECIAL_OBJECT_LAVA
+
+  #----------------------------------------------------------------------------
+
+  ## Converts a tile index to an index into the walkable bitmap. Thanks to the
+  #  border the neighbours of any map tile can be looked up in the bitmap without
+  #  checking the map bounds.
+
+  def padded_index(self, index):
+    return index + 2 * (index // self.width) + self.padded_width + 1
+
+  #----------------------------------------------------------------------------
+
+  def tile_is_walkable(self, index):
+    return self.walkable[self.padded_index(index)] != 0
+
+  #----------------------------------------------------------------------------
+
+  ## Recomputes the walkable bitmap value for given tile, this has to be called
+  #  whenever the tile kind, to be destroyed flag or the bombs on the tile change.
+
+  def update_walkability(self, index):
+    self.walkable[self.padded_index(index)] = 1 if (self.kinds[index] == MapTile.TILE_FLOOR or self.to_be_destroyed[index]) and len(self.bombs[index]) == 0 else 0
+
+  #----------------------------------------------------------------------------
+
+  ## Adds given tile to or removes it from free_floor_tiles, this has to be called
+  #  whenever the tile kind, special object, item or players on the tile change.
+  #  Tiles are removed by moving the last tile of the list in their place, so
+  #  both adding and removing take constant time.
+
+  def update_free_floor(self, index):
+    is_free = (self.kinds[index] == MapTile.TILE_FLOOR and self.special_objects[index] == TileGrid.NO_VALUE and
+      self.items[index] == TileGrid.NO_VALUE and len(self.players[index]) == 0)
+    
+    position = self.free_floor_positions[index]
+    
+    if is_free and position < 0:
+      self.free_floor_positions[index] = len(self.free_floor_tiles)
+      self.free_floor_tiles.append(index)
+    elif not is_free and position >= 0:
+      last_index = self.free_floor_tiles.pop()
+      
+      if last_index != index:
+        self.free_floor_tiles[position] = last_index
+        self.free_floor_positions[last_index] = position
+        
+      self.free_floor_positions[index] = -1
+
+  #----------------------------------------------------------------------------
+
+  def get_tile_hash_key(self, index):
+    return StateHash.key((StateHash.TAG_TILE,index,self.kinds[index],self.items[index],self.to_be_destroyed[index]))
+
+  #----------------------------------------------------------------------------
+
+  @staticmethod
+  def get_flame_hash_key(index, flame):
+    return StateHash.key((StateHash.TAG_FLAME,index,flame.burns_out_at))
+
+  #----------------------------------------------------------------------------
+
+  ## Updates the state hash for given tile, this has to be called whenever the
+  #  tile kind, item or to be destroyed flag change.
+
+  def update_tile_hash(self, index):
+    key = self.get_tile_hash_key(index)
+    self.state_hash = (self.state_hash - self.tile_hash_keys[index] + key) & StateHash.MASK
+    self.tile_hash_keys[index] = key
+
+  #----------------------------------------------------------------------------
+
+  ## Computes the hash of the tiles and flames from scratch, it's always equal to
+  #  state_hash (this is meant for checking).
+
+  def compute_state_hash(self):
+    result = 0
+    
+    for index in range(len(self.kinds)):
+      result += self.get_tile_hash_key(index)
+      
+      for flame in self.flames[index]:
+        result += TileGrid.get_flame_hash_key(index,flame)
+        
+    return result & StateHash.MASK
+
+  #----------------------------------------------------------------------------
+
+  ## Removes the flames at the beginning of given tile's flame list.
+
+  def remove_flames(self, index, count):
+    flames = self.flames[index]
+    
+    for flame in flames[:count]:
+      self.state_hash = (self.state_hash - TileGrid.get_flame_hash_key(index,flame)) & StateHash.MASK
+      
+    del flames[:count]
+
+  #----------------------------------------------------------------------------
+
+  ## Returns a tuple of indices of tiles a flame going from given tile in given
+  #  direction (0 = up, 1 = right, 2 = down, 3 = left) would go through if it was
+  #  infinitely long, i.e. the tiles up to the map edge or the first wall, or
+  #  including the first block. The rays are computed when first needed and only
+  #  change when a block is destroyed (see block_destroyed).
+
+  def get_flame_ray(self, index, direction):
+    ray = self.flame_rays[direction][index]
+    
+    if ray == None:
+      ray = []
+      x, y = self.index_to_coordinates(index)
+      increment = TileGrid.DIRECTION_INCREMENTS[direction]
+      
+      while True:
+        x += increment[0]
+        y += increment[1]
+        
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+          break
+        
+        ray_index = y * self.width + x
+        
+        if self.kinds[ray_index] == MapTile.TILE_WALL:
+          break
+        
+        ray.append(ray_index)
+        
+        if self.kinds[ray_index] == MapTile.TILE_BLOCK:
+          break
+        
+      ray = tuple(ray)
+      self.flame_rays[direction][index] = ray
+      
+    return ray
+
+  #----------------------------------------------------------------------------
+
+  ## Turns the block at given tile into floor and invalidates the flame rays that
+  #  may have been stopped by it.
+
+  def block_destroyed(self, index):
+    self.kinds[index] = MapTile.TILE_FLOOR
+    self.update_walkability(index)
+    self.update_free_floor(index)
+    self.update_tile_hash(index)
+    self.invalidate_flame_rays(index)
+
+  #----------------------------------------------------------------------------
+
+  ## Invalidates the flame rays that may go through given tile (those in the same
+  #  row and column), this has to be called whenever the tile kind changes.
+
+  def invalidate_flame_rays(self, index):
+    x, y = self.index_to_coordinates(index)
+    
+    for i in range(y * self.width,(y + 1) * self.width):
+      self.flame_rays[1][i] = None
+      self.flame_rays[3][i] = None
+    
+    for i in range(x,len(self.kinds),self.width):
+      self.flame_rays[0][i] = None
+      self.flame_rays[2][i] = None
+
+  #----------------------------------------------------------------------------
+
+  def add_flame(self, index, flame):
+    self.flames[index].append(flame)
+    self.active_tiles.add(index)
+    self.state_hash = (self.state_hash + TileGrid.get_flame_hash_key(index,flame)) & StateHash.MASK
+
+#==============================================================================
+
+## Packs and reads the records of a match state saved by GameMap.save_state. A
+#  record is described by a tuple of (attribute name, field kind) pairs, where
+#  the kind is a struct format character or "n" for an integer or None (stored
+#  as -1) or "p" for a pair of integers or None (stored with a flag). Reading
+#  checks that the data isn't cut off and that the counts and indices are within
+#  their limits, so that a damaged or crafted state (e.g. from a shared replay
+#  file) can only make the loading fail with a ValueError.
+
+class StateRecords(object):
+  FIELD_FORMATS = {"i": "i", "I": "I", "B": "B", "?": "?", "d": "d", "n": "i", "p": "?ii"}
+
+  #----------------------------------------------------------------------------
+
+  def __init__(self, data):
+    self.data = data
+    self.position = 0    ##< where in the data the next value is
+
+  #----------------------------------------------------------------------------
+
+  ## Returns the struct format of given record fields.
+
+  @staticmethod
+  def get_format(fields):
+    return "<" + "".join([StateRecords.FIELD_FORMATS[kind] for name, kind in fields])
+
+  #----------------------------------------------------------------------------
+
+  ## Packs the values (dict of attribute name -> value) of given record fields.
+
+  @staticmethod
+  def pack(fields, values):
+    result = []
+    
+    for name, kind in fields:
+      value = values[name]
+      
+      if kind == "n":
+        result.append(-1 if value == None else value)
+      elif kind == "p":
+        result.extend((False,0,0) if value == None else (True,value[0],value[1]))
+      else:
+        result.append(value)
+    
+    return struct.pack(StateRecords.get_format(fields),*result)
+
+  #----------------------------------------------------------------------------
+
+  ## Packs given integers, each in given struct format, preceded by their count.
+
+  @staticmethod
+  def pack_list(value_format, values):
+    return struct.pack("<I" + value_format * len(values),len(values),*values)
+
+  #----------------------------------------------------------------------------
+
+  ## Returns the bytes of given array.array in little endian byte order.
+
+  @staticmethod
+  def array_to_bytes(values):
+    if sys.byteorder == "big":
+      values = values[:]
+      values.byteswap()
+    
+    if hasattr(values,"tobytes"):
+      return values.tobytes()
+    
+    return values.tostring()     # Python 2 arrays only have the old name
+
+  #----------------------------------------------------------------------------
+
+  def check(self, condition, what):
+    if not condition:
+      raise ValueError("invalid match state: " + what)
+
+  #----------------------------------------------------------------------------
+
+  def read(self, struct_format):
+    size = struct.calcsize(struct_format)
+    self.check(self.position + size <= len(self.data),"the data is cut off")
+    result = struct.unpack_from(struct_format,self.data,self.position)
+    self.position += size
+    return result
+
+  #----------------------------------------------------------------------------
+
+  ## Reads a record with given fields and returns its values as a dict of
+  #  attribute name -> value.
+
+  def read_record(self, fields):
+    values = self.read(StateRecords.get_format(fields))
+    result = {}
+    i = 0
+    
+    for name, kind in fields:
+      if kind == "n":
+        result[name] = None if values[i] == -1 else values[i]
+        i += 1
+      elif kind == "p":
+        result[name] = (values[i + 1],values[i + 2]) if values[i] else None
+        i += 3
+      else:
+        result[name] = values[i]
+        i += 1
+    
+    return result
+
+  #----------------------------------------------------------------------------
+
+  def read_count(self):
+    return self.read("<I")[0]
+
+  #----------------------------------------------------------------------------
+
+  ## Reads an integer in given struct format and checks that it is in given
+  #  range (minimum inclusive, limit exclusive).
+
+  def read_index(self, value_format, limit, minimum=0):
+    result = self.read("<" + value_format)[0]
+    self.check(minimum <= result < limit,"value " + str(result) + " out of range")
+    return result
+
+  #----------------------------------------------------------------------------
+
+  ## Reads a list written by pack_list and checks that all its values are in
+  #  given range.
+
+  def read_list(self, value_format, limit, minimum=0):
+    count = self.read_count()
+    self.check(self.position + count * struct.calcsize("<" + value_format) <= len(self.data),"the data is cut off")
+    result = list(self.read("<" + value_format * count))
+    self.check(all([minimum <= value < limit for value in result]),"value out of range")
+    return result
+
+  #----------------------------------------------------------------------------
+
+  ## Reads the contents of an array.array with given type code and length saved
+  #  by array_to_bytes.
+
+  def read_array(self, typecode, length):
+    result = array.array(typecode)
+    size = result.itemsize * length
+    self.check(self.position + size <= len(self.data),"the data is cut off")
+    data = self.data[self.position:self.position + size]
+    
+    if hasattr(result,"frombytes"):
+      result.frombytes(data)
+    else:
+      result.fromstring(data)    # Python 2
+      
+    self.position += size
+    
+    if sys.byteorder == "big":
+      result.byteswap()
+    
+    return result
+
+#==============================================================================
+
+## Snapshot of the whole state of a match, made by GameMap.snapshot. It must be
+#  treated as immutable so that it can be restored any number of times. The tile
+#  state is stored as flat array copies and the players and bombs as tuples of
+#  their attribute values, while the objects themselves (and the flames, which
+#  never change) are shared with the map, so a snapshot can only be restored to
+#  the map it was taken from.
+
+class GameMapSnapshot(object):
+  __slots__ = ("map_values","random_state","timers","flame_burnouts","team_alive_counts","alive_players",
+    "player_values","bombs","bomb_values","kinds","items","to_be_destroyed","walkable","free_floor_tiles",
+    "free_floor_positions","active_tiles","flames","tile_players","tile_bombs","tile_hash_keys","state_hash",
+    "entity_hash")
+
+  #----------------------------------------------------------------------------
+
+  def __init__(self):
+    self.map_values = ()            ##< values of GameMap.SNAPSHOT_ATTRIBUTES
+    self.random_state = None        ##< state of the map's random number generator
+    self.timers = ()                ##< copy of the timer heap
+    self.flame_burnouts = ()        ##< (time, tile indices) pairs
+    self.team_alive_counts = ()     ##< (team number, players alive) pairs
+    self.alive_players = ()
+    self.player_values = ()         ##< Player.get_snapshot() for each player
+    self.bombs = ()                 ##< bombs on the map
+    self.bomb_values = ()           ##< Bomb.get_snapshot() for each bomb on the map
+    self.kinds = None               ##< copies of TileGrid arrays
+    self.items = None
+    self.to_be_destroyed = None
+    self.walkable = None
+    self.free_floor_tiles = ()
+    self.free_floor_positions = None
+    self.active_tiles = frozenset()
+    self.flames = ()                ##< (tile index, flames) pairs for tiles with flames
+    self.tile_players = ()          ##< (tile index, players) pairs for tiles with players
+    self.tile_bombs = ()            ##< (tile index, bombs) pairs for tiles with bombs
+    self.tile_hash_keys = ()        ##< copy of TileGrid.tile_hash_keys
+    self.state_hash = 0             ##< TileGrid.state_hash
+    self.entity_hash = 0            ##< GameMap.entity_hash, the keys of the players and bombs are in their values
+
+#==============================================================================
+
+## Holds and manipulates the map data including the players, bombs etc.
+
+class GameMap(object):
+  MAP_WIDTH = 15               ##< default map width, used for maps that don't specify their size
+  MAP_HEIGHT = 11              ##< default map height
+  MAX_MAP_SIZE = 128           ##< maximum width and height of a map given in its header
+  WALL_MARGIN_HORIZONTAL = 0.2
+  WALL_MARGIN_VERTICAL = 0.4
+  WALL_MARGIN_HORIZONTAL_FIXED = Positionable.to_fixed(WALL_MARGIN_HORIZONTAL)   ##< margins in fixed point units
+  WALL_MARGIN_VERTICAL_FIXED = Positionable.to_fixed(WALL_MARGIN_VERTICAL)
+  
+  COLLISION_BORDER_UP = 0       ##< position is inside upper border with non-walkable tile
+  COLLISION_BORDER_RIGHT = 1    ##< position is inside right border with non-walkable tile
+  COLLISION_BORDER_DOWN = 2     ##< position is inside bottom border with non-walkable tile
+  COLLISION_BORDER_LEFT = 3     ##< position is inside left border with non-walkable tile
+  COLLISION_TOTAL = 4           ##< position is inside non-walkable tile
+  COLLISION_NONE = 5            ##< no collision
+
+  ITEM_BOMB = 0
+  ITEM_FLAME = 1
+  ITEM_SUPERFLAME = 2
+  ITEM_SPEEDUP = 3
+  ITEM_DISEASE = 4
+  ITEM_RANDOM = 5
+  ITEM_SPRING = 6
+  ITEM_SHOE = 7
+  ITEM_MULTIBOMB = 8
+  ITEM_BOXING_GLOVE = 9
+  ITEM_DETONATOR = 10
+  ITEM_THROWING_GLOVE = 11
+  
+  SAFE_DANGER_VALUE = 5000     ##< time in ms, used in danger map to indicate safe tile
+
+  FLAME_END_DIRECTIONS = ("up","right","down","left")   ##< flame end directions for ray directions (see TileGrid.get_flame_ray)
+  FLAME_DIRECTIONS = ("all","horizontal","vertical") + FLAME_END_DIRECTIONS  ##< all flame directions, numbered by their positions in saved states
+
+  TIMER_BOMB_EXPLOSION = 0     ##< timer event kinds, see schedule_timer
+  TIMER_FLAME_BURNOUT = 1
+  TIMER_DISEASE_END = 2
+  TIMER_GIVE_AWAY = 3
+  
+  GIVE_AWAY_DELAY = 3000       ##< after how many ms the items of dead players will be given away
+  
+  START_GAME_AFTER = 2500      ##< delay in ms before the game begins
+  
+  STATE_WAITING_TO_PLAY = 0    ##< players can't do anything yet
+  STATE_PLAYING = 1            ##< game is being played
+  STATE_FINISHING = 2          ##< game is over but the map is still being updated for a while after
+  STATE_GAME_OVER = 3          ##< the game is definitely over and should no longer be updated
+  
+  EARTHQUAKE_DURATION = 10000
+  
+  MAX_PLAYERS = 64             ##< maximum number of players (slots in PlaySetup), maps only give starting positions for the first 10
+  MAX_SEED = 2 ** 31 - 1
+  RANDOM_SUBSTREAMS = 1024     ##< how many random substreams each map seed provides
+
+  SNAPSHOT_ATTRIBUTES = ("time_from_start","state","start_game_at","end_game_at","announce_win_at","win_announced",
+    "winner_team","earthquake_ends_at","timer_counter","number_of_blocks","create_disease_cloud_at")   ##< map attributes saved by snapshot
+  SNAPSHOT_GETTER = operator.attrgetter(*SNAPSHOT_ATTRIBUTES)
+
+  STATE_FIELDS = (("time_from_start","i"),("state","B"),("start_game_at","i"),("end_game_at","i"),("announce_win_at","i"),
+    ("win_announced","?"),("winner_team","i"),("earthquake_ends_at","i"),("timer_counter","I"),("number_of_blocks","i"),
+    ("create_disease_cloud_at","i"))   ##< record of the map attributes written by save_state, see StateRecords
+  STATE_RANDOM_FORMAT = "<625I?d"      ##< Mersenne Twister state (624 words and the position) and the cached gauss value
+  STATE_FLAME_FORMAT = "<biB"          ##< player number (-1 = none), burn out time, direction number (see FLAME_DIRECTIONS)
+  STATE_TIMER_FORMAT = "<iIBI"         ##< time, counter, kind, bomb or player number (0 for other kinds), followed by a list of given away items
+
+  #----------------------------------------------------------------------------
+  
+  ## Initialises a new map from map_data (string) and a PlaySetup object. A headless
+  #  map doesn't produce any sound or animation events, so it can be simulated
+  #  without a display (see Simulation). All randomness of the match comes from
+  #  the seed (random if None), so the same map, setup, seed and inputs always
+  #  give the same match.
+
+  def __init__(self, map_data, play_setup, game_number, max_games, all_items_cheat=False, headless=False, seed=None):
+    self.headless = headless
+    self.map_data = map_data                                 ##< the map data the map was made from (e.g. for replays)
+    self.all_items_cheat = all_items_cheat
+    self.bomb_fire_times_up_to_date = False                  ##< whether Bomb.fires_at is valid for all bombs
+    self.bomb_fire_times_computed_at = -1                    ##< map time at which Bomb.fires_at were computed
+    self.detonator_bombs_on_map = False                      ##< whether there were detonator bombs at the last fire time computation
+    self.seed = seed if seed != None else random.randint(0,GameMap.MAX_SEED)
+    self.random = SeededRandom(self.seed)                  ##< random number generator of the map and its players
+    
+    map_data = map_data.replace(" ","").replace("\n","")     # get rid of white characters
+
+    string_split = map_data.split(";")
+
+    # the header can optionally specify the map size, e.g. "env1:31x21"
+    
+    header = string_split[0].split(":")
+
+    self.environment_name = header[0]
+    
+    if len(header) > 1:
+      map_size = header[1].lower().split("x")
+      
+      if len(map_size) != 2 or not map_size[0].isdigit() or not map_size[1].isdigit():
+        raise ValueError("invalid map size in the map header: " + header[1])
+      
+      self.width = int(map_size[0])                          ##< map width in tiles
+      self.height = int(map_size[1])                         ##< map height in tiles
+      
+      if not (1 <= self.width <= GameMap.MAX_MAP_SIZE and 1 <= self.height <= GameMap.MAX_MAP_SIZE):
+        raise ValueError("map size " + header[1] + " is out of range (1 to " + str(GameMap.MAX_MAP_SIZE) + " tiles in each direction)")
+    else:
+      self.width = GameMap.MAP_WIDTH
+      self.height = GameMap.MAP_HEIGHT
+
+    if len(string_split) < 4 or len(string_split[3]) != self.width * self.height:
+      raise ValueError("the map has " + (str(len(string_split[3])) if len(string_split) >= 4 else "no") + " tiles, its size is " + str(self.width) + "x" + str(self.height))
+
+    # make the tiles array:
+    self.tile_grid = TileGrid(self.width,self.height)        ##< holds the state of the tiles
+    self.tiles = []                                          ##< 2D array of MapTile objects (views into tile_grid)
+    self.starting_positions = [None for i in range(max(10,len(play_setup.get_slots())))]  # starting position for each player, None = not given by the map
+
+    self.end_game_at = -1                          ##< time at which the map should go to STATE_GAME_OVER state
+    self.start_game_at = GameMap.START_GAME_AFTER
+    self.win_announced = False
+    self.announce_win_at = -1
+    self.state = GameMap.STATE_WAITING_TO_PLAY
+    self.winner_team = -1                          ##< if map state is GameMap.STATE_GAME_OVER, this holds the winning team (-1 = draw)
+
+    self.game_number = game_number
+    self.max_games = max_games
+
+    self.earthquake_ends_at = 0                    ##< absolute map time in ms at which the earthquake ends
+
+    self.timers = []                               ##< heap of scheduled events in format (time, sequence number, timer kind, payload), see schedule_timer
+    self.timer_counter = 0                         ##< sequence number for the next timer, keeps the order of events deterministic
+    self.flame_burnouts = {}                       ##< maps burnout times to lists of indices of tiles with flames burning out at that time, see bomb_explodes
+
+    self.time_from_start = 0                       ##< time in ms from the start of the map, the time increases with each update (so time spent in game menu is excluded)
+
+    block_tiles = []
+
+    line = -1
+    column = 0
+    
+    teleport_a_tile = None       # helper variables used to pair teleports
     teleport_b_tile = None
     self.number_of_blocks = 0    ##< says how many block tiles there are currently on the map
 
     for i in range(len(string_split[3])):
       tile_character = string_split[3][i]
 
-      if i % GameMap.MAP_WIDTH == 0: # add new row
+      if i % self.width == 0: # add new row
         line += 1
         column = 0
         self.tiles.append([])
 
-      tile = MapTile((column,line))
+      tile = MapTile((column,line),self.tile_grid)
 
       if tile_character == "x":
         tile.kind = MapTile.TILE_BLOCK
@@ -1294,25 +2280,41 @@ class GameMap(object):
     # place items under the block tiles:
     
     for i in range(len(string_split[2])):
-      random_tile = random.choice(block_tiles)
+      random_tile = self.random.choice(block_tiles)
       random_tile.item = self.letter_to_item(string_split[2][i])
       block_tiles.remove(random_tile)
 
-    # init danger map:
-    
-    self.danger_map = [[GameMap.SAFE_DANGER_VALUE for i in range(GameMap.MAP_WIDTH)] for j in range(GameMap.MAP_HEIGHT)]  ##< 2D array of times in ms for each square that
-       
     # initialise players:
 
     self.players = []                      ##< list of players in the game
     self.players_by_numbers = {}           ##< mapping of numbers to players
     self.players_by_numbers[-1] = None
+    self.entity_hash = 0                   ##< sum of the state hash keys of the players and bombs on the map, see get_state_hash
+    self.outdated_hash_keys = []           ##< players and bombs whose hash keys have to be recomputed, see hash_key_changed
 
     player_slots = play_setup.get_slots()
 
+    # players without a starting position given by the map (e.g. players above 10)
+    # start on random free floor tiles:
+    
+    players_without_position = [i for i in range(len(player_slots)) if player_slots[i] != None and self.starting_positions[i] == None]
+    
+    if len(players_without_position) > 0:
+      taken_tiles = set([self.tile_grid.tile_index((int(position[0]),int(position[1]))) for position in self.starting_positions if position != None])
+      possible_tiles = sorted([index for index in self.tile_grid.free_floor_tiles if not index in taken_tiles])
+      
+      if len(possible_tiles) < len(players_without_position):
+        raise ValueError("the map only has " + str(len(possible_tiles)) + " free tiles for " + str(len(players_without_position)) + " players without a starting position")
+      
+      for i, index in zip(players_without_position,self.random.sample(possible_tiles,len(players_without_position))):
+        coordinates = self.tile_grid.index_to_coordinates(index)
+        self.starting_positions[i] = (float(coordinates[0]),float(coordinates[1]))
+
     for i in range(len(player_slots)):
       if player_slots[i] != None:
         new_player = Player()
+        new_player.game_map = self
+        new_player.random = self.random
         new_player.set_number(i)
         new_player.set_team_number(player_slots[i][1])
         new_player.move_to_tile_center(self.starting_positions[i])
@@ -1321,6 +2323,12 @@ class GameMap(object):
       else:
         self.players_by_numbers[i] = None
         
+    self.alive_players = list(self.players)  ##< players that are alive, in the same order as in self.players, see player_killed
+    self.team_alive_counts = {}            ##< maps team numbers to the numbers of their players alive, teams with no players alive aren't present, see player_killed
+    
+    for player in self.players:
+      self.team_alive_counts[player.get_team_number()] = self.team_alive_counts.get(player.get_team_number(),0) + 1
+        
     # give players starting items:
     
     start_items_string = string_split[1] if not all_items_cheat else "bbbbbFkxtsssssmp"
@@ -1333,27 +2341,575 @@ class GameMap(object):
         
         player.give_item(item_to_give)
       
-      self.player_starting_items.append(item_to_give)
-        
-    self.bombs = []                   ##< bombs on the map
-    self.sound_events = []            ##< list of currently happening sound event (see SoundPlayer class)
-    self.animation_events = []        ##< list of animation events, tuples in format (animation_event, coordinates)
-    self.items_to_give_away = []      ##< list of tuples in format (time_of_giveaway, list_of_items)
+      self.player_starting_items.append(item_to_give)
+        
+    self.bombs = []                   ##< bombs on the map
+    self.sound_events = []            ##< list of currently happening sound event (see SoundPlayer class)
+    self.animation_events = []        ##< list of animation events, tuples in format (animation_event, map coordinates, pixel offset)
+
+    self.create_disease_cloud_at = 0  ##< at what time (in ms) the disease clouds should be released
+
+    self.__recompute_hash_keys()
+
+  #----------------------------------------------------------------------------
+
+  def get_starting_items(self):
+    return self.player_starting_items
+
+  #----------------------------------------------------------------------------
+
+  def get_seed(self):
+    return self.seed
+
+  #----------------------------------------------------------------------------
+
+  ## Creates a new random number generator derived from the map seed, so that each
+  #  user of randomness (such as the AI of given player) can have its own stream
+  #  that isn't affected by the others. substream_number must be less than
+  #  RANDOM_SUBSTREAMS.
+
+  def get_random_substream(self, substream_number):
+    return SeededRandom(self.seed * GameMap.RANDOM_SUBSTREAMS + substream_number + 1)
+
+  #----------------------------------------------------------------------------
+
+  ## Captures the current state of the match into a GameMapSnapshot that can be
+  #  given to restore later, e.g. to look ahead or roll back the match. Sounds,
+  #  animations and other things that only matter for the rendering aren't saved.
+
+  def snapshot(self):
+    tile_grid = self.tile_grid
+    result = GameMapSnapshot()
+    
+    self.get_state_hash()             # brings the hash keys of the players and bombs up to date
+    
+    result.map_values = GameMap.SNAPSHOT_GETTER(self)
+    result.random_state = self.random.getstate()
+    result.timers = tuple(self.timers)
+    result.flame_burnouts = tuple([(time,tuple(indices)) for time, indices in self.flame_burnouts.items()])
+    result.team_alive_counts = tuple(self.team_alive_counts.items())
+    result.alive_players = tuple(self.alive_players)
+    result.player_values = tuple([player.get_snapshot() for player in self.players])
+    result.bombs = tuple(self.bombs)
+    result.bomb_values = tuple([bomb.get_snapshot() for bomb in self.bombs])
+    
+    result.kinds = tile_grid.kinds[:]
+    result.items = tile_grid.items[:]
+    result.to_be_destroyed = tile_grid.to_be_destroyed[:]
+    result.walkable = tile_grid.walkable[:]
+    result.free_floor_tiles = tuple(tile_grid.free_floor_tiles)
+    result.free_floor_positions = tile_grid.free_floor_positions[:]
+    result.active_tiles = frozenset(tile_grid.active_tiles)
+    result.flames = tuple([(index,tuple(tile_grid.flames[index])) for index in tile_grid.active_tiles if len(tile_grid.flames[index]) > 0])
+    result.tile_players = tuple([(index,tuple(tile_grid.players[index])) for index in self.__occupied_tiles(self.players)])
+    result.tile_bombs = tuple([(index,tuple(tile_grid.bombs[index])) for index in self.__occupied_tiles(self.bombs)])
+    result.tile_hash_keys = tuple(tile_grid.tile_hash_keys)
+    result.state_hash = tile_grid.state_hash
+    result.entity_hash = self.entity_hash
+    
+    return result
+
+  #----------------------------------------------------------------------------
+
+  ## Returns the set of indices of tiles under which given players or bombs are
+  #  in the map's index.
+
+  def __occupied_tiles(self, objects):
+    result = set([obj.tile_index for obj in objects])
+    result.discard(None)
+    return result
+
+  #----------------------------------------------------------------------------
+
+  ## Sets the state of the match to that captured by given GameMapSnapshot of this
+  #  map. Only the tiles that are or were occupied are touched, so restoring takes
+  #  time proportional to the number of players, bombs and flames.
+
+  def restore(self, snapshot):
+    tile_grid = self.tile_grid
+    
+    # clear the indices of the current state:
+    
+    for index in self.__occupied_tiles(self.players):
+      del tile_grid.players[index][:]
+      
+    for index in self.__occupied_tiles(self.bombs):
+      del tile_grid.bombs[index][:]
+    
+    for bomb in self.bombs:
+      bomb.hash_key = None          # no longer on the map unless the snapshot has it
+      
+      for index in bomb.danger_tiles:
+        del tile_grid.danger_bombs[index][:]
+        
+    for index in tile_grid.active_tiles:
+      del tile_grid.flames[index][:]
+    
+    if tile_grid.kinds != snapshot.kinds:
+      for index in range(len(snapshot.kinds)):
+        if tile_grid.kinds[index] != snapshot.kinds[index]:
+          tile_grid.invalidate_flame_rays(index)
+    
+    # set the saved state:
+    
+    for name, value in zip(GameMap.SNAPSHOT_ATTRIBUTES,snapshot.map_values):
+      setattr(self,name,value)
+    
+    self.random.setstate(snapshot.random_state)
+    self.timers = list(snapshot.timers)
+    self.flame_burnouts = dict([(time,list(indices)) for time, indices in snapshot.flame_burnouts])
+    self.team_alive_counts = dict(snapshot.team_alive_counts)
+    self.alive_players = list(snapshot.alive_players)
+    
+    for player, values in zip(self.players,snapshot.player_values):
+      player.restore_snapshot(values)
+      
+    self.bombs = list(snapshot.bombs)
+    
+    for bomb, values in zip(self.bombs,snapshot.bomb_values):
+      bomb.restore_snapshot(values)
+      
+      for index in bomb.danger_tiles:
+        tile_grid.danger_bombs[index].append(bomb)
+    
+    tile_grid.kinds[:] = snapshot.kinds
+    tile_grid.items[:] = snapshot.items
+    tile_grid.to_be_destroyed[:] = snapshot.to_be_destroyed
+    tile_grid.walkable[:] = snapshot.walkable
+    tile_grid.free_floor_tiles[:] = snapshot.free_floor_tiles
+    tile_grid.free_floor_positions[:] = snapshot.free_floor_positions
+    tile_grid.active_tiles.clear()
+    tile_grid.active_tiles.update(snapshot.active_tiles)
+    tile_grid.tile_hash_keys[:] = snapshot.tile_hash_keys
+    tile_grid.state_hash = snapshot.state_hash
+    
+    for index, flames in snapshot.flames:
+      tile_grid.flames[index].extend(flames)
+      
+    for index, players in snapshot.tile_players:
+      tile_grid.players[index].extend(players)
+      
+    for index, bombs in snapshot.tile_bombs:
+      tile_grid.bombs[index].extend(bombs)
+    
+    self.bomb_fire_times_up_to_date = False
+    self.__clear_outdated_hash_keys()
+    self.entity_hash = snapshot.entity_hash
+
+  #----------------------------------------------------------------------------
+
+  def __bomb_number(self, bomb, bomb_table, bomb_numbers):
+    if not bomb in bomb_numbers:
+      bomb_numbers[bomb] = len(bomb_table)
+      bomb_table.append(bomb)
+      
+    return bomb_numbers[bomb]
+
+  #----------------------------------------------------------------------------
+
+  ## Returns the current state of the match (as captured by snapshot) serialized
+  #  into a string of bytes, in which players are referred to by their numbers
+  #  and bombs by their positions in a table of all bombs the state refers to
+  #  (the map's bombs come first). The values are written as little endian
+  #  records (see StateRecords) and the tile arrays as their raw contents, so
+  #  the state doesn't depend on the Python version. It can be loaded with
+  #  load_state into any map made from the same map data and play setup, e.g.
+  #  from a file.
+
+  def save_state(self):
+    snapshot = self.snapshot()
+    bomb_table = []
+    bomb_numbers = {}
+    
+    for bomb in snapshot.bombs:
+      self.__bomb_number(bomb,bomb_table,bomb_numbers)
+    
+    timers = []
+    
+    for time, counter, timer_kind, payload in snapshot.timers:
+      number = 0
+      items = []
+      
+      if timer_kind == GameMap.TIMER_BOMB_EXPLOSION:
+        number = self.__bomb_number(payload,bomb_table,bomb_numbers)
+      elif timer_kind == GameMap.TIMER_DISEASE_END:
+        number = payload.get_number()
+      elif timer_kind == GameMap.TIMER_GIVE_AWAY:
+        items = payload
+      
+      timers.append(struct.pack(GameMap.STATE_TIMER_FORMAT,time,counter,timer_kind,number) + StateRecords.pack_list("b",items))
+    
+    players = []
+    
+    for player, values in zip(self.players,snapshot.player_values):
+      items = values[-2]
+      item_kinds = sorted(items)    # the order of a dict depends on its history in Python 2
+      
+      players.append(struct.pack("<b",player.get_number()) +
+        StateRecords.pack(Player.STATE_FIELDS,dict(zip(Player.SNAPSHOT_ATTRIBUTES,values))) +
+        StateRecords.pack_list("b",item_kinds) +
+        StateRecords.pack_list("i",[items[item] for item in item_kinds]) +
+        StateRecords.pack_list("I",[self.__bomb_number(bomb,bomb_table,bomb_numbers) for bomb in values[-1]]))
+    
+    bombs = []
+    
+    for bomb in bomb_table:
+      values = dict(zip(Bomb.SNAPSHOT_ATTRIBUTES + Bomb.SNAPSHOT_FLIGHT_ATTRIBUTES,bomb.get_snapshot()))
+      
+      bombs.append(struct.pack("<b",bomb.player.get_number()) +
+        StateRecords.pack(Bomb.STATE_FIELDS,values) +
+        StateRecords.pack_list("I",values["danger_tiles"]) +
+        StateRecords.pack_list("I",values["chain_tiles"]))
+    
+    random_version, random_words, gauss = snapshot.random_state
+    
+    result = [
+      StateRecords.pack(GameMap.STATE_FIELDS,dict(zip(GameMap.SNAPSHOT_ATTRIBUTES,snapshot.map_values))),
+      struct.pack(GameMap.STATE_RANDOM_FORMAT,*(random_words + (gauss != None,0.0 if gauss == None else gauss))),
+      struct.pack("<I",len(snapshot.kinds))]
+    
+    for values in (snapshot.kinds,snapshot.items,snapshot.to_be_destroyed,snapshot.walkable,snapshot.free_floor_positions):
+      result.append(StateRecords.array_to_bytes(values))
+    
+    result.append(StateRecords.pack_list("I",snapshot.free_floor_tiles))
+    result.append(StateRecords.pack_list("I",sorted(snapshot.active_tiles)))
+    result.append(struct.pack("<I",len(snapshot.flames)))
+    
+    for index, flames in sorted(snapshot.flames,key=operator.itemgetter(0)):
+      result.append(struct.pack("<II",index,len(flames)))
+      
+      for flame in flames:
+        result.append(struct.pack(GameMap.STATE_FLAME_FORMAT,-1 if flame.player == None else flame.player.get_number(),
+          flame.burns_out_at,GameMap.FLAME_DIRECTIONS.index(flame.direction)))
+    
+    result.append(struct.pack("<I",len(snapshot.flame_burnouts)))
+    
+    for time, indices in sorted(snapshot.flame_burnouts):
+      result.append(struct.pack("<i",time) + StateRecords.pack_list("I",indices))
+    
+    result.append(struct.pack("<I",len(snapshot.team_alive_counts)))
+    
+    for team, count in sorted(snapshot.team_alive_counts):
+      result.append(struct.pack("<iI",team,count))
+    
+    result.append(StateRecords.pack_list("b",[player.get_number() for player in snapshot.alive_players]))
+    result.append(struct.pack("<II",len(bombs),len(snapshot.bombs)))
+    result.extend(bombs)
+    result.append(struct.pack("<I",len(players)))
+    result.extend(players)
+    result.append(struct.pack("<I",len(timers)))
+    result.extend(timers)
+    result.append(struct.pack("<I",len(snapshot.tile_players)))
+    
+    for index, players_on_tile in sorted(snapshot.tile_players,key=operator.itemgetter(0)):
+      result.append(struct.pack("<I",index) + StateRecords.pack_list("b",[player.get_number() for player in players_on_tile]))
+    
+    result.append(struct.pack("<I",len(snapshot.tile_bombs)))
+    
+    for index, bombs_on_tile in sorted(snapshot.tile_bombs,key=operator.itemgetter(0)):
+      result.append(struct.pack("<I",index) + StateRecords.pack_list("I",[bomb_numbers[bomb] for bomb in bombs_on_tile]))
+    
+    return b"".join(result)
+
+  #----------------------------------------------------------------------------
+
+  ## Reads a player number written by save_state and returns the player.
+
+  def __read_player(self, reader, allow_none=False):
+    number = reader.read("<b")[0]
+    reader.check(self.players_by_numbers.get(number) != None or (allow_none and number == -1),"player number " + str(number))
+    return self.players_by_numbers[number]
+
+  #----------------------------------------------------------------------------
+
+  ## Checks the position values of a player or bomb record read by load_state and
+  #  adds the tile position computed from them.
+
+  def __check_position(self, reader, values):
+    reader.check(0 <= values["x"] < self.get_width() * Positionable.POSITION_UNITS and
+      0 <= values["y"] < self.get_height() * Positionable.POSITION_UNITS,"position")
+    
+    values["tile_position"] = (values["x"] // Positionable.POSITION_UNITS,values["y"] // Positionable.POSITION_UNITS)
+    reader.check(values["tile_index"] == None or 0 <= values["tile_index"] < self.tile_grid.get_number_of_tiles(),"tile index")
+
+  #----------------------------------------------------------------------------
+
+  ## Sets the state of the match to one returned by save_state. New bomb objects
+  #  are made for the bombs of the state. The state is checked as it is read,
+  #  raises ValueError if it's damaged or doesn't fit the map.
+
+  def load_state(self, data):
+    tile_grid = self.tile_grid
+    number_of_tiles = tile_grid.get_number_of_tiles()
+    reader = StateRecords(data)
+    snapshot = GameMapSnapshot()
+    
+    map_values = reader.read_record(GameMap.STATE_FIELDS)
+    reader.check(map_values["state"] <= GameMap.STATE_GAME_OVER,"map state")
+    snapshot.map_values = tuple([map_values[name] for name in GameMap.SNAPSHOT_ATTRIBUTES])
+    
+    random_values = reader.read(GameMap.STATE_RANDOM_FORMAT)
+    reader.check(random_values[624] <= 624,"random state")
+    snapshot.random_state = (random.Random.VERSION,random_values[:625],random_values[626] if random_values[625] else None)
+    
+    # tiles:
+    
+    reader.check(reader.read_count() == number_of_tiles,"number of tiles")
+    snapshot.kinds = reader.read_array("b",number_of_tiles)
+    snapshot.items = reader.read_array("b",number_of_tiles)
+    snapshot.to_be_destroyed = reader.read_array("b",number_of_tiles)
+    snapshot.walkable = reader.read_array("b",len(tile_grid.walkable))
+    snapshot.free_floor_positions = reader.read_array("i",number_of_tiles)
+    snapshot.free_floor_tiles = reader.read_list("I",number_of_tiles)
+    snapshot.active_tiles = frozenset(reader.read_list("I",number_of_tiles))
+    
+    map_walkable_indices = set([tile_grid.padded_index(index) for index in range(number_of_tiles)])
+    
+    reader.check(all([MapTile.TILE_FLOOR <= kind <= MapTile.TILE_WALL for kind in snapshot.kinds]),"tile kind")
+    reader.check(all([TileGrid.NO_VALUE <= item <= GameMap.ITEM_THROWING_GLOVE for item in snapshot.items]),"tile item")
+    reader.check(all([value in (0,1) for value in snapshot.to_be_destroyed]),"tiles to be destroyed")
+    reader.check(all([value in (0,1) and (value == 0 or index in map_walkable_indices) for index, value in enumerate(snapshot.walkable)]),"walkable tiles")
+    reader.check(len(set(snapshot.free_floor_tiles)) == len(snapshot.free_floor_tiles) and
+      all([snapshot.free_floor_positions[index] == position for position, index in enumerate(snapshot.free_floor_tiles)]) and
+      len([position for position in snapshot.free_floor_positions if position != -1]) == len(snapshot.free_floor_tiles),"free floor tiles")
+    
+    # flames and map values:
+    
+    snapshot.flames = []
+    
+    for i in range(reader.read_count()):
+      index, count = reader.read("<II")
+      reader.check(index in snapshot.active_tiles,"flame tile")
+      flames = []
+      
+      for j in range(count):
+        player = self.__read_player(reader,True)
+        burns_out_at, direction = reader.read("<iB")
+        reader.check(direction < len(GameMap.FLAME_DIRECTIONS),"flame direction")
+        flames.append(Flame(player,burns_out_at,GameMap.FLAME_DIRECTIONS[direction]))
+      
+      snapshot.flames.append((index,flames))
+    
+    snapshot.flame_burnouts = []
+    
+    for i in range(reader.read_count()):
+      time = reader.read("<i")[0]
+      snapshot.flame_burnouts.append((time,reader.read_list("I",number_of_tiles)))
+    
+    snapshot.team_alive_counts = [reader.read("<iI") for i in range(reader.read_count())]
+    snapshot.alive_players = [self.__read_player(reader) for i in range(reader.read_count())]
+    
+    team_alive_counts = {}
+    
+    for player in snapshot.alive_players:
+      team_alive_counts[player.get_team_number()] = team_alive_counts.get(player.get_team_number(),0) + 1
+    
+    reader.check(len(set(snapshot.alive_players)) == len(snapshot.alive_players) and
+      len(dict(snapshot.team_alive_counts)) == len(snapshot.team_alive_counts) and
+      dict(snapshot.team_alive_counts) == team_alive_counts,"players alive")
+    
+    # bombs:
+    
+    number_of_bombs_in_table, number_of_bombs = reader.read("<II")
+    reader.check(number_of_bombs <= number_of_bombs_in_table,"number of bombs")
+    bomb_attributes = Bomb.SNAPSHOT_ATTRIBUTES + Bomb.SNAPSHOT_FLIGHT_ATTRIBUTES
+    bombs = []
+    bomb_tiles = []
+    snapshot.bomb_values = []
+    
+    for i in range(number_of_bombs_in_table):
+      bomb = Bomb(self.__read_player(reader))
+      values = reader.read_record(Bomb.STATE_FIELDS)
+      self.__check_position(reader,values)
+      reader.check(values["movement"] <= Bomb.BOMB_NO_MOVEMENT,"bomb movement")
+      reader.check(values["danger_tile"] == None or self.tile_is_withing_map(values["danger_tile"]),"danger tile")
+      values["danger_tiles"] = reader.read_list("I",number_of_tiles)
+      values["chain_tiles"] = reader.read_list("I",number_of_tiles)
+      values["hash_key"] = 0
+      values = tuple([values[name] for name in bomb_attributes])
+      bomb.restore_snapshot(values)
+      bomb.game_map = self        # only now, so that a failed load doesn't touch the map's outdated hash keys
+      bombs.append(bomb)
+      
+      if i < number_of_bombs:
+        snapshot.bomb_values.append(values)
+        
+        if bomb.tile_index != None:
+          bomb_tiles.append((bomb.tile_index,i))
+    
+    snapshot.bombs = bombs[:number_of_bombs]
+    
+    # players:
+    
+    reader.check(reader.read_count() == len(self.players),"number of players")
+    snapshot.player_values = []
+    player_tiles = []
+    
+    for player in self.players:
+      reader.check(reader.read("<b")[0] == player.get_number(),"player number")
+      values = reader.read_record(Player.STATE_FIELDS)
+      self.__check_position(reader,values)
+      reader.check(values["state"] <= Player.STATE_DEAD and values["state_backup"] <= Player.STATE_DEAD,"player state")
+      reader.check(values["disease"] <= Player.DISEASE_EARTHQUAKE,"disease")
+      
+      for name in ("jumping_to","teleporting_to"):
+        reader.check(values[name] == None or self.tile_is_withing_map(values[name]),name)
+      
+      item_kinds = reader.read_list("b",GameMap.ITEM_THROWING_GLOVE + 1)
+      item_counts = reader.read_list("i",2 ** 31)
+      reader.check(len(item_kinds) == len(item_counts),"items")
+      items = dict(zip(item_kinds,item_counts))
+      detonator_bombs = tuple([bombs[i] for i in reader.read_list("I",len(bombs))])
+      
+      if values["tile_index"] != None:
+        player_tiles.append((values["tile_index"],player.get_number()))
+      
+      values["items_hash_key"] = Player.get_items_hash_key(items)
+      values["hash_key"] = 0
+      snapshot.player_values.append(tuple([values[name] for name in Player.SNAPSHOT_ATTRIBUTES]) + (items,detonator_bombs))
+    
+    # timers:
+    
+    snapshot.timers = []
+    
+    for i in range(reader.read_count()):
+      time, counter, timer_kind, number = reader.read(GameMap.STATE_TIMER_FORMAT)
+      payload = reader.read_list("b",GameMap.ITEM_THROWING_GLOVE + 1)
+      
+      if timer_kind == GameMap.TIMER_BOMB_EXPLOSION:
+        reader.check(number < len(bombs),"timer bomb")
+        payload = bombs[number]
+      elif timer_kind == GameMap.TIMER_DISEASE_END:
+        reader.check(self.players_by_numbers.get(number) != None,"timer player")
+        payload = self.players_by_numbers[number]
+      elif timer_kind == GameMap.TIMER_FLAME_BURNOUT:
+        payload = None
+      else:
+        reader.check(timer_kind == GameMap.TIMER_GIVE_AWAY,"timer kind")
+      
+      snapshot.timers.append((time,counter,timer_kind,payload))
+    
+    reader.check(len(set([timer[1] for timer in snapshot.timers])) == len(snapshot.timers),"timer counters")
+    
+    burnout_times = [timer[0] for timer in snapshot.timers if timer[2] == GameMap.TIMER_FLAME_BURNOUT]
+    reader.check(sorted(burnout_times) == sorted(set([time for time, indices in snapshot.flame_burnouts])) and
+      len(burnout_times) == len(snapshot.flame_burnouts),"flame burnout times")
+    heapq.heapify(snapshot.timers)   # the saved heap is kept as it is, a damaged one is repaired
+    
+    # lists of the players and bombs on tiles, they have to agree with their tile indices:
+    
+    snapshot.tile_players = []
+    
+    for i in range(reader.read_count()):
+      index = reader.read_index("I",number_of_tiles)
+      snapshot.tile_players.append((index,[self.__read_player(reader) for j in range(reader.read_count())]))
+    
+    snapshot.tile_bombs = []
+    
+    for i in range(reader.read_count()):
+      index = reader.read_index("I",number_of_tiles)
+      snapshot.tile_bombs.append((index,[bombs[j] for j in reader.read_list("I",number_of_bombs)]))
+    
+    reader.check(sorted([(index,player.get_number()) for index, players in snapshot.tile_players for player in players]) == sorted(player_tiles),"players on tiles")
+    reader.check(sorted([(index,bombs.index(bomb)) for index, bombs_on_tile in snapshot.tile_bombs for bomb in bombs_on_tile]) == sorted(bomb_tiles),"bombs on tiles")
+    reader.check(reader.position == len(data),"unexpected data at the end")
+    
+    snapshot.tile_hash_keys = tile_grid.tile_hash_keys[:]
+    
+    self.restore(snapshot)
+    self.__recompute_hash_keys()
+    
+    tile_grid.tile_hash_keys = [tile_grid.get_tile_hash_key(index) for index in range(number_of_tiles)]  # the hash keys weren't saved, compute them for the new tiles
+    tile_grid.state_hash = tile_grid.compute_state_hash()
+
+  #----------------------------------------------------------------------------
+
+  ## Returns the hash of the current state of the match (the tiles, flames, bombs,
+  #  players' positions, states and items and the map time), see StateHash. Two
+  #  runs of a match can be compared tick by tick with it to find where they
+  #  start to differ. The tiles and flames are hashed incrementally as they
+  #  change, the players and bombs keep their keys in entity_hash and only the
+  #  keys of those that have changed since the last call are recomputed.
+
+  def get_state_hash(self):
+    entity_hash = self.entity_hash
+    
+    for entity in self.outdated_hash_keys:
+      entity.hash_key_outdated = False
+      
+      if entity.hash_key != None:   # not a bomb that has been removed from the map
+        new_key = entity.get_hash_key()
+        entity_hash += new_key - entity.hash_key
+        entity.hash_key = new_key
+        
+    del self.outdated_hash_keys[:]
+    self.entity_hash = entity_hash & StateHash.MASK
+    
+    return (self.tile_grid.state_hash + self.entity_hash + StateHash.key((StateHash.TAG_MAP,self.time_from_start,self.state))) & StateHash.MASK
+
+  #----------------------------------------------------------------------------
+
+  ## Marks the state hash key of given player or bomb as outdated, so that it is
+  #  recomputed by the next get_state_hash call. Many values may change during a
+  #  tick (e.g. the position in each movement sub-step), but the key is computed
+  #  at most once per call of get_state_hash.
+
+  def hash_key_changed(self, entity):
+    if not entity.hash_key_outdated:
+      entity.hash_key_outdated = True
+      self.outdated_hash_keys.append(entity)
+
+  #----------------------------------------------------------------------------
+
+  ## Forgets the outdated hash keys, e.g. when the keys have been restored.
+
+  def __clear_outdated_hash_keys(self):
+    for entity in self.outdated_hash_keys:
+      entity.hash_key_outdated = False
+      
+    del self.outdated_hash_keys[:]
 
-    self.create_disease_cloud_at = 0  ##< at what time (in ms) the disease clouds should be released
+  #----------------------------------------------------------------------------
+
+  ## Computes the state hash keys of all players and bombs on the map from scratch.
+
+  def __recompute_hash_keys(self):
+    self.__clear_outdated_hash_keys()
+    self.entity_hash = 0
+    
+    for entity in self.players + self.bombs:
+      entity.hash_key = entity.get_hash_key()
+      self.entity_hash += entity.hash_key
+      
+    self.entity_hash &= StateHash.MASK
 
   #----------------------------------------------------------------------------
 
-  def get_starting_items(self):
-    return self.player_starting_items
+  ## Removes given bomb from the list of the map's bombs along with its state
+  #  hash key.
+
+  def __remove_bomb(self, bomb):
+    self.bombs.remove(bomb)
+    self.entity_hash = (self.entity_hash - bomb.hash_key) & StateHash.MASK
+    bomb.hash_key = None
 
   #----------------------------------------------------------------------------
 
+  ## Returns a list of starting positions for each player number, None for numbers
+  #  without a player and without a starting position in the map data.
+
   def get_starting_positions(self):
     return self.starting_positions
 
   #----------------------------------------------------------------------------
 
+  ## Returns the players that are alive, in the same order as get_players.
+
+  def get_alive_players(self):
+    return self.alive_players
+
+  #----------------------------------------------------------------------------
+
   ## Returns a tuple (game number, max games).
  
   def get_game_number_info(self):
@@ -1362,12 +2918,60 @@ class GameMap(object):
   #----------------------------------------------------------------------------
 
   def start_earthquake(self):
-    self.earthquake_time_left = GameMap.EARTHQUAKE_DURATION
+    self.earthquake_ends_at = self.time_from_start + GameMap.EARTHQUAKE_DURATION
 
   #----------------------------------------------------------------------------
 
   def earthquake_is_active(self):
-    return self.earthquake_time_left > 0
+    return self.time_from_start < self.earthquake_ends_at
+
+  #----------------------------------------------------------------------------
+
+  ## Schedules an event of given kind (see TIMER_* constants) to happen at given
+  #  absolute map time, it will be handled at the beginning of the first update
+  #  after the time has passed. Timers can't be cancelled, the handlers
+  #  check whether the event is still valid (e.g. the bomb hasn't exploded yet).
+
+  def schedule_timer(self, time, timer_kind, payload):
+    heapq.heappush(self.timers,(time,self.timer_counter,timer_kind,payload))
+    self.timer_counter += 1
+
+  #----------------------------------------------------------------------------
+
+  def __process_timers(self):
+    while len(self.timers) > 0 and self.timers[0][0] < self.time_from_start:
+      time, counter, timer_kind, payload = heapq.heappop(self.timers)
+      
+      if timer_kind == GameMap.TIMER_BOMB_EXPLOSION:
+        if not payload.has_exploded and payload.movement != Bomb.BOMB_FLYING:   # flying bomb will explode when it lands
+          self.bomb_explodes(payload)
+      elif timer_kind == GameMap.TIMER_FLAME_BURNOUT:
+        self.__burn_out_flames(self.flame_burnouts.pop(time))
+      elif timer_kind == GameMap.TIMER_DISEASE_END:
+        if payload.get_disease() != Player.DISEASE_NONE and payload.disease_ends_at == time:    # not valid if the disease has changed since
+          payload.end_disease()
+      elif timer_kind == GameMap.TIMER_GIVE_AWAY:
+        self.spread_items(payload)
+        debug_log("giving away items")
+
+  #----------------------------------------------------------------------------
+
+  ## Removes the flames that have burnt out from tiles with given indices. Flames
+  #  are added to tiles in the order of their burnout times, so the burnt out ones
+  #  are always at the beginning of the tile's list and are removed at once.
+
+  def __burn_out_flames(self, tile_indices):
+    tile_grid = self.tile_grid
+    
+    for index in tile_indices:
+      flames = tile_grid.flames[index]
+      burnt_out = 0
+      
+      while burnt_out < len(flames) and flames[burnt_out].burns_out_at < self.time_from_start:
+        burnt_out += 1
+      
+      if burnt_out > 0:
+        tile_grid.remove_flames(index,burnt_out)
 
   #----------------------------------------------------------------------------
 
@@ -1376,18 +2980,69 @@ class GameMap(object):
 
   #----------------------------------------------------------------------------
 
-  ## Efficiently (lazily) gets a danger value of given tile. Danger value says
-  #  how much time in ms has will pass until there will be a fire at the tile.
+  ## Efficiently gets a danger value of given tile. Danger value says how much
+  #  time in ms has will pass until there will be a fire at the tile. The value is
+  #  computed from the bombs whose flame reaches the tile (see update_bomb_danger),
+  #  which are kept up to date as bombs and blocks change, and their expected
+  #  explosion times (see update_bomb_fire_times).
 
   def get_danger_value(self, tile_coordinates):
-    if not self.danger_map_is_up_to_date:
-      self.update_danger_map()
-      self.danger_map_is_up_to_date = True
-    
     if not self.tile_is_withing_map(tile_coordinates):
       return 0       # never walk outside map
     
-    return self.danger_map[tile_coordinates[1]][tile_coordinates[0]]
+    if not self.bomb_fire_times_up_to_date or (self.detonator_bombs_on_map and self.bomb_fire_times_computed_at != self.time_from_start):
+      self.update_bomb_fire_times()
+    
+    index = tile_coordinates[1] * self.width + tile_coordinates[0]
+    
+    result = 0 if self.tile_grid.tile_shouldnt_walk(index) else GameMap.SAFE_DANGER_VALUE
+    
+    for bomb in self.tile_grid.danger_bombs[index]:
+      result = min(result,bomb.fires_at - self.time_from_start)
+      
+    return result
+
+  #----------------------------------------------------------------------------
+
+  ## Computes the expected explosion time (Bomb.fires_at) of each bomb, i.e. the
+  #  earliest of its own explosion time and the times of bombs whose flame would
+  #  set it off. This is Dijkstra's algorithm over the graph of bombs in which the
+  #  edges go from bombs to the bombs in their flame. A detonator bomb can go off
+  #  any moment, so it's expected to explode in 100 ms.
+
+  def update_bomb_fire_times(self):
+    bombs_to_process = []
+    self.detonator_bombs_on_map = False
+    
+    for i in range(len(self.bombs)):
+      bomb = self.bombs[i]
+      
+      if bomb.has_detonator():
+        bomb.fires_at = self.time_from_start + 100
+        self.detonator_bombs_on_map = True
+      else:
+        bomb.fires_at = bomb.explodes_at
+        
+      bombs_to_process.append((bomb.fires_at,i,bomb))   # i makes the entries unique and the order deterministic
+    
+    heapq.heapify(bombs_to_process)
+    entry_number = len(bombs_to_process)
+    
+    while len(bombs_to_process) > 0:
+      fires_at, i, bomb = heapq.heappop(bombs_to_process)
+      
+      if fires_at > bomb.fires_at:      # outdated entry
+        continue
+    
+      for index in bomb.chain_tiles:
+        for bomb2 in self.tile_grid.bombs[index]:
+          if fires_at < bomb2.fires_at:
+            bomb2.fires_at = fires_at
+            heapq.heappush(bombs_to_process,(fires_at,entry_number,bomb2))
+            entry_number += 1
+    
+    self.bomb_fire_times_up_to_date = True
+    self.bomb_fire_times_computed_at = self.time_from_start
 
   #----------------------------------------------------------------------------
   
@@ -1395,7 +3050,7 @@ class GameMap(object):
     if not self.tile_is_withing_map(tile_coordinates):
       return False
     
-    return self.tiles[tile_coordinates[1]][tile_coordinates[0]].special_object == MapTile.SPECIAL_OBJECT_LAVA
+    return self.tile_grid.special_objects[tile_coordinates[1] * self.width + tile_coordinates[0]] == MapTile.SPECIAL_OBJECT_LAVA
 
   #----------------------------------------------------------------------------
   
@@ -1403,53 +3058,105 @@ class GameMap(object):
   #  are spread randomly on the map floor tiles after a while.
   
   def give_away_items(self, items):
-    self.items_to_give_away.append((pygame.time.get_ticks() + GameMap.GIVE_AWAY_DELAY,items))
+    self.schedule_timer(self.time_from_start + GameMap.GIVE_AWAY_DELAY,GameMap.TIMER_GIVE_AWAY,items)
 
   #----------------------------------------------------------------------------
   
-  def update_danger_map(self):
-    # reset the map:
-    self.danger_map = [map(lambda tile: 0 if tile.shouldnt_walk() else GameMap.SAFE_DANGER_VALUE, tile_row) for tile_row in self.tiles]
+  ## Computes the tiles the flame of given bomb would reach (bomb.danger_tiles) and
+  #  registers the bomb at these tiles for get_danger_value, it also remembers the
+  #  tiles with bombs the flame would set off (bomb.chain_tiles). Exploded bombs are
+  #  unregistered. If recompute is False, the tiles are only recomputed if the
+  #  bomb has changed its tile.
 
-    for bomb in self.bombs:
-      bomb_tile = bomb.get_tile_position()
-      
-      time_until_explosion = bomb.time_until_explosion()
+  def update_bomb_danger(self, bomb, recompute=True):
+    bomb_tile = None if bomb.has_exploded else bomb.get_tile_position()
+    
+    if not recompute and bomb_tile == bomb.danger_tile:
+      return
+    
+    tile_grid = self.tile_grid
+    self.bomb_fire_times_up_to_date = False
+    
+    for index in bomb.danger_tiles:
+      tile_grid.danger_bombs[index].remove(bomb)
+    
+    bomb.danger_tile = bomb_tile
+    bomb.danger_tiles = []
+    bomb.chain_tiles = []
+    
+    if bomb_tile == None or not self.tile_is_withing_map(bomb_tile):
+      return
+    
+    bomb.danger_tiles.append(tile_grid.tile_index(bomb_tile))
+    bomb.chain_tiles.append(bomb.danger_tiles[0])     # other bombs on the same tile
+    
+    for direction in (0,1,2,3):
+      ray_start = bomb.danger_tiles[0]
+      length_left = bomb.flame_length
       
-      if bomb.has_detonator():           # detonator = bad
-        time_until_explosion = 100
+      while length_left > 0:
+        ray = tile_grid.get_flame_ray(ray_start,direction)
+        
+        for index in ray[:length_left]:
+          if not tile_grid.tile_is_walkable(index):
+            if len(tile_grid.bombs[index]) > 0:
+              bomb.chain_tiles.append(index)
+              
+            length_left = 0
+            break
+          
+          bomb.danger_tiles.append(index)
+          length_left -= 1
       
-      self.danger_map[bomb_tile[1]][bomb_tile[0]] = min(self.danger_map[bomb_tile[1]][bomb_tile[0]],time_until_explosion)
+        if length_left == 0 or len(ray) == 0 or tile_grid.kinds[ray[-1]] != MapTile.TILE_BLOCK:
+          break
+        
+        ray_start = ray[-1]   # the ray ended with a block being destroyed (walkable), the danger goes on behind it
+
+    for index in bomb.danger_tiles:
+      tile_grid.danger_bombs[index].append(bomb)
+
+  #----------------------------------------------------------------------------
+
+  ## Must be called when the walkability of given tile (by index) changes, updates
+  #  the flame reach of bombs which may be affected, i.e. those reaching the tile
+  #  or its neighbours.
 
-                         # up                              right                            down                             left
-      position         = [[bomb_tile[0],bomb_tile[1] - 1], [bomb_tile[0] + 1,bomb_tile[1]], [bomb_tile[0],bomb_tile[1] + 1], [bomb_tile[0] - 1,bomb_tile[1]]]
-      flame_stop       = [False,                           False,                           False,                           False]
-      tile_increment   = [(0,-1),                          (1,0),                           (0,1),                           (-1,0)]
+  def __tile_walkability_changed(self, index):
+    tile_grid = self.tile_grid
+    tile = tile_grid.index_to_coordinates(index)
+    bombs_to_update = []
     
-      for i in range(bomb.flame_length):
-        for direction in (0,1,2,3):
-          if flame_stop[direction]:
-            continue
-        
-          if not self.tile_is_walkable(position[direction]) or not self.tile_is_withing_map(position[direction]):
-            flame_stop[direction] = True
-            continue
-          
-          current_tile = position[direction]
+    for neighbour in (tile,(tile[0],tile[1] - 1),(tile[0] + 1,tile[1]),(tile[0],tile[1] + 1),(tile[0] - 1,tile[1])):
+      if not self.tile_is_withing_map(neighbour):
+        continue
+    
+      for bomb in tile_grid.danger_bombs[tile_grid.tile_index(neighbour)]:
+        if not bomb in bombs_to_update:
+          bombs_to_update.append(bomb)
           
-          self.danger_map[current_tile[1]][current_tile[0]] = min(self.danger_map[current_tile[1]][current_tile[0]],time_until_explosion)
-          position[direction][0] += tile_increment[direction][0] 
-          position[direction][1] += tile_increment[direction][1]
+    for bomb in bombs_to_update:
+      self.update_bomb_danger(bomb)
 
   #----------------------------------------------------------------------------
           
   def add_sound_event(self, sound_event):
-    self.sound_events.append(sound_event)
+    if not self.headless:
+      self.sound_events.append(sound_event)
 
   #----------------------------------------------------------------------------
-    
-  def add_animation_event(self, animation_event, coordinates):    
-    self.animation_events.append((animation_event,coordinates))
+
+  ## Adds an animation event at given map (not pixel) coordinates, the renderer
+  #  converts them to pixels and applies pixel_offset.
+
+  def add_animation_event(self, animation_event, coordinates, pixel_offset=(0,0)):
+    if not self.headless:
+      self.animation_events.append((animation_event,coordinates,pixel_offset))
+
+  #----------------------------------------------------------------------------
+
+  def is_headless(self):
+    return self.headless
 
   #----------------------------------------------------------------------------
     
@@ -1501,7 +3208,7 @@ class GameMap(object):
     if not self.tile_is_withing_map(tile_coordinates):
       return False     # coordinates outside the map
     
-    return len(self.tiles[tile_coordinates[1]][tile_coordinates[0]].flames) >= 1
+    return len(self.tile_grid.flames[tile_coordinates[1] * self.width + tile_coordinates[0]]) >= 1
 
   #----------------------------------------------------------------------------
 
@@ -1511,17 +3218,19 @@ class GameMap(object):
     if not self.tile_is_withing_map(tile_coordinates):
       return False     # coordinates outside the map
     
-    return self.tiles[tile_coordinates[1]][tile_coordinates[0]].special_object in (MapTile.SPECIAL_OBJECT_TELEPORT_A,MapTile.SPECIAL_OBJECT_TELEPORT_B)
+    return self.tile_grid.special_objects[tile_coordinates[1] * self.width + tile_coordinates[0]] in (MapTile.SPECIAL_OBJECT_TELEPORT_A,MapTile.SPECIAL_OBJECT_TELEPORT_B)
 
   #----------------------------------------------------------------------------
 
   def bomb_on_tile(self, tile_coordinates):
-    bombs = self.bombs_on_tile(tile_coordinates)
+    tile_coordinates = Positionable.position_to_tile(tile_coordinates)
+    
+    if not self.tile_is_withing_map(tile_coordinates):
+      return None
     
-    if len(bombs) > 0:
-      return bombs[0]
+    bombs = self.tile_grid.bombs[tile_coordinates[1] * self.width + tile_coordinates[0]]
     
-    return None
+    return bombs[0] if len(bombs) > 0 else None
 
   #----------------------------------------------------------------------------
 
@@ -1532,28 +3241,57 @@ class GameMap(object):
 
   #----------------------------------------------------------------------------
 
+  ## Returns a list of players (alive and not in air) at given tile, uses an index
+  #  that's kept up to date by update_player_index.
+
   def get_players_at_tile(self, tile_coordinates):
-    result = []
+    if not self.tile_is_withing_map(tile_coordinates):
+      return []
     
-    for player in self.players:
-      player_tile_position = player.get_tile_position()
+    return list(self.tile_grid.players[tile_coordinates[1] * self.width + tile_coordinates[0]])
 
-      if not player.is_dead() and not player.is_in_air() and player_tile_position[0] == tile_coordinates[0] and player_tile_position[1] == tile_coordinates[1]:
-        result.append(player)
+  #----------------------------------------------------------------------------
+
+  def tile_has_player(self, tile_coordinates):
+    if not self.tile_is_withing_map(tile_coordinates):
+      return False
     
-    return result
+    return len(self.tile_grid.players[tile_coordinates[1] * self.width + tile_coordinates[0]]) > 0
 
   #----------------------------------------------------------------------------
 
-  def tile_has_player(self, tile_coordinates):
-    return len(self.get_players_at_tile(tile_coordinates))
+  ## Keeps the tile -> players index (see get_players_at_tile) up to date, this has
+  #  to be called whenever a player moves, dies or goes to or from the air
+  #  (Player.set_position does it automatically).
+
+  def update_player_index(self, player):
+    new_index = None
+    
+    if not player.is_dead() and not player.is_in_air():
+      player_tile = player.get_tile_position()
+      
+      if self.tile_is_withing_map(player_tile):
+        new_index = self.tile_grid.tile_index(player_tile)
+    
+    if new_index == player.tile_index:
+      return
+    
+    if player.tile_index != None:
+      self.tile_grid.players[player.tile_index].remove(player)
+      self.tile_grid.update_free_floor(player.tile_index)
+      
+    if new_index != None:
+      self.tile_grid.players[new_index].append(player)
+      self.tile_grid.update_free_floor(new_index)
+      
+    player.tile_index = new_index
 
   #----------------------------------------------------------------------------
 
   ## Checks if given tile coordinates are within the map boundaries.
 
   def tile_is_withing_map(self, tile_coordinates):
-    return tile_coordinates[0] >= 0 and tile_coordinates[1] >= 0 and tile_coordinates[0] <= GameMap.MAP_WIDTH - 1 and tile_coordinates[1] <= GameMap.MAP_HEIGHT - 1
+    return tile_coordinates[0] >= 0 and tile_coordinates[1] >= 0 and tile_coordinates[0] <= self.width - 1 and tile_coordinates[1] <= self.height - 1
 
   #----------------------------------------------------------------------------
 
@@ -1561,51 +3299,68 @@ class GameMap(object):
     if not self.tile_is_withing_map(tile_coordinates):
       return False
     
-    tile = self.tiles[tile_coordinates[1]][tile_coordinates[0]]
-    return self.tile_is_withing_map(tile_coordinates) and (self.tiles[tile_coordinates[1]][tile_coordinates[0]].kind == MapTile.TILE_FLOOR or tile.to_be_destroyed) and not self.tile_has_bomb(tile_coordinates)
+    return self.tile_grid.tile_is_walkable(tile_coordinates[1] * self.width + tile_coordinates[0])
 
   #----------------------------------------------------------------------------
 
   ## Gets a collision type (see class constants) for give float position.
 
   def get_position_collision_type(self, position):
-    tile_coordinates = Positionable.position_to_tile(position)
+    return self.get_fixed_position_collision_type(Positionable.to_fixed(position[0]),Positionable.to_fixed(position[1]))
+
+  #----------------------------------------------------------------------------
+
+  ## Same as get_position_collision_type but for fixed point position (see
+  #  Positionable). The walkable bitmap has a border around the map, so once the
+  #  tile itself is known to be inside the map its neighbours are looked up
+  #  without any further bound checks.
+
+  def get_fixed_position_collision_type(self, x, y):
+    units = Positionable.POSITION_UNITS
+    tile_x = x // units
+    tile_y = y // units
+    
+    if tile_x < 0 or tile_y < 0 or tile_x >= self.width or tile_y >= self.height:
+      return GameMap.COLLISION_TOTAL
+    
+    walkable = self.tile_grid.walkable
+    row = self.tile_grid.padded_width
+    bitmap_index = (tile_y + 1) * row + tile_x + 1
     
-    if not self.tile_is_walkable(tile_coordinates):
+    if not walkable[bitmap_index]:
       return GameMap.COLLISION_TOTAL
     
-    position_within_tile = (position[0] % 1,position[1] % 1)
+    within_x = x - tile_x * units
+    within_y = y - tile_y * units
     
-    if position_within_tile[1] < GameMap.WALL_MARGIN_HORIZONTAL:
-      if not self.tile_is_walkable((tile_coordinates[0],tile_coordinates[1] - 1)):
+    if within_y < GameMap.WALL_MARGIN_HORIZONTAL_FIXED:
+      if not walkable[bitmap_index - row]:
         return GameMap.COLLISION_BORDER_UP
-    elif position_within_tile[1] > 1.0 - GameMap.WALL_MARGIN_HORIZONTAL:
-      if not self.tile_is_walkable((tile_coordinates[0],tile_coordinates[1] + 1)):
+    elif within_y > units - GameMap.WALL_MARGIN_HORIZONTAL_FIXED:
+      if not walkable[bitmap_index + row]:
         return GameMap.COLLISION_BORDER_DOWN
       
-    if position_within_tile[0] < GameMap.WALL_MARGIN_VERTICAL:
-      if not self.tile_is_walkable((tile_coordinates[0] - 1,tile_coordinates[1])):
+    if within_x < GameMap.WALL_MARGIN_VERTICAL_FIXED:
+      if not walkable[bitmap_index - 1]:
         return GameMap.COLLISION_BORDER_LEFT
-    elif position_within_tile[0] > 1.0 - GameMap.WALL_MARGIN_VERTICAL:
-      if not self.tile_is_walkable((tile_coordinates[0] + 1,tile_coordinates[1])):
+    elif within_x > units - GameMap.WALL_MARGIN_VERTICAL_FIXED:
+      if not walkable[bitmap_index + 1]:
         return GameMap.COLLISION_BORDER_RIGHT
     
     return GameMap.COLLISION_NONE
 
   #----------------------------------------------------------------------------
 
+  ## Returns a list of bombs (not flying ones) at given tile (coordinates may be float
+  #  or int), uses an index that's kept up to date by update_bomb_index.
+
   def bombs_on_tile(self, tile_coordinates):
-    result = []
-    
     tile_coordinates = Positionable.position_to_tile(tile_coordinates)
     
-    for bomb in self.bombs:
-      bomb_tile_position = bomb.get_tile_position()
-
-      if bomb.movement != Bomb.BOMB_FLYING and bomb_tile_position[0] == tile_coordinates[0] and bomb_tile_position[1] == tile_coordinates[1]:
-        result.append(bomb)
-      
-    return result
+    if not self.tile_is_withing_map(tile_coordinates):
+      return []
+    
+    return list(self.tile_grid.bombs[tile_coordinates[1] * self.width + tile_coordinates[0]])
 
   #----------------------------------------------------------------------------
 
@@ -1624,220 +3379,208 @@ class GameMap(object):
     
     bomb_position = bomb.get_tile_position()
     
-    new_flame = Flame()
-    new_flame.player = bomb.player
-    new_flame.direction = "all"
+    burns_out_at = self.time_from_start + Flame.BURNING_TIME
     
-    self.tiles[bomb_position[1]][bomb_position[0]].flames.append(new_flame)
+    # all flames burning out at the same time are removed by a single timer:
     
-    # information relevant to flame spreading in each direction:
+    if not burns_out_at in self.flame_burnouts:
+      self.flame_burnouts[burns_out_at] = []
+      self.schedule_timer(burns_out_at,GameMap.TIMER_FLAME_BURNOUT,None)
     
-                     # up                    right                down                 left
-    axis_position    = [bomb_position[1] - 1,bomb_position[0] + 1,bomb_position[1] + 1,bomb_position[0] - 1]
-    flame_stop       = [False,               False,               False,               False]
-    map_limit        = [0,                   GameMap.MAP_WIDTH - 1,   GameMap.MAP_HEIGHT - 1,  0]
-    increment        = [-1,                  1,                   1,                   -1]
-    goes_horizontaly = [False,               True,                False,               True]
-    previous_flame   = [None,                None,                None,                None]
+    flame_tiles = self.flame_burnouts[burns_out_at]
+    
+    tile_grid = self.tile_grid
+    bomb_index = tile_grid.tile_index(bomb_position)
+    
+    flame_tiles.append(bomb_index)
+    tile_grid.add_flame(bomb_index,Flame(bomb.player,burns_out_at,"all"))
     
     # spread the flame in all 4 directions:
-
-    for i in range(bomb.flame_length + 1):
-      if i >= bomb.flame_length:
-        flame_stop = [True, True, True, True]
-
-      for direction in (0,1,2,3): # for each direction
-        if flame_stop[direction]:  
-          if previous_flame[direction] != None:   # flame stopped in previous iteration
-          
-            if direction == 0:
-              previous_flame[direction].direction = "up"
-            elif direction == 1:
-              previous_flame[direction].direction = "right"
-            elif direction == 2:
-              previous_flame[direction].direction = "down"
-            else:
-              previous_flame[direction].direction = "left"
-          
-            previous_flame[direction] = None
-        else:
-          if ((increment[direction] == -1 and axis_position[direction] >= map_limit[direction]) or
-            (increment[direction] == 1 and axis_position[direction] <= map_limit[direction])):
-            # flame is inside the map here          
-        
-            if goes_horizontaly[direction]:
-              tile_for_flame = self.tiles[bomb_position[1]][axis_position[direction]]
-            else:
-              tile_for_flame = self.tiles[axis_position[direction]][bomb_position[0]]
-        
-            if tile_for_flame.kind == MapTile.TILE_WALL:
-              flame_stop[direction] = True
-            else:
-              new_flame2 = copy.copy(new_flame)
-              new_flame2.direction = "horizontal" if goes_horizontaly[direction] else "vertical"
-              tile_for_flame.flames.append(new_flame2)
-            
-              previous_flame[direction] = new_flame2
-            
-              if tile_for_flame.kind == MapTile.TILE_BLOCK:
-                flame_stop[direction] = True
-          else:
-            flame_stop[direction] = True
-          
-        axis_position[direction] += increment[direction]
+    
+    for direction in (0,1,2,3):
+      ray = tile_grid.get_flame_ray(bomb_index,direction)[:bomb.flame_length]
+      
+      if len(ray) == 0:
+        continue
+      
+      middle_direction = "vertical" if direction % 2 == 0 else "horizontal"
+      
+      for index in ray[:-1]:
+        tile_grid.add_flame(index,Flame(bomb.player,burns_out_at,middle_direction))
+      
+      tile_grid.add_flame(ray[-1],Flame(bomb.player,burns_out_at,GameMap.FLAME_END_DIRECTIONS[direction]))   # end of the flame
+      flame_tiles.extend(ray)
     
     bomb.explodes()
    
+    self.update_bomb_index(bomb)
+   
     if bomb in self.bombs:
-      self.bombs.remove(bomb)
+      self.__remove_bomb(bomb)
 
   #----------------------------------------------------------------------------
 
+  ## Places given items on random free floor tiles (see TileGrid.free_floor_tiles).
+
   def spread_items(self, items):
-    possible_tiles = []
-    
-    for y in range(GameMap.MAP_HEIGHT):
-      for x in range(GameMap.MAP_WIDTH):
-        tile = self.tiles[y][x]
-        
-        if tile.kind == MapTile.TILE_FLOOR and tile.special_object == None and tile.item == None and not self.tile_has_player((x,y)):
-          possible_tiles.append(tile)
+    tile_grid = self.tile_grid
+    possible_tiles = tile_grid.free_floor_tiles
           
     for item in items:
       if len(possible_tiles) == 0:
         break                              # no more tiles to place items on => end
       
-      tile = random.choice(possible_tiles)
-      tile.item = item
-      
-      possible_tiles.remove(tile)
+      index = self.random.choice(possible_tiles)
+      tile_grid.items[index] = item
+      tile_grid.update_free_floor(index)   # (removes the tile from possible_tiles)
+      tile_grid.update_tile_hash(index)
 
   #----------------------------------------------------------------------------
 
   def __update_bombs(self, dt):
     i = 0
 
-    while i < len(self.bombs):    # update all bombs
+    while i < len(self.bombs):    # update moving bombs, the rest only waits for its explosion timer
       bomb = self.bombs[i]
       
       if bomb.has_exploded:       # just in case
-        self.bombs.remove(bomb)
+        self.update_bomb_index(bomb)
+        self.__remove_bomb(bomb)
         continue
       
-      bomb.time_of_existence += dt
-            
+      if bomb.movement == Bomb.BOMB_NO_MOVEMENT:
+        i += 1
+        continue
+      
+      if bomb.movement == Bomb.BOMB_FLYING:
+        i += 1
+        distance_to_travel = dt / 1000.0 * Bomb.FLYING_SPEED
+        bomb.flight_info.distance_travelled += distance_to_travel
+        
+        if bomb.flight_info.distance_travelled >= bomb.flight_info.total_distance_to_travel:
+          bomb_tile = bomb.get_tile_position()
+          self.add_sound_event(SoundPlayer.SOUND_EVENT_BOMB_PUT)
+
+          if not self.tile_is_walkable(bomb_tile) or self.tile_has_player(bomb_tile) or self.tile_has_teleport(bomb_tile):
+            destination_tile = (bomb_tile[0] + bomb.flight_info.direction[0],bomb_tile[1] + bomb.flight_info.direction[1])
+            bomb.send_flying(destination_tile)
+          else:        # bomb lands
+            bomb.movement = Bomb.BOMB_NO_MOVEMENT
+            self.update_bomb_index(bomb)
+            self.get_tile_at(bomb_tile).item = None
+            self.__bomb_stopped(bomb)
+      else:
+        self.__roll_bomb(bomb,dt * Bomb.ROLLING_SPEED)
+        
+        if not bomb.has_exploded:
+          i += 1
+
+  #----------------------------------------------------------------------------
+
+  ## Moves a rolling bomb by given distance in fixed point units. The distance is
+  #  split into steps of at most Bomb.MAX_ROLLING_STEP, each followed by the checks
+  #  for lava, arrows and obstacles, so a long time step can't make the bomb skip
+  #  a tile. The cost is proportional to the distance.
+
+  def __roll_bomb(self, bomb, distance_to_travel):
+    while distance_to_travel > 0 and bomb.movement != Bomb.BOMB_NO_MOVEMENT:
+      step_distance = min(distance_to_travel,Bomb.MAX_ROLLING_STEP)
+      distance_to_travel -= step_distance
+      
       bomb_position = bomb.get_position()
       bomb_tile = bomb.get_tile_position()
-
-      if bomb.movement != Bomb.BOMB_FLYING and bomb.time_of_existence > bomb.explodes_in + bomb.detonator_time: # bomb explodes
-        self.bomb_explodes(bomb)
-        continue
-      elif bomb.movement != Bomb.BOMB_FLYING and self.tiles[bomb_tile[1]][bomb_tile[0]].special_object == MapTile.SPECIAL_OBJECT_LAVA and bomb.is_near_tile_center():
+      
+      if self.tiles[bomb_tile[1]][bomb_tile[0]].special_object == MapTile.SPECIAL_OBJECT_LAVA and bomb.is_near_tile_center():
         self.bomb_explodes(bomb)
-        continue
-      else:
-        i += 1
+        return
       
-      if bomb.movement != Bomb.BOMB_NO_MOVEMENT:
-        if bomb.movement == Bomb.BOMB_FLYING:
-          distance_to_travel = dt / 1000.0 * Bomb.FLYING_SPEED
-          bomb.flight_info.distance_travelled += distance_to_travel
-          
-          if bomb.flight_info.distance_travelled >= bomb.flight_info.total_distance_to_travel:
-            bomb_tile = bomb.get_tile_position()
-            self.add_sound_event(SoundPlayer.SOUND_EVENT_BOMB_PUT)
-
-            if not self.tile_is_walkable(bomb_tile) or self.tile_has_player(bomb_tile) or self.tile_has_teleport(bomb_tile):
-              destination_tile = (bomb_tile[0] + bomb.flight_info.direction[0],bomb_tile[1] + bomb.flight_info.direction[1])
-              bomb.send_flying(destination_tile)
-            else:        # bomb lands
-              bomb.movement = Bomb.BOMB_NO_MOVEMENT
-              self.get_tile_at(bomb_tile).item = None        
-        else:            # bomb rolling          
-          if bomb.is_near_tile_center():
-            object_at_tile = self.tiles[bomb_tile[1]][bomb_tile[0]].special_object
-          
-            redirected = False
-          
-            if object_at_tile == MapTile.SPECIAL_OBJECT_ARROW_UP and bomb.movement != Bomb.BOMB_ROLLING_UP:
-              bomb.movement = Bomb.BOMB_ROLLING_UP
-              bomb.set_position((bomb_tile[0] + 0.5,bomb_tile[1]))  # aline with x axis
-              redirected = True
-            elif object_at_tile == MapTile.SPECIAL_OBJECT_ARROW_RIGHT and bomb.movement != Bomb.BOMB_ROLLING_RIGHT:
-              bomb.movement = Bomb.BOMB_ROLLING_RIGHT
-              bomb.set_position((bomb_position[0],bomb_tile[1] + 0.5))
-              redirected = True
-            elif object_at_tile == MapTile.SPECIAL_OBJECT_ARROW_DOWN and bomb.movement != Bomb.BOMB_ROLLING_DOWN:
-              bomb.movement = Bomb.BOMB_ROLLING_DOWN
-              bomb.set_position((bomb_tile[0] + 0.5,bomb_position[1]))
-              redirected = True
-            elif object_at_tile == MapTile.SPECIAL_OBJECT_ARROW_LEFT and bomb.movement != Bomb.BOMB_ROLLING_LEFT:
-              bomb.movement = Bomb.BOMB_ROLLING_LEFT
-              bomb.set_position((bomb_position[0],bomb_tile[1] + 0.5))
-              redirected = True
-        
-            if redirected:
-              bomb_position = bomb.get_position()
-              
-          if self.tiles[bomb_tile[1]][bomb_tile[0]].item != None:   # rolling bomb destroys items
-            self.tiles[bomb_tile[1]][bomb_tile[0]].item = None
-        
-          bomb_position_within_tile = (bomb_position[0] % 1,bomb_position[1] % 1) 
-          check_collision = False
-          forward_tile = None
-          distance_to_travel = dt / 1000.0 * Bomb.ROLLING_SPEED
-          
-          helper_boundaries = (0.5,0.9)
-          helper_boundaries2 = (1 - helper_boundaries[1],1 - helper_boundaries[0])
-        
-          opposite_direction = Bomb.BOMB_NO_MOVEMENT
+      if bomb.is_near_tile_center():
+        object_at_tile = self.tiles[bomb_tile[1]][bomb_tile[0]].special_object
+      
+        if object_at_tile == MapTile.SPECIAL_OBJECT_ARROW_UP and bomb.movement != Bomb.BOMB_ROLLING_UP:
+          bomb.movement = Bomb.BOMB_ROLLING_UP
+          bomb.set_position((bomb_tile[0] + 0.5,bomb_tile[1]))  # aline with x axis
+        elif object_at_tile == MapTile.SPECIAL_OBJECT_ARROW_RIGHT and bomb.movement != Bomb.BOMB_ROLLING_RIGHT:
+          bomb.movement = Bomb.BOMB_ROLLING_RIGHT
+          bomb.set_position((bomb_position[0],bomb_tile[1] + 0.5))
+        elif object_at_tile == MapTile.SPECIAL_OBJECT_ARROW_DOWN and bomb.movement != Bomb.BOMB_ROLLING_DOWN:
+          bomb.movement = Bomb.BOMB_ROLLING_DOWN
+          bomb.set_position((bomb_tile[0] + 0.5,bomb_position[1]))
+        elif object_at_tile == MapTile.SPECIAL_OBJECT_ARROW_LEFT and bomb.movement != Bomb.BOMB_ROLLING_LEFT:
+          bomb.movement = Bomb.BOMB_ROLLING_LEFT
+          bomb.set_position((bomb_position[0],bomb_tile[1] + 0.5))
           
-          if bomb.movement == Bomb.BOMB_ROLLING_UP:
-            bomb.set_position((bomb_position[0],bomb_position[1] - distance_to_travel))
-            opposite_direction = Bomb.BOMB_ROLLING_DOWN
-        
-            if helper_boundaries2[0] < bomb_position_within_tile[1] < helper_boundaries2[1]:
-              check_collision = True
-              forward_tile = (bomb_tile[0],bomb_tile[1] - 1)
-        
-          elif bomb.movement == Bomb.BOMB_ROLLING_RIGHT:
-            bomb.set_position((bomb_position[0] + distance_to_travel,bomb_position[1]))
-            opposite_direction = Bomb.BOMB_ROLLING_LEFT
-          
-            if helper_boundaries[0] < bomb_position_within_tile[0] < helper_boundaries[1]:
-              check_collision = True
-              forward_tile = (bomb_tile[0] + 1,bomb_tile[1])
-          
-          elif bomb.movement == Bomb.BOMB_ROLLING_DOWN:
-            bomb.set_position((bomb_position[0],bomb_position[1] + distance_to_travel))
-            opposite_direction = Bomb.BOMB_ROLLING_UP
-          
-            if helper_boundaries[0] < bomb_position_within_tile[1] < helper_boundaries[1]:
-              check_collision = True
-              forward_tile = (bomb_tile[0],bomb_tile[1] + 1)
-          
-          elif bomb.movement == Bomb.BOMB_ROLLING_LEFT:
-            bomb.set_position((bomb_position[0] - distance_to_travel,bomb_position[1]))        
-            opposite_direction = Bomb.BOMB_ROLLING_RIGHT
+      if self.tiles[bomb_tile[1]][bomb_tile[0]].item != None:   # rolling bomb destroys items
+        self.tiles[bomb_tile[1]][bomb_tile[0]].item = None
+    
+      units = Positionable.POSITION_UNITS
+      bomb_position_within_tile = (bomb.x % units,bomb.y % units)
+      check_collision = False
+      forward_tile = None
+      helper_boundaries = (units // 2,units * 9 // 10)
+      helper_boundaries2 = (units - helper_boundaries[1],units - helper_boundaries[0])
+    
+      opposite_direction = Bomb.BOMB_NO_MOVEMENT
+      
+      if bomb.movement == Bomb.BOMB_ROLLING_UP:
+        bomb.set_fixed_position(bomb.x,bomb.y - step_distance)
+        opposite_direction = Bomb.BOMB_ROLLING_DOWN
+    
+        if helper_boundaries2[0] < bomb_position_within_tile[1] < helper_boundaries2[1]:
+          check_collision = True
+          forward_tile = (bomb_tile[0],bomb_tile[1] - 1)
+    
+      elif bomb.movement == Bomb.BOMB_ROLLING_RIGHT:
+        bomb.set_fixed_position(bomb.x + step_distance,bomb.y)
+        opposite_direction = Bomb.BOMB_ROLLING_LEFT
+      
+        if helper_boundaries[0] < bomb_position_within_tile[0] < helper_boundaries[1]:
+          check_collision = True
+          forward_tile = (bomb_tile[0] + 1,bomb_tile[1])
+      
+      elif bomb.movement == Bomb.BOMB_ROLLING_DOWN:
+        bomb.set_fixed_position(bomb.x,bomb.y + step_distance)
+        opposite_direction = Bomb.BOMB_ROLLING_UP
+      
+        if helper_boundaries[0] < bomb_position_within_tile[1] < helper_boundaries[1]:
+          check_collision = True
+          forward_tile = (bomb_tile[0],bomb_tile[1] + 1)
+      
+      elif bomb.movement == Bomb.BOMB_ROLLING_LEFT:
+        bomb.set_fixed_position(bomb.x - step_distance,bomb.y)
+        opposite_direction = Bomb.BOMB_ROLLING_RIGHT
 
-            if helper_boundaries2[0] < bomb_position_within_tile[0] < helper_boundaries2[1]:
-              check_collision = True
-              forward_tile = (bomb_tile[0] - 1,bomb_tile[1])
+        if helper_boundaries2[0] < bomb_position_within_tile[0] < helper_boundaries2[1]:
+          check_collision = True
+          forward_tile = (bomb_tile[0] - 1,bomb_tile[1])
 
-          if check_collision and (not self.tile_is_walkable(forward_tile) or self.tile_has_player(forward_tile) or self.tile_has_teleport(forward_tile)):
-            bomb.move_to_tile_center()          
-          
-            if bomb.has_spring:
-              bomb.movement = opposite_direction
-              self.add_sound_event(SoundPlayer.SOUND_EVENT_SPRING)
-            else:
-              bomb.movement = Bomb.BOMB_NO_MOVEMENT
-              self.add_sound_event(SoundPlayer.SOUND_EVENT_KICK)
+      if check_collision and (not self.tile_is_walkable(forward_tile) or self.tile_has_player(forward_tile) or self.tile_has_teleport(forward_tile)):
+        bomb.move_to_tile_center()          
+      
+        if bomb.has_spring:
+          bomb.movement = opposite_direction
+          self.add_sound_event(SoundPlayer.SOUND_EVENT_SPRING)
+        else:
+          bomb.movement = Bomb.BOMB_NO_MOVEMENT
+          self.add_sound_event(SoundPlayer.SOUND_EVENT_KICK)
+          self.__bomb_stopped(bomb)
+
+  #----------------------------------------------------------------------------
+
+  ## Must be called when a bomb stops moving. Bombs standing still aren't updated
+  #  every frame, so if the bomb should have already exploded (while flying) or
+  #  has stopped on lava, its explosion is scheduled for the next update.
+
+  def __bomb_stopped(self, bomb):
+    bomb_tile = bomb.get_tile_position()
+    
+    if bomb.explodes_at < self.time_from_start or self.tile_has_lava(bomb_tile):
+      self.schedule_timer(self.time_from_start,GameMap.TIMER_BOMB_EXPLOSION,bomb)
 
   #----------------------------------------------------------------------------
 
   def __update_players(self, dt, immortal_player_numbers):
-    time_now = pygame.time.get_ticks()
+    time_now = self.time_from_start
     release_disease_cloud = False
     
     if time_now > self.create_disease_cloud_at:
@@ -1849,13 +3592,8 @@ class GameMap(object):
         continue
       
       if release_disease_cloud and player.get_disease() != Player.DISEASE_NONE:
-        self.add_animation_event(Renderer.ANIMATION_EVENT_DISEASE_CLOUD,Renderer.map_position_to_pixel_position(player.get_position(),(0,0)))
+        self.add_animation_event(Renderer.ANIMATION_EVENT_DISEASE_CLOUD,player.get_position())
       
-      if self.winning_color == -1:
-        self.winning_color = player.get_team_number()
-      elif self.winning_color != player.get_team_number():
-        self.game_is_over = False
-        
       player_tile_position = player.get_tile_position()
       player_tile = self.tiles[player_tile_position[1]][player_tile_position[0]]
       
@@ -1898,7 +3636,7 @@ class GameMap(object):
             transmitted = True
             player_at_tile.set_disease(player.get_disease(),player.get_disease_time())  # transmit disease
           
-        if transmitted and random.randint(0,2) == 0:
+        if transmitted and self.random.randint(0,2) == 0:
           self.add_sound_event(SoundPlayer.SOUND_EVENT_GO_AWAY)
 
   #----------------------------------------------------------------------------
@@ -1908,60 +3646,56 @@ class GameMap(object):
   def update(self, dt, immortal_player_numbers=[]):
     self.time_from_start += dt
     
-    self.danger_map_is_up_to_date = False    # reset this each frame
-    
-    i = 0
-    
-    self.earthquake_time_left = max(0,self.earthquake_time_left - dt)
-    
-    while i < len(self.items_to_give_away):  # giving away items of dead players
-      item = self.items_to_give_away[i]
-      
-      if self.time_from_start >= item[0]:
-        self.spread_items(item[1])
-        self.items_to_give_away.remove(item)
-        
-        debug_log("giving away items")
-          
-      i += 1
+    self.__process_timers()     # bomb explosions, flame burnouts, giving away items etc.
 
     self.__update_bombs(dt)
 
-    for line in self.tiles:
-      for tile in line:
-        if tile.to_be_destroyed and tile.kind == MapTile.TILE_BLOCK and not self.tile_has_flame(tile.coordinates):
-          tile.kind = MapTile.TILE_FLOOR
-          self.number_of_blocks -= 1
-          tile.to_be_destroyed = False
-        
-        i = 0
-        
-        while True:
-          if i >= len(tile.flames):
-            break
-          
-          if tile.kind == MapTile.TILE_BLOCK:  # flame on a block tile -> destroy the block
-            tile.to_be_destroyed = True
-          elif tile.kind == MapTile.TILE_FLOOR and tile.item != None:
-            tile.item = None                   # flame destroys the item
-          
-          bombs_inside_flame = self.bombs_on_tile(tile.coordinates)
-          
-          for bomb in bombs_inside_flame:      # bomb inside flame -> detonate it
-            self.bomb_explodes(bomb)
+    tile_grid = self.tile_grid
+
+    # Only the active tiles (with flames or waiting to be destroyed) are updated,
+    # in the order of their indices. Exploding bombs can activate new tiles during
+    # the pass, those with greater index than the current one are still updated
+    # in this pass. Flames are removed by timers (see __burn_out_flames).
+
+    tiles_to_update = list(tile_grid.active_tiles)
+    heapq.heapify(tiles_to_update)
+    tiles_queued = set(tiles_to_update)
+
+    while len(tiles_to_update) > 0:
+      index = heapq.heappop(tiles_to_update)
+      flames = tile_grid.flames[index]
+      
+      if tile_grid.to_be_destroyed[index] and tile_grid.kinds[index] == MapTile.TILE_BLOCK and len(flames) == 0:   # (walkability doesn't change here)
+        tile_grid.to_be_destroyed[index] = 0
+        tile_grid.block_destroyed(index)
+        self.number_of_blocks -= 1
+      
+      if len(flames) > 0:
+        if tile_grid.kinds[index] == MapTile.TILE_BLOCK:  # flame on a block tile -> destroy the block
+          if not tile_grid.to_be_destroyed[index]:
+            tile_grid.to_be_destroyed[index] = 1
+            tile_grid.update_walkability(index)
+            tile_grid.update_tile_hash(index)
+            self.__tile_walkability_changed(index)
+        elif tile_grid.kinds[index] == MapTile.TILE_FLOOR and tile_grid.items[index] != TileGrid.NO_VALUE:
+          tile_grid.items[index] = TileGrid.NO_VALUE      # flame destroys the item
+          tile_grid.update_free_floor(index)
+          tile_grid.update_tile_hash(index)
+        
+        bombs_inside_flame = tile_grid.bombs[index]
+        
+        if len(bombs_inside_flame) > 0:
+          while len(bombs_inside_flame) > 0:   # bomb inside flame -> detonate it (this removes it from the list)
+            self.bomb_explodes(bombs_inside_flame[0])
           
-          flame = tile.flames[i]
-          
-          flame.time_to_burnout -= dt
-          
-          if flame.time_to_burnout < 0:
-            tile.flames.remove(flame)
-      
-          i += 1
+          for new_index in tile_grid.active_tiles:
+            if new_index > index and not new_index in tiles_queued:
+              heapq.heappush(tiles_to_update,new_index)
+              tiles_queued.add(new_index)
+        
+      if len(flames) == 0 and not tile_grid.to_be_destroyed[index]:
+        tile_grid.active_tiles.discard(index)
     
-    self.game_is_over = True
-    self.winning_color = -1
-
     self.__update_players(dt,immortal_player_numbers)
           
     if self.state == GameMap.STATE_WAITING_TO_PLAY:  
@@ -1973,12 +3707,15 @@ class GameMap(object):
         self.state = GameMap.STATE_GAME_OVER
       elif not self.win_announced:
         if self.time_from_start >= self.announce_win_at:
-          self.add_sound_event(SoundPlayer.SOUND_EVENT_WIN_0 + self.winner_team)
+          if self.winner_team <= 9:
+            self.add_sound_event(SoundPlayer.SOUND_EVENT_WIN_0 + self.winner_team)
+          else:                                     # only the first 10 teams have their own sound
+            self.add_sound_event(SoundPlayer.SOUND_EVENT_CONFIRM)
           self.win_announced = True
-    elif self.state != GameMap.STATE_GAME_OVER and self.game_is_over:
+    elif self.state != GameMap.STATE_GAME_OVER and self.game_is_decided():
       self.end_game_at = self.time_from_start + 5000
       self.state = GameMap.STATE_FINISHING
-      self.winner_team = self.winning_color
+      self.winner_team = list(self.team_alive_counts)[0] if len(self.team_alive_counts) == 1 else -1
       self.announce_win_at = self.time_from_start + 2000
     
   #----------------------------------------------------------------------------
@@ -1987,14 +3724,84 @@ class GameMap(object):
     return self.winner_team
 
   #----------------------------------------------------------------------------
+
+  ## Must be called when a player dies (Player.kill does it), keeps the numbers of
+  #  players alive in each team up to date.
+
+  def player_killed(self, player):
+    self.alive_players.remove(player)
+    team_number = player.get_team_number()
+    self.team_alive_counts[team_number] -= 1
+    
+    if self.team_alive_counts[team_number] == 0:
+      del self.team_alive_counts[team_number]
+
+  #----------------------------------------------------------------------------
+
+  ## Checks if at most one team has players alive, i.e. the game is over (even
+  #  though the map may still be in STATE_FINISHING for a while).
+
+  def game_is_decided(self):
+    return len(self.team_alive_counts) <= 1
+
+  #----------------------------------------------------------------------------
     
   def get_state(self):
     return self.state
 
   #----------------------------------------------------------------------------
     
-  def add_bomb(self, bomb):
-    self.bombs.append(bomb)
+  def add_bomb(self, bomb):
+    self.bombs.append(bomb)
+    bomb.placed_at = self.time_from_start
+    bomb.game_map = self
+    bomb.explodes_at = bomb.placed_at + bomb.explodes_in + bomb.detonator_time
+    bomb.hash_key = 0                 # the key is computed by the next get_state_hash
+    self.hash_key_changed(bomb)
+    self.update_bomb_index(bomb)
+    self.schedule_timer(bomb.explodes_at,GameMap.TIMER_BOMB_EXPLOSION,bomb)
+    self.__bomb_stopped(bomb)
+
+  #----------------------------------------------------------------------------
+
+  ## Keeps the tile -> bombs index (see bombs_on_tile) and the bomb's danger
+  #  (see update_bomb_danger) up to date, this has to be called whenever a bomb
+  #  changes its position, starts or stops flying or explodes (Bomb.set_position
+  #  does it automatically).
+
+  def update_bomb_index(self, bomb):
+    self.update_bomb_danger(bomb,False)
+    
+    new_index = None
+    
+    if not bomb.has_exploded and bomb.movement != Bomb.BOMB_FLYING:
+      bomb_tile = bomb.get_tile_position()
+      
+      if self.tile_is_withing_map(bomb_tile):
+        new_index = self.tile_grid.tile_index(bomb_tile)
+    
+    if new_index == bomb.tile_index:
+      return
+    
+    old_index = bomb.tile_index
+    
+    if old_index != None:
+      self.tile_grid.bombs[old_index].remove(bomb)
+      self.tile_grid.update_walkability(old_index)
+      
+    if new_index != None:
+      self.tile_grid.bombs[new_index].append(bomb)
+      self.tile_grid.update_walkability(new_index)
+      
+    bomb.tile_index = new_index
+    
+    # bombs block flames, so this may change the danger around:
+    
+    if old_index != None:
+      self.__tile_walkability_changed(old_index)
+      
+    if new_index != None:
+      self.__tile_walkability_changed(new_index)
 
   #----------------------------------------------------------------------------
 
@@ -2008,6 +3815,16 @@ class GameMap(object):
 
   #----------------------------------------------------------------------------
 
+  def get_width(self):
+    return self.width
+
+  #----------------------------------------------------------------------------
+
+  def get_height(self):
+    return self.height
+
+  #----------------------------------------------------------------------------
+
   def get_players(self):
     return self.players
 
@@ -2087,6 +3904,19 @@ class PlaySetup(object):
   
   def decrease_number_of_games(self):
     self.number_of_games = (self.number_of_games - 2) % PlaySetup.MAX_GAMES + 1
+
+  #----------------------------------------------------------------------------
+  
+  ## Sets up a large lobby of given number of AI players (up to GameMap.MAX_PLAYERS)
+  #  split evenly into given number of teams (at least 1 and at most one per
+  #  player). The map only gives starting positions for the first 10 players, the
+  #  rest start on random floor tiles. Empty slots are added up to 10 so that the
+  #  setup can still be changed in the menu.
+  
+  def set_ai_lobby(self, number_of_players, number_of_teams):
+    number_of_players = min(number_of_players,GameMap.MAX_PLAYERS)
+    number_of_teams = max(1,min(number_of_teams,number_of_players))
+    self.player_slots = [(-1,i % number_of_teams) for i in range(number_of_players)] + [None for i in range(10 - number_of_players)]
    
 #==============================================================================
 
@@ -2172,8 +4002,8 @@ class PlayerKeyMaps(StringSerializable):
   def __init__(self):
     self.key_maps = {}  ##< maps keys to tuples of a format: (player_number, action), for general actions player_number will be -1
     
-    self.bomb_key_last_pressed_time = [0 for i in range(10)]  ##< for bomb double press detection
-    self.bomb_key_previous_state = [False for i in range(10)] ##< for bomb double press detection
+    self.bomb_key_last_pressed_time = {}  ##< maps player numbers to times of the last bomb key press, for bomb double press detection
+    self.bomb_key_previous_state = {}     ##< maps player numbers to bomb key states in the previous call, for bomb double press detection
 
     self.allow_mouse_control = False    ##< if true, player movement by mouse is allowed, otherwise not
 
@@ -2491,7 +4321,7 @@ class PlayerKeyMaps(StringSerializable):
 
     result = []
 
-    reset_bomb_key_previous_state = [True for i in range(10)]
+    bomb_key_pressed = set()    # numbers of players whose bomb key is pressed
 
     # check mouse control:
 
@@ -2555,17 +4385,17 @@ class PlayerKeyMaps(StringSerializable):
         if action_tuple[1] == PlayerKeyMaps.ACTION_BOMB:
           player_number = action_tuple[0]
           
-          if self.bomb_key_previous_state[player_number] == False and pygame.time.get_ticks() - self.bomb_key_last_pressed_time[player_number] < 200:
+          if not self.bomb_key_previous_state.get(player_number,False) and pygame.time.get_ticks() - self.bomb_key_last_pressed_time.get(player_number,0) < 200:
             result.append((player_number,PlayerKeyMaps.ACTION_BOMB_DOUBLE))
           
           self.bomb_key_last_pressed_time[player_number] = pygame.time.get_ticks()
           
           self.bomb_key_previous_state[player_number] = True
-          reset_bomb_key_previous_state[player_number] = False
+          bomb_key_pressed.add(player_number)
 
-    for i in range(10):
-      if reset_bomb_key_previous_state[i]:
-        self.bomb_key_previous_state[i] = False
+    for player_number in self.bomb_key_previous_state:
+      if not player_number in bomb_key_pressed:
+        self.bomb_key_previous_state[player_number] = False
 
     return result
 
@@ -3432,12 +5262,14 @@ class PlaySetupMenu(Menu):
     self.items[0].append("back")
     self.items[1].append("next")
          
-    for i in range(10):
+    slots = self.play_setup.get_slots()
+         
+    for i in range(len(slots)):
       slot_color = Renderer.COLOR_RGB_VALUES[i] if i != Game.COLOR_BLACK else dark_grey  # black with black border not visible, use dark grey
       
       self.items[0].append(Renderer.colored_text(i,str(i + 1)) + ": ")
       
-      slot = self.play_setup.get_slots()[i]
+      slot = slots[i]
       
       if slot == None:
         self.items[0][-1] += "-"
@@ -3482,7 +5314,7 @@ class PlaySetupMenu(Menu):
           # changing teams
         
           if slot != None:
-            slots[self.selected_item[0] - 1] = (slot[0],(slot[1] + 1) % 10)
+            slots[self.selected_item[0] - 1] = (slot[0],(slot[1] + 1) % len(slots))
       
         self.state = Menu.MENU_STATE_SELECTING
       
@@ -3503,6 +5335,11 @@ class Renderer(object):
     (168,127,56),            # brown
     (209,117,206)            # purple
     ]
+  
+  # colors for teams above 10 (large lobbies) are generated, going around the hue
+  # circle by the golden angle gives distinct neighbouring colors:
+  
+  COLOR_RGB_VALUES += [tuple([int(c * 255) for c in colorsys.hsv_to_rgb((i * 0.618034) % 1.0,0.7,0.9)]) for i in range(GameMap.MAX_PLAYERS - len(COLOR_RGB_VALUES))]
     
   MAP_TILE_WIDTH = 50              ##< tile width in pixels
   MAP_TILE_HEIGHT = 45             ##< tile height in pixels
@@ -3534,6 +5371,7 @@ class Renderer(object):
   #----------------------------------------------------------------------------
 
   def __init__(self):
+    self.map_size = (GameMap.MAP_WIDTH,GameMap.MAP_HEIGHT)    ##< size (in tiles) of the map being rendered
     self.update_screen_info()
 
     self.environment_images = {}
@@ -3558,31 +5396,12 @@ class Renderer(object):
       self.environment_images[environment_name] = (pygame.image.load(filename_floor),pygame.image.load(filename_block),pygame.image.load(filename_wall))
 
     self.prerendered_map = None     # keeps a reference to a map for which some parts have been prerendered
-    self.prerendered_map_background = pygame.Surface((GameMap.MAP_WIDTH * Renderer.MAP_TILE_WIDTH + 2 * Renderer.MAP_BORDER_WIDTH,GameMap.MAP_HEIGHT * Renderer.MAP_TILE_HEIGHT + 2 * Renderer.MAP_BORDER_WIDTH))
+    self.prerendered_map_background = None
 
-    self.player_images = []         ##< player images in format [color index]["sprite name"] and [color index]["sprite name"][frame]
+    self.player_images = {}         ##< player images in format [color index]["sprite name"] and [color index]["sprite name"][frame], see get_player_images
 
-    for i in range(10):
-      self.player_images.append({})
-      
-      for helper_string in ["up","right","down","left"]:
-        self.player_images[-1][helper_string] =  self.color_surface(pygame.image.load(os.path.join(Game.RESOURCE_PATH,"player_" + helper_string + ".png")),i)
-        
-        string_index = "walk " + helper_string
-      
-        self.player_images[-1][string_index] = []
-        self.player_images[-1][string_index].append(self.color_surface(pygame.image.load(os.path.join(Game.RESOURCE_PATH,"player_" + helper_string + "_walk1.png")),i))
-        
-        if helper_string == "up" or helper_string == "down":
-          self.player_images[-1][string_index].append(self.color_surface(pygame.image.load(os.path.join(Game.RESOURCE_PATH,"player_" + helper_string + "_walk2.png")),i))
-        else:
-          self.player_images[-1][string_index].append(self.player_images[-1][helper_string])
-        
-        self.player_images[-1][string_index].append(self.color_surface(pygame.image.load(os.path.join(Game.RESOURCE_PATH,"player_" + helper_string + "_walk3.png")),i))
-        self.player_images[-1][string_index].append(self.player_images[-1][string_index][0])
-        
-        string_index = "box " + helper_string
-        self.player_images[-1][string_index] = self.color_surface(pygame.image.load(os.path.join(Game.RESOURCE_PATH,"player_" + helper_string + "_box.png")),i)
+    for i in range(10):             # the generated colors are only made when needed
+      self.get_player_images(i)
      
     self.bomb_images = []
     self.bomb_images.append(pygame.image.load(os.path.join(Game.RESOURCE_PATH,"bomb1.png")))
@@ -3635,7 +5454,7 @@ class Renderer(object):
     self.gui_images["prompt"] = self.render_text(self.font_normal,"You sure?",(255,255,255))
     self.gui_images["version"] = self.render_text(self.font_small,"v " + Game.VERSION_STR,(0,100,0))
     
-    self.player_info_board_images = [None for i in range(10)]  # up to date infoboard image for each player
+    self.player_info_board_images = {}  # up to date infoboard image for each player number
 
     self.gui_images["out"] = pygame.image.load(os.path.join(Game.RESOURCE_PATH,"gui_out.png"))   
      
@@ -3714,7 +5533,7 @@ class Renderer(object):
   def update_screen_info(self):
     self.screen_resolution = Renderer.get_screen_size()
     self.screen_center = (self.screen_resolution[0] / 2,self.screen_resolution[1] / 2)
-    self.map_render_location = Renderer.get_map_render_position()
+    self.map_render_location = Renderer.get_map_render_position(self.map_size)
 
   #----------------------------------------------------------------------------
   
@@ -3771,16 +5590,22 @@ class Renderer(object):
 
   #----------------------------------------------------------------------------
 
+  ## Gets the pixel position at which a map of given size (in tiles, default size
+  #  if None) is rendered so that it's centered on the screen.
+
   @staticmethod  
-  def get_map_render_position(): 
+  def get_map_render_position(map_size=None): 
+    if map_size == None:
+      map_size = (GameMap.MAP_WIDTH,GameMap.MAP_HEIGHT)
+    
     screen_size = Renderer.get_screen_size()
-    return ((screen_size[0] - Renderer.MAP_BORDER_WIDTH * 2 - Renderer.MAP_TILE_WIDTH * GameMap.MAP_WIDTH) / 2,(screen_size[1] - Renderer.MAP_BORDER_WIDTH * 2 - Renderer.MAP_TILE_HEIGHT * GameMap.MAP_HEIGHT - 50) / 2)  
+    return ((screen_size[0] - Renderer.MAP_BORDER_WIDTH * 2 - Renderer.MAP_TILE_WIDTH * map_size[0]) / 2,(screen_size[1] - Renderer.MAP_BORDER_WIDTH * 2 - Renderer.MAP_TILE_HEIGHT * map_size[1] - 50) / 2)  
 
   #----------------------------------------------------------------------------
     
   @staticmethod
-  def map_position_to_pixel_position(map_position, offset = (0,0)):
-    map_render_location = Renderer.get_map_render_position()
+  def map_position_to_pixel_position(map_position, offset = (0,0), map_size = None):
+    map_render_location = Renderer.get_map_render_position(map_size)
     return (map_render_location[0] + int(map_position[0] * Renderer.MAP_TILE_WIDTH) + Renderer.MAP_BORDER_WIDTH + offset[0],map_render_location[1] + int(map_position[1] * Renderer.MAP_TILE_HEIGHT) + Renderer.MAP_BORDER_WIDTH + offset[1])
     
   def set_resolution(self, new_resolution):
@@ -3806,33 +5631,58 @@ class Renderer(object):
 
   #----------------------------------------------------------------------------
 
+  ## Returns the player images (see self.player_images) for given color, makes them
+  #  first if they haven't been made yet.
+
+  def get_player_images(self, color_index):
+    if color_index in self.player_images:
+      return self.player_images[color_index]
+    
+    images = {}
+    
+    for helper_string in ["up","right","down","left"]:
+      images[helper_string] =  self.color_surface(pygame.image.load(os.path.join(Game.RESOURCE_PATH,"player_" + helper_string + ".png")),color_index)
+      
+      string_index = "walk " + helper_string
+    
+      images[string_index] = []
+      images[string_index].append(self.color_surface(pygame.image.load(os.path.join(Game.RESOURCE_PATH,"player_" + helper_string + "_walk1.png")),color_index))
+      
+      if helper_string == "up" or helper_string == "down":
+        images[string_index].append(self.color_surface(pygame.image.load(os.path.join(Game.RESOURCE_PATH,"player_" + helper_string + "_walk2.png")),color_index))
+      else:
+        images[string_index].append(images[helper_string])
+      
+      images[string_index].append(self.color_surface(pygame.image.load(os.path.join(Game.RESOURCE_PATH,"player_" + helper_string + "_walk3.png")),color_index))
+      images[string_index].append(images[string_index][0])
+      
+      string_index = "box " + helper_string
+      images[string_index] = self.color_surface(pygame.image.load(os.path.join(Game.RESOURCE_PATH,"player_" + helper_string + "_box.png")),color_index)
+      
+    self.player_images[color_index] = images
+    
+    return images
+
+  #----------------------------------------------------------------------------
+
   ## Updates info board images in self.player_info_board_images. This should be called each frame, as
   #  rerendering is done only when needed.
 
   def update_info_boards(self, players):
-    for i in range(10):      # for each player number
+    for player in players:
+      i = player.get_number()
       
       update_needed = False
       
-      if self.player_info_board_images[i] == None:
+      if not i in self.player_info_board_images:
         self.player_info_board_images[i] = self.gui_images["info board"].copy()
         
         update_needed = True
       
-      player = None
-      
-      for one_player in players:
-        if one_player.get_number() == i:
-          player = one_player
-          break
-      
-      if player == None:
-        continue
-      
       if player.info_board_needs_update():
         update_needed = True
       
-      if not update_needed or player == None:
+      if not update_needed:
         continue
       
       # rerendering needed here
@@ -3937,7 +5787,7 @@ class Renderer(object):
 
   def process_animation_events(self, animation_event_list):
     for animation_event in animation_event_list:
-      self.animations[animation_event[0]].play(animation_event[1])
+      self.animations[animation_event[0]].play(Renderer.map_position_to_pixel_position(animation_event[1],animation_event[2],self.map_size))
 
   #----------------------------------------------------------------------------
 
@@ -4106,7 +5956,7 @@ class Renderer(object):
         if int(pygame.time.get_ticks() / 500) % 2 == 0:
           direction_string = "box " + direction_string
         
-        result.blit(self.player_images[player_info[1]][direction_string],player_coords)
+        result.blit(self.get_player_images(player_info[1])[direction_string],player_coords)
     
       for bomb_info in self.party_bombs:
         result.blit(self.bomb_images[0],(bomb_info[0],bomb_info[1]))
@@ -4268,14 +6118,14 @@ class Renderer(object):
     
       map_info_border_size = 5
     
-      self.preview_map_image = pygame.Surface((tile_size * GameMap.MAP_WIDTH,tile_size * GameMap.MAP_HEIGHT + map_info_border_size + Renderer.MAP_TILE_HEIGHT))
-    
       with open(os.path.join(Game.MAP_PATH,map_filename)) as map_file:
         map_data = map_file.read()
         temp_map = GameMap(map_data,PlaySetup(),0,0)
         
-        for y in range(GameMap.MAP_HEIGHT):
-          for x in range(GameMap.MAP_WIDTH):
+        self.preview_map_image = pygame.Surface((tile_size * temp_map.get_width(),tile_size * temp_map.get_height() + map_info_border_size + Renderer.MAP_TILE_HEIGHT))
+        
+        for y in range(temp_map.get_height()):
+          for x in range(temp_map.get_width()):
             tile = temp_map.get_tile_at((x,y))
             tile_kind = tile.kind
             
@@ -4308,12 +6158,15 @@ class Renderer(object):
         starting_positions = temp_map.get_starting_positions()
 
         for player_index in range(len(starting_positions)):
+          if starting_positions[player_index] == None:
+            continue
+          
           draw_position = (int(starting_positions[player_index][0]) * tile_size + tile_half_size,int(starting_positions[player_index][1]) * tile_size + tile_half_size)
            
           pygame.draw.rect(self.preview_map_image,tile_color,pygame.Rect(pos_x,pos_y,tile_size,tile_size))
           pygame.draw.circle(self.preview_map_image,Renderer.COLOR_RGB_VALUES[player_index],draw_position,tile_half_size)
 
-        y = tile_size * GameMap.MAP_HEIGHT + map_info_border_size
+        y = tile_size * temp_map.get_height() + map_info_border_size
         column = 0
 
         self.preview_map_image.blit(self.environment_images[temp_map.get_environment_name()][0],(0,y))
@@ -4361,10 +6214,14 @@ class Renderer(object):
     image_lava = pygame.image.load(os.path.join(Game.RESOURCE_PATH,"other_lava.png"))
     image_background = pygame.image.load(os.path.join(Game.RESOURCE_PATH,"other_map_background.png"))
 
+    self.map_size = (map_to_render.get_width(),map_to_render.get_height())
+    self.map_render_location = Renderer.get_map_render_position(self.map_size)
+    self.prerendered_map_background = pygame.Surface((self.map_size[0] * Renderer.MAP_TILE_WIDTH + 2 * Renderer.MAP_BORDER_WIDTH,self.map_size[1] * Renderer.MAP_TILE_HEIGHT + 2 * Renderer.MAP_BORDER_WIDTH))
+
     self.prerendered_map_background.blit(image_background,(0,0))
 
-    for j in range(GameMap.MAP_HEIGHT):
-      for i in range(GameMap.MAP_WIDTH):
+    for j in range(self.map_size[1]):
+      for i in range(self.map_size[0]):
         render_position = (i * Renderer.MAP_TILE_WIDTH + Renderer.MAP_BORDER_WIDTH,j * Renderer.MAP_TILE_HEIGHT + + Renderer.MAP_BORDER_WIDTH)          
         self.prerendered_map_background.blit(self.environment_images[map_to_render.get_environment_name()][0],render_position)
        
@@ -4419,15 +6276,15 @@ class Renderer(object):
               
       scale = (1 + 0.5 * quotient)
               
-      player_image = self.player_images[color_index]["down"]
+      player_image = self.get_player_images(color_index)["down"]
       image_to_render = pygame.transform.scale(player_image,(int(scale * player_image.get_size()[0]),int(scale * player_image.get_size()[1])))
       draw_shadow = False
               
       relative_offset[0] = -1 * (image_to_render.get_size()[0] / 2 - Renderer.PLAYER_SPRITE_CENTER[0])                   # offset caused by scale  
-      relative_offset[1] = -1 * int(math.sin(quotient * math.pi / 2.0) * Renderer.MAP_TILE_HEIGHT * GameMap.MAP_HEIGHT)  # height offset
+      relative_offset[1] = -1 * int(math.sin(quotient * math.pi / 2.0) * Renderer.MAP_TILE_HEIGHT * self.map_size[1])  # height offset
 
     elif player.is_teleporting():
-      image_to_render = self.player_images[color_index][("up","right","down","left")[animation_frame]]
+      image_to_render = self.get_player_images(color_index)[("up","right","down","left")[animation_frame]]
 
     elif player.is_boxing() or player.is_throwing():
       if not player.is_throwing() and animation_frame == 0:
@@ -4437,14 +6294,14 @@ class Renderer(object):
 
       helper_string += ("up","right","down","left")[player.get_direction_number()]
 
-      image_to_render = self.player_images[color_index][helper_string]
+      image_to_render = self.get_player_images(color_index)[helper_string]
     else:
       helper_string = ("up","right","down","left")[player.get_direction_number()]
 
       if player.is_walking():
-        image_to_render = self.player_images[color_index]["walk " + helper_string][animation_frame]
+        image_to_render = self.get_player_images(color_index)["walk " + helper_string][animation_frame]
       else:
-        image_to_render = self.player_images[color_index][helper_string]
+        image_to_render = self.get_player_images(color_index)[helper_string]
 
     if player.get_disease() != Player.DISEASE_NONE:
       overlay_images.append(self.other_images["disease"][animation_frame % 2]) 
@@ -4492,7 +6349,10 @@ class Renderer(object):
 
   #----------------------------------------------------------------------------
 
-  def render_map(self, map_to_render):
+  ## Renders the map, interpolation (0 to 1) says where between the last two simulation
+  #  ticks the players and bombs should be drawn (see Positionable.get_interpolated_position).
+
+  def render_map(self, map_to_render, interpolation=1.0):
     result = pygame.Surface(self.screen_resolution)
     
     self.menu_background_image = None             # unload unneccessarry images
@@ -4512,10 +6372,12 @@ class Renderer(object):
     # order the players and bombs by their y position so that they are drawn correctly
 
     profiler.measure_start("map rend. sort")
-    ordered_objects_to_render = []
-    ordered_objects_to_render.extend(map_to_render.get_players())
-    ordered_objects_to_render.extend(map_to_render.get_bombs())
-    ordered_objects_to_render.sort(key = lambda what: 1000 if (isinstance(what,Bomb) and what.movement == Bomb.BOMB_FLYING) else what.get_position()[1])   # flying bombs are rendered above everything else
+    ordered_objects_to_render = []    # list of tuples (render position, object)
+    
+    for object_to_render in map_to_render.get_players() + map_to_render.get_bombs():
+      ordered_objects_to_render.append((object_to_render.get_interpolated_position(interpolation),object_to_render))
+    
+    ordered_objects_to_render.sort(key = lambda what: 1000 if (isinstance(what[1],Bomb) and what[1].movement == Bomb.BOMB_FLYING) else what[0][1])   # flying bombs are rendered above everything else
     profiler.measure_stop("map rend. sort")
     
     # render the map by lines:
@@ -4533,15 +6395,15 @@ class Renderer(object):
     flame_animation_frame = (pygame.time.get_ticks() / 100) % 2
     
     for line in tiles:
-      x = (GameMap.MAP_WIDTH - 1) * Renderer.MAP_TILE_WIDTH + Renderer.MAP_BORDER_WIDTH + self.map_render_location[0]
+      x = (self.map_size[0] - 1) * Renderer.MAP_TILE_WIDTH + Renderer.MAP_BORDER_WIDTH + self.map_render_location[0]
       
       while True:                  # render players and bombs in the current line 
         if object_to_render_index >= len(ordered_objects_to_render):
           break
         
-        object_to_render = ordered_objects_to_render[object_to_render_index]
+        object_position, object_to_render = ordered_objects_to_render[object_to_render_index]
         
-        if object_to_render.get_position()[1] > line_number + 1:
+        if object_position[1] > line_number + 1:
           break
         
         if isinstance(object_to_render,Player):
@@ -4554,14 +6416,14 @@ class Renderer(object):
           continue
 
         if draw_shadow:
-          render_position = self.tile_position_to_pixel_position(object_to_render.get_position(),Renderer.SHADOW_SPRITE_CENTER)
+          render_position = self.tile_position_to_pixel_position(object_position,Renderer.SHADOW_SPRITE_CENTER)
           render_position = (
             (render_position[0] + Renderer.MAP_BORDER_WIDTH + relative_offset[0]) % self.prerendered_map_background.get_size()[0] + self.map_render_location[0],
             render_position[1] + Renderer.MAP_BORDER_WIDTH + self.map_render_location[1])
 
           result.blit(self.other_images["shadow"],render_position)
         
-        render_position = self.tile_position_to_pixel_position(object_to_render.get_position(),sprite_center)
+        render_position = self.tile_position_to_pixel_position(object_position,sprite_center)
         render_position = ((render_position[0] + Renderer.MAP_BORDER_WIDTH + relative_offset[0]) % self.prerendered_map_background.get_size()[0] + self.map_render_location[0],render_position[1] + Renderer.MAP_BORDER_WIDTH + relative_offset[1] + self.map_render_location[1])
         
         result.blit(image_to_render,render_position)
@@ -4593,7 +6455,7 @@ class Renderer(object):
   
         profiler.measure_stop("map rend. tiles")
   
-      x = (GameMap.MAP_WIDTH - 1) * Renderer.MAP_TILE_WIDTH + Renderer.MAP_BORDER_WIDTH + self.map_render_location[0]
+      x = (self.map_size[0] - 1) * Renderer.MAP_TILE_WIDTH + Renderer.MAP_BORDER_WIDTH + self.map_render_location[0]
   
       y += Renderer.MAP_TILE_HEIGHT
       line_number += 1
@@ -4617,7 +6479,7 @@ class Renderer(object):
     y = self.map_render_location[1] + self.prerendered_map_background.get_size()[1] + 20
       
     for i in players_by_numbers:
-      if players_by_numbers[i] == None or self.player_info_board_images[i] == None:
+      if players_by_numbers[i] == None or not i in self.player_info_board_images:
         continue
         
       if players_by_numbers[i].is_dead():
@@ -4669,6 +6531,21 @@ class AI(object):
     
     self.do_nothing = False     ##< this can turn AI off for debugging purposes
     self.didnt_move_since = 0 
+    self.random = game_map.get_random_substream(player.get_number())  ##< each AI has its own random stream
+
+  #----------------------------------------------------------------------------
+
+  ## Returns a tuple describing the AI's state, see Simulation.snapshot.
+
+  def get_snapshot(self):
+    return (tuple(self.outputs),self.recompute_compute_actions_on,self.didnt_move_since,self.random.getstate())
+
+  #----------------------------------------------------------------------------
+
+  def restore_snapshot(self, values):
+    self.outputs = list(values[0])
+    self.recompute_compute_actions_on, self.didnt_move_since = values[1:3]
+    self.random.setstate(values[3])
 
   #----------------------------------------------------------------------------
    
@@ -4691,10 +6568,12 @@ class AI(object):
   #  outside of the map etc.).
    
   def decide_general_direction(self):
-    players = self.game_map.get_players()
+    enemy_player = self.player
     
-    enemy_players = filter(lambda p: p.is_enemy(self.player) and not p.is_dead(), players)
-    enemy_player = enemy_players[0] if len(enemy_players) > 0 else self.player
+    for player in self.game_map.get_alive_players():   # the first enemy alive, usually found after a few players
+      if player.is_enemy(self.player):
+        enemy_player = player
+        break
             
     my_tile_position = self.player.get_tile_position()
     another_player_tile_position = enemy_player.get_tile_position()
@@ -4822,17 +6701,16 @@ class AI(object):
     allies = 0
     enemies = 0
     
-    for player in self.game_map.get_players():
-      if player.is_dead() or player == self.player:
-        continue
-      
-      player_position = player.get_tile_position()
-      
-      if abs(current_position[0] - player_position[0]) <= 1 and abs(current_position[1] - player_position[1]) <= 1:
-        if player.is_enemy(self.player):
-          enemies += 1
-        else:
-          allies += 1
+    for y in (current_position[1] - 1,current_position[1],current_position[1] + 1):   # only look at the 3 x 3 tiles using the player index
+      for x in (current_position[0] - 1,current_position[0],current_position[0] + 1):
+        for player in self.game_map.get_players_at_tile((x,y)):
+          if player == self.player:
+            continue
+          
+          if player.is_enemy(self.player):
+            enemies += 1
+          else:
+            allies += 1
       
     return (enemies,allies)
 
@@ -4864,7 +6742,7 @@ class AI(object):
     
     if trapped:
       # in case the player is trapped spin randomly and press box in hope to free itself
-      chosen_movement_action = random.choice((PlayerKeyMaps.ACTION_UP,PlayerKeyMaps.ACTION_RIGHT,PlayerKeyMaps.ACTION_DOWN,PlayerKeyMaps.ACTION_LEFT))
+      chosen_movement_action = self.random.choice((PlayerKeyMaps.ACTION_UP,PlayerKeyMaps.ACTION_RIGHT,PlayerKeyMaps.ACTION_DOWN,PlayerKeyMaps.ACTION_LEFT))
     elif self.game_map.tile_has_bomb(current_tile):
       # standing on a bomb, find a way to escape
       
@@ -4920,7 +6798,7 @@ class AI(object):
         elif score == maximum_score:
           best_direction_actions.append(action[direction])
       
-      chosen_movement_action = random.choice(best_direction_actions)
+      chosen_movement_action = self.random.choice(best_direction_actions)
       
     if chosen_movement_action != None:
       if self.player.get_disease() == Player.DISEASE_REVERSE_CONTROLS:
@@ -4928,114 +6806,524 @@ class AI(object):
       
       self.outputs.append((self.player.get_number(),chosen_movement_action))
       
-      self.didnt_move_since = self.game_map.get_map_time()
+      self.didnt_move_since = self.game_map.get_map_time()
+
+    if self.game_map.get_map_time() - self.didnt_move_since > 10000:   # didn't move for 10 seconds or more => force move
+      chosen_movement_action = self.random.choice((PlayerKeyMaps.ACTION_UP,PlayerKeyMaps.ACTION_RIGHT,PlayerKeyMaps.ACTION_DOWN,PlayerKeyMaps.ACTION_LEFT))
+      self.outputs.append((self.player.get_number(),chosen_movement_action))
+      
+    # bomb decisions
+    
+    bomb_laid = False
+    
+    if self.game_map.tile_has_bomb(current_tile):
+      # should I throw?
+      
+      if self.player.can_throw() and max(escape_direction_ratings) == 0:
+        self.outputs.append((self.player.get_number(),PlayerKeyMaps.ACTION_BOMB_DOUBLE))
+    elif self.player.get_bombs_left() > 0 and (self.player.can_throw() or self.game_map.get_danger_value(current_tile) > 2000 and max(escape_direction_ratings) > 0): 
+      # should I lay bomb?
+      
+      chance_to_put_bomb = 100    # one in how many
+      
+      players_near = self.players_nearby()
+      
+      if players_near[0] > 0 and players_near[1] == 0:  # enemy nearby and no ally nearby
+        chance_to_put_bomb = 5
+      else:
+        block_tile_ratio = self.game_map.get_number_of_block_tiles() / float(self.game_map.get_width() * self.game_map.get_height())
+
+        if block_tile_ratio < 0.4:   # if there is not many tiles left, put bombs more often
+          chance_to_put_bomb = 80
+        elif block_tile_ratio < 0.2:
+          chance_to_put_bomb = 20
+      
+      number_of_block_neighbours = self.number_of_blocks_next_to_tile(current_tile)
+     
+      if number_of_block_neighbours == 1:
+        chance_to_put_bomb = 3
+      elif number_of_block_neighbours == 2 or number_of_block_neighbours == 3:
+        chance_to_put_bomb = 2
+      
+      do_lay_bomb = self.random.randint(0,chance_to_put_bomb) == 0
+      
+      if do_lay_bomb:
+        bomb_laid = True
+        
+        if self.random.randint(0,2) == 0 and self.should_lay_multibomb(chosen_movement_action):  # lay a single bomb or multibomb?
+          self.outputs.append((self.player.get_number(),PlayerKeyMaps.ACTION_BOMB_DOUBLE))
+        else:
+          self.outputs.append((self.player.get_number(),PlayerKeyMaps.ACTION_BOMB))
+  
+    # should I box?
+    
+    if self.player.can_box() and not self.player.detonator_is_active():
+      if trapped or self.game_map.tile_has_bomb(self.player.get_forward_tile_position()):
+        self.outputs.append((self.player.get_number(),PlayerKeyMaps.ACTION_SPECIAL))
+  
+    if bomb_laid:   # if bomb was laid, the outputs must be recomputed fast in order to prevent laying bombs to other tiles
+      self.recompute_compute_actions_on = current_time + 10
+    else:
+      self.recompute_compute_actions_on = current_time + self.random.randint(AI.REPEAT_ACTIONS[0],AI.REPEAT_ACTIONS[1])
+
+    # should I detonate the detonator?
+    
+    if self.player.detonator_is_active():
+      if self.random.randint(0,2) == 0 and self.game_map.get_danger_value(current_tile) >= GameMap.SAFE_DANGER_VALUE:
+        self.outputs.append((self.player.get_number(),PlayerKeyMaps.ACTION_SPECIAL))
+  
+    return self.outputs
+
+  #----------------------------------------------------------------------------
+
+  def should_lay_multibomb(self, movement_action):
+    if self.player.can_throw():    # multibomb not possible with throwing glove
+      return False
+    
+    multibomb_count = self.player.get_multibomb_count()
+    
+    if multibomb_count > 1:        # multibomb possible
+      current_tile = self.player.get_tile_position()
+
+      player_direction = movement_action if movement_action != None else self.player.get_direction_number()
+
+      # by laying multibomb one of the escape routes will be cut off, let's check
+      # if there would be any escape routes left
+      
+      escape_direction_ratings = list(self.rate_bomb_escape_directions(current_tile))
+      escape_direction_ratings[player_direction] = 0
+      
+      if max(escape_direction_ratings) == 0:
+        return False
+
+      direction_vector = self.player.get_direction_vector()
+      
+      multibomb_safe = True
+      
+      for i in range(multibomb_count):
+        if not self.game_map.tile_is_walkable(current_tile) or not self.game_map.tile_is_withing_map(current_tile):
+          break
+        
+        if self.game_map.get_danger_value(current_tile) < 3000 or self.game_map.tile_has_lava(current_tile):
+          multibomb_safe = False
+          break
+        
+        current_tile = (current_tile[0] + direction_vector[0],current_tile[1] + direction_vector[1])
+        
+      if multibomb_safe:
+        return True
+      
+    return False
+
+#==============================================================================
+
+## Steps a match (GameMap with its players and AIs) using only the map time, with
+#  no need for a display, sound or the wall clock. Used both by the Game and for
+#  headless simulation (then the map should be created as headless). With
+#  use_ais False the AI players only do the actions given to step (as when
+#  playing a replay).
+
+class Simulation(object):
+
+  #----------------------------------------------------------------------------
+
+  def __init__(self, game_map, play_setup, immortal_player_numbers=[], use_ais=True):
+    self.game_map = game_map
+    self.immortal_player_numbers = immortal_player_numbers
+    self.ais = []
+    
+    player_slots = play_setup.get_slots()
+    
+    for i in range(len(player_slots)):
+      if use_ais and player_slots[i] != None and player_slots[i][0] < 0:  # indicates AI
+        self.ais.append(AI(game_map.get_players_by_numbers()[i],game_map))
+
+  #----------------------------------------------------------------------------
+
+  def get_map(self):
+    return self.game_map
+
+  #----------------------------------------------------------------------------
+
+  ## Makes one simulation step of dt ms, input_actions are actions of human players
+  #  (in the format of PlayerKeyMaps.get_current_actions()). Returns the list of
+  #  all actions performed in this step (including the AI ones).
+
+  def step(self, dt, input_actions=[]):
+    actions_being_performed = list(input_actions)
+    
+    profiler.measure_start("sim. AIs")
+    
+    for ai in self.ais:
+      actions_being_performed.extend(ai.play())
+      
+    profiler.measure_stop("sim. AIs")
+
+    profiler.measure_start("sim. inputs")
+    
+    actions_by_player = {}    # so that each player only goes through its own actions
+    
+    for action in actions_being_performed:
+      if not action[0] in actions_by_player:
+        actions_by_player[action[0]] = []
+        
+      actions_by_player[action[0]].append(action)
+    
+    for player in self.game_map.get_players():
+      player.react_to_inputs(actions_by_player.get(player.get_number(),[]),dt,self.game_map)
+      
+    profiler.measure_stop("sim. inputs")
+      
+    profiler.measure_start("sim. map update")
+    
+    self.game_map.update(dt,self.immortal_player_numbers)
+    
+    profiler.measure_stop("sim. map update")
+    
+    return actions_being_performed
+
+  #----------------------------------------------------------------------------
+
+  ## Simulates the match with steps of dt ms until it's over or until max_time (map
+  #  time in ms, None = no limit) is reached. Returns the winning team (-1 = draw or
+  #  the match didn't finish). If stop_when_decided is True, the simulation stops as
+  #  soon as only one team is left, without waiting for STATE_FINISHING to end.
+
+  def run(self, dt=10, max_time=None, stop_when_decided=False):
+    while self.game_map.get_state() != GameMap.STATE_GAME_OVER:
+      if max_time != None and self.game_map.get_map_time() >= max_time:
+        return -1
+      
+      if stop_when_decided and self.game_map.get_state() == GameMap.STATE_FINISHING:
+        break
+      
+      self.step(dt)
+
+    return self.game_map.get_winner_team()
+
+  #----------------------------------------------------------------------------
+
+  ## Captures the state of the simulation, i.e. the map (see GameMap.snapshot)
+  #  and the AIs, so that it can later be given to restore.
+
+  def snapshot(self):
+    return (self.game_map.snapshot(),tuple([ai.get_snapshot() for ai in self.ais]))
+
+  #----------------------------------------------------------------------------
+
+  def restore(self, snapshot):
+    self.game_map.restore(snapshot[0])
+    
+    for ai, values in zip(self.ais,snapshot[1]):
+      ai.restore_snapshot(values)
+
+#==============================================================================
+
+## Records a match into a replay file. The header holds everything needed to
+#  make the same map (map data, player slots, seed, ...) and it is followed by a
+#  record of the actions performed in each simulation tick (human and AI ones).
+#  As the simulation is deterministic, this is enough to play the match back
+#  (see ReplayPlayer). Every HASH_INTERVAL ms of map time the state hash (see
+#  GameMap.get_state_hash) is recorded too, so that the playback can tell
+#  where it went out of sync, and every KEYFRAME_INTERVAL ms a keyframe with the
+#  whole state (GameMap.save_state, compressed), so that the playback can seek
+#  without simulating the match from the start. The file ends with an index of
+#  the keyframes and a footer pointing to it. All numbers are little endian.
+#  Keyframes of files older than KEYFRAME_VERSION were pickled and are ignored.
+
+class ReplayRecorder(object):
+  FILE_MAGIC = b"BMRP"
+  INDEX_MAGIC = b"BMRI"
+  FORMAT_VERSION = 3
+  KEYFRAME_VERSION = 3            ##< oldest format version whose keyframes can be loaded
+  
+  HEADER_FORMAT = "<4sBIHHBB"     ##< magic, version, seed, game number, max games, all items cheat, number of slots
+  SLOT_FORMAT = "<bb"             ##< player number (negative = AI), team number
+  NO_SLOT = (-128,-128)           ##< stored for empty slots
+  COUNT_FORMAT = "<B"             ##< number of immortal players (followed by their numbers as "b")
+  MAP_DATA_FORMAT = "<I"          ##< length of the map data (followed by the data)
+  TICK_FORMAT = "<HB"             ##< tick length in ms, number of actions
+  ACTION_FORMAT = "<bB"           ##< player number, action
+  HASH_FORMAT = "<IQ"             ##< map time, state hash
+  KEYFRAME_FORMAT = "<I"          ##< length of the keyframe data (followed by the data)
+  INDEX_ENTRY_FORMAT = "<IQ"      ##< map time, file offset of the keyframe marker
+  FOOTER_FORMAT = "<IQ4s"         ##< number of keyframes, file offset of the index, index magic
+  
+  MAX_TICK_LENGTH = 0xfff0        ##< tick lengths above are used as record markers:
+  KEYFRAME_MARKER = 0xfffd        ##< followed by KEYFRAME_FORMAT
+  HASH_MARKER = 0xfffe            ##< followed by HASH_FORMAT
+  END_MARKER = 0xffff             ##< followed by HASH_FORMAT with the final state, then the index and footer
+  
+  HASH_INTERVAL = 1000
+  KEYFRAME_INTERVAL = 5000
+
+  #----------------------------------------------------------------------------
+
+  def __init__(self, filename, game_map, play_setup, immortal_player_numbers=[]):
+    self.game_map = game_map
+    self.replay_file = open(filename,"wb")
+    self.next_hash_at = ReplayRecorder.HASH_INTERVAL            ##< map time at which to record the next state hash
+    self.next_keyframe_at = ReplayRecorder.KEYFRAME_INTERVAL    ##< map time at which to record the next keyframe
+    self.keyframes = []                                         ##< (map time, file offset) of the keyframes recorded so far
+    
+    player_slots = play_setup.get_slots()
+    
+    self.replay_file.write(struct.pack(ReplayRecorder.HEADER_FORMAT,ReplayRecorder.FILE_MAGIC,ReplayRecorder.FORMAT_VERSION,
+      game_map.get_seed(),game_map.game_number,game_map.max_games,1 if game_map.all_items_cheat else 0,len(player_slots)))
+    
+    for slot in player_slots:
+      self.replay_file.write(struct.pack(ReplayRecorder.SLOT_FORMAT,*(slot if slot != None else ReplayRecorder.NO_SLOT)))
+      
+    self.replay_file.write(struct.pack(ReplayRecorder.COUNT_FORMAT,len(immortal_player_numbers)))
+    self.replay_file.write(struct.pack("<" + "b" * len(immortal_player_numbers),*immortal_player_numbers))
+    
+    map_data = game_map.map_data.encode("ascii")
+    self.replay_file.write(struct.pack(ReplayRecorder.MAP_DATA_FORMAT,len(map_data)))
+    self.replay_file.write(map_data)
 
-    if self.game_map.get_map_time() - self.didnt_move_since > 10000:   # didn't move for 10 seconds or more => force move
-      chosen_movement_action = random.choice((PlayerKeyMaps.ACTION_UP,PlayerKeyMaps.ACTION_RIGHT,PlayerKeyMaps.ACTION_DOWN,PlayerKeyMaps.ACTION_LEFT))
-      self.outputs.append((self.player.get_number(),chosen_movement_action))
-      
-    # bomb decisions
+  #----------------------------------------------------------------------------
+
+  ## Records one simulation tick, must be called after each Simulation.step with
+  #  its dt and the actions it returned.
+
+  def record_tick(self, dt, actions):
+    record = [struct.pack(ReplayRecorder.TICK_FORMAT,dt,len(actions))]
     
-    bomb_laid = False
+    for action in actions:
+      record.append(struct.pack(ReplayRecorder.ACTION_FORMAT,action[0],action[1]))
     
-    if self.game_map.tile_has_bomb(current_tile):
-      # should I throw?
-      
-      if self.player.can_throw() and max(escape_direction_ratings) == 0:
-        self.outputs.append((self.player.get_number(),PlayerKeyMaps.ACTION_BOMB_DOUBLE))
-    elif self.player.get_bombs_left() > 0 and (self.player.can_throw() or self.game_map.get_danger_value(current_tile) > 2000 and max(escape_direction_ratings) > 0): 
-      # should I lay bomb?
-      
-      chance_to_put_bomb = 100    # one in how many
+    if self.game_map.get_map_time() >= self.next_hash_at:
+      record.append(struct.pack("<H",ReplayRecorder.HASH_MARKER))
+      record.append(struct.pack(ReplayRecorder.HASH_FORMAT,self.game_map.get_map_time(),self.game_map.get_state_hash()))
+      self.next_hash_at += ReplayRecorder.HASH_INTERVAL
       
-      players_near = self.players_nearby()
+    self.replay_file.write(b"".join(record))
+    
+    if self.game_map.get_map_time() >= self.next_keyframe_at:
+      self.keyframes.append((self.game_map.get_map_time(),self.replay_file.tell()))
+      keyframe_data = zlib.compress(self.game_map.save_state())
+      self.replay_file.write(struct.pack("<H",ReplayRecorder.KEYFRAME_MARKER))
+      self.replay_file.write(struct.pack(ReplayRecorder.KEYFRAME_FORMAT,len(keyframe_data)))
+      self.replay_file.write(keyframe_data)
+      self.next_keyframe_at += ReplayRecorder.KEYFRAME_INTERVAL
+
+  #----------------------------------------------------------------------------
+
+  ## Records the final state and the keyframe index and closes the file.
+
+  def close(self):
+    self.replay_file.write(struct.pack("<H",ReplayRecorder.END_MARKER))
+    self.replay_file.write(struct.pack(ReplayRecorder.HASH_FORMAT,self.game_map.get_map_time(),self.game_map.get_state_hash()))
+    
+    index_offset = self.replay_file.tell()
+    
+    for keyframe in self.keyframes:
+      self.replay_file.write(struct.pack(ReplayRecorder.INDEX_ENTRY_FORMAT,*keyframe))
       
-      if players_near[0] > 0 and players_near[1] == 0:  # enemy nearby and no ally nearby
-        chance_to_put_bomb = 5
-      else:
-        block_tile_ratio = self.game_map.get_number_of_block_tiles() / float(GameMap.MAP_WIDTH * GameMap.MAP_HEIGHT)
+    self.replay_file.write(struct.pack(ReplayRecorder.FOOTER_FORMAT,len(self.keyframes),index_offset,ReplayRecorder.INDEX_MAGIC))
+    self.replay_file.close()
 
-        if block_tile_ratio < 0.4:   # if there is not many tiles left, put bombs more often
-          chance_to_put_bomb = 80
-        elif block_tile_ratio < 0.2:
-          chance_to_put_bomb = 20
+#==============================================================================
+
+## Plays back a replay file made by ReplayRecorder. The map is driven by the
+#  recorded actions only (the AIs aren't run), the recorded state hashes are
+#  compared with those of the map as they come. The file is memory mapped (call
+#  close when done) and seek can jump to any map time by loading the nearest
+#  keyframe before it and simulating only the rest. A file that isn't a valid
+#  replay gives a ValueError.
+
+class ReplayPlayer(object):
+
+  #----------------------------------------------------------------------------
+
+  def __init__(self, filename, headless=True):
+    if os.path.getsize(filename) < struct.calcsize(ReplayRecorder.HEADER_FORMAT):   # also because an empty file can't be mapped
+      raise ValueError(filename + " is not a replay file")
+    
+    with open(filename,"rb") as replay_file:
+      self.data = mmap.mmap(replay_file.fileno(),0,access=mmap.ACCESS_READ)   ##< contents of the replay file
       
-      number_of_block_neighbours = self.number_of_blocks_next_to_tile(current_tile)
-     
-      if number_of_block_neighbours == 1:
-        chance_to_put_bomb = 3
-      elif number_of_block_neighbours == 2 or number_of_block_neighbours == 3:
-        chance_to_put_bomb = 2
+    self.position = 0    ##< where in the data the next record is
+    
+    try:
+      self.__read_header(filename,headless)
+    except Exception:
+      self.data.close()
+      raise
+
+  #----------------------------------------------------------------------------
+
+  def __read_header(self, filename, headless):
+    magic, version, seed, game_number, max_games, all_items_cheat, number_of_slots = self.__read(ReplayRecorder.HEADER_FORMAT)
+    
+    if magic != ReplayRecorder.FILE_MAGIC or version > ReplayRecorder.FORMAT_VERSION:
+      raise ValueError(filename + " is not a replay file of a supported version")
+    
+    self.play_setup = PlaySetup()
+    self.play_setup.player_slots = []
+    
+    for i in range(number_of_slots):
+      slot = self.__read(ReplayRecorder.SLOT_FORMAT)
+      self.play_setup.player_slots.append(slot if slot != ReplayRecorder.NO_SLOT else None)
       
-      do_lay_bomb = random.randint(0,chance_to_put_bomb) == 0
+    number_of_immortal_players = self.__read(ReplayRecorder.COUNT_FORMAT)[0]
+    immortal_player_numbers = list(self.__read("<" + "b" * number_of_immortal_players))
+    
+    map_data_length = self.__read(ReplayRecorder.MAP_DATA_FORMAT)[0]
+    map_data = str(self.__read("<" + str(map_data_length) + "s")[0].decode("ascii"))
+    self.ticks_start = self.position    ##< where the tick records start
+    
+    self.game_map = GameMap(map_data,self.play_setup,game_number,max_games,all_items_cheat != 0,headless,seed)
+    self.simulation = Simulation(self.game_map,self.play_setup,immortal_player_numbers,False)
+    self.initial_snapshot = self.game_map.snapshot()    ##< for seeking before the first keyframe
+    self.finished = False        ##< whether the end of the replay has been reached
+    self.out_of_sync_at = None   ##< map time of the first state hash that didn't match the recorded one, None = all matched
+    self.keyframes = []          ##< (map time, file offset) of the keyframes, empty if the file has no index (e.g. recording was cut off) or is too old
+    
+    footer_size = struct.calcsize(ReplayRecorder.FOOTER_FORMAT)
+    
+    if version >= ReplayRecorder.KEYFRAME_VERSION and len(self.data) >= self.ticks_start + footer_size:
+      number_of_keyframes, index_offset, index_magic = struct.unpack_from(ReplayRecorder.FOOTER_FORMAT,self.data,len(self.data) - footer_size)
       
-      if do_lay_bomb:
-        bomb_laid = True
+      if index_magic == ReplayRecorder.INDEX_MAGIC:
+        entry_size = struct.calcsize(ReplayRecorder.INDEX_ENTRY_FORMAT)
         
-        if random.randint(0,2) == 0 and self.should_lay_multibomb(chosen_movement_action):  # lay a single bomb or multibomb?
-          self.outputs.append((self.player.get_number(),PlayerKeyMaps.ACTION_BOMB_DOUBLE))
-        else:
-          self.outputs.append((self.player.get_number(),PlayerKeyMaps.ACTION_BOMB))
-  
-    # should I box?
-    
-    if self.player.can_box() and not self.player.detonator_is_active():
-      if trapped or self.game_map.tile_has_bomb(self.player.get_forward_tile_position()):
-        self.outputs.append((self.player.get_number(),PlayerKeyMaps.ACTION_SPECIAL))
-  
-    if bomb_laid:   # if bomb was laid, the outputs must be recomputed fast in order to prevent laying bombs to other tiles
-      self.recompute_compute_actions_on = current_time + 10
-    else:
-      self.recompute_compute_actions_on = current_time + random.randint(AI.REPEAT_ACTIONS[0],AI.REPEAT_ACTIONS[1])
+        if index_offset < self.ticks_start or index_offset + number_of_keyframes * entry_size > len(self.data) - footer_size:
+          raise ValueError(filename + " has a damaged keyframe index")
+        
+        self.keyframes = [struct.unpack_from(ReplayRecorder.INDEX_ENTRY_FORMAT,self.data,index_offset + i * entry_size) for i in range(number_of_keyframes)]
+        
+        if not all([self.ticks_start <= offset < index_offset for keyframe_time, offset in self.keyframes]):
+          raise ValueError(filename + " has a damaged keyframe index")
 
-    # should I detonate the detonator?
+  #----------------------------------------------------------------------------
+
+  def __read(self, struct_format):
+    size = struct.calcsize(struct_format)
     
-    if self.player.detonator_is_active():
-      if random.randint(0,2) == 0 and self.game_map.get_danger_value(current_tile) >= GameMap.SAFE_DANGER_VALUE:
-        self.outputs.append((self.player.get_number(),PlayerKeyMaps.ACTION_SPECIAL))
-  
-    return self.outputs
+    if self.position + size > len(self.data):
+      raise ValueError("the replay file is cut off")
+    
+    result = struct.unpack_from(struct_format,self.data,self.position)
+    self.position += size
+    return result
 
   #----------------------------------------------------------------------------
 
-  def should_lay_multibomb(self, movement_action):
-    if self.player.can_throw():    # multibomb not possible with throwing glove
-      return False
-    
-    multibomb_count = self.player.get_multibomb_count()
+  ## Closes the replay file, the player can't read from it after this (the map
+  #  stays as it is).
+
+  def close(self):
+    self.data.close()
+
+  #----------------------------------------------------------------------------
+
+  def __check_hash(self):
+    map_time, state_hash = self.__read(ReplayRecorder.HASH_FORMAT)
     
-    if multibomb_count > 1:        # multibomb possible
-      current_tile = self.player.get_tile_position()
+    if self.out_of_sync_at == None and (map_time != self.game_map.get_map_time() or state_hash != self.game_map.get_state_hash()):
+      self.out_of_sync_at = map_time
 
-      player_direction = movement_action if movement_action != None else self.player.get_direction_number()
+  #----------------------------------------------------------------------------
 
-      # by laying multibomb one of the escape routes will be cut off, let's check
-      # if there would be any escape routes left
+  def get_map(self):
+    return self.game_map
+
+  #----------------------------------------------------------------------------
+
+  def is_finished(self):
+    return self.finished
+
+  #----------------------------------------------------------------------------
+
+  ## Returns None if the playback is in sync with the recorded match, otherwise
+  #  the map time at which it was first found out of sync.
+
+  def get_out_of_sync_time(self):
+    return self.out_of_sync_at
+
+  #----------------------------------------------------------------------------
+
+  ## Returns a list of (map time, file offset) of the replay's keyframes.
+
+  def get_keyframes(self):
+    return self.keyframes
+
+  #----------------------------------------------------------------------------
+
+  ## Plays the next recorded tick, returns its length in ms or None if the end
+  #  of the replay has been reached.
+
+  def step(self):
+    while not self.finished:
+      if self.position + 2 > len(self.data):   # the recording was cut off
+        self.finished = True
+        break
       
-      escape_direction_ratings = list(self.rate_bomb_escape_directions(current_tile))
-      escape_direction_ratings[player_direction] = 0
+      tick_length = self.__read("<H")[0]
       
-      if max(escape_direction_ratings) == 0:
-        return False
-
-      direction_vector = self.player.get_direction_vector()
+      if tick_length == ReplayRecorder.HASH_MARKER:
+        self.__check_hash()
+      elif tick_length == ReplayRecorder.KEYFRAME_MARKER:
+        keyframe_length = self.__read(ReplayRecorder.KEYFRAME_FORMAT)[0]
+        self.position += keyframe_length
+      elif tick_length == ReplayRecorder.END_MARKER:
+        self.__check_hash()
+        self.finished = True
+      else:
+        number_of_actions = self.__read(ReplayRecorder.COUNT_FORMAT)[0]
+        actions = [self.__read(ReplayRecorder.ACTION_FORMAT) for i in range(number_of_actions)]
+        self.simulation.step(tick_length,actions)
+        return tick_length
       
-      multibomb_safe = True
+    return None
+
+  #----------------------------------------------------------------------------
+
+  ## Plays the rest of the replay as fast as possible.
+
+  def run(self):
+    while self.step() != None:
+      pass
+
+  #----------------------------------------------------------------------------
+
+  ## Moves the playback to the first tick ending at or after given map time (or
+  #  to the end of the replay). Seeking backwards or past a keyframe loads the
+  #  last keyframe before the time (or the initial state), so at most
+  #  KEYFRAME_INTERVAL ms of the match has to be simulated.
+
+  def seek(self, map_time):
+    keyframe = None
+    
+    for candidate in self.keyframes:
+      if candidate[0] > map_time:
+        break
+        
+      keyframe = candidate
       
-      for i in range(multibomb_count):
-        if not self.game_map.tile_is_walkable(current_tile) or not self.game_map.tile_is_withing_map(current_tile):
-          break
+    current_time = self.game_map.get_map_time()
+    
+    if map_time < current_time or (keyframe != None and keyframe[0] > current_time):
+      if keyframe == None:
+        self.game_map.restore(self.initial_snapshot)
+        self.position = self.ticks_start
+      else:
+        self.position = keyframe[1] + 2      # skip the marker
+        keyframe_length = self.__read(ReplayRecorder.KEYFRAME_FORMAT)[0]
         
-        if self.game_map.get_danger_value(current_tile) < 3000 or self.game_map.tile_has_lava(current_tile):
-          multibomb_safe = False
-          break
+        try:
+          state = zlib.decompress(self.data[self.position:self.position + keyframe_length])
+        except zlib.error:
+          raise ValueError("damaged keyframe in the replay file")
         
-        current_tile = (current_tile[0] + direction_vector[0],current_tile[1] + direction_vector[1])
+        self.game_map.load_state(state)
+        self.position += keyframe_length
         
-      if multibomb_safe:
-        return True
+      self.finished = False
       
-    return False
+    while not self.finished and self.game_map.get_map_time() < map_time:
+      self.step()
 
 #==============================================================================
     
@@ -5171,6 +7459,8 @@ class Game(object):
     "purple"
     ]
     
+  COLOR_NAMES += ["color " + str(i + 1) for i in range(len(COLOR_NAMES),GameMap.MAX_PLAYERS)]   # generated colors (see Renderer.COLOR_RGB_VALUES)
+    
   STATE_PLAYING = 0
   STATE_EXIT = 1
   STATE_MENU_MAIN = 2
@@ -5191,6 +7481,11 @@ class Game(object):
   
   NUMBER_OF_CONTROLLED_PLAYERS = 4    ##< maximum number of non-AI players on one PC
   
+  FIXED_TIMESTEP = True               ##< if true, the simulation runs in ticks of SIMULATION_TICK_LENGTH independently of the frame rate
+  SIMULATION_TICK_LENGTH = 8          ##< length of one simulation tick in ms in fixed timestep mode (125 Hz)
+  MAX_TICKS_PER_FRAME = 13            ##< limits the simulation time per frame (about 100 ms), the rest is dropped on very slow frames
+  REPLAY_SEEK_STEP = 5000             ##< by how many ms the left/right arrow keys move the replay playback
+  
   RESOURCE_PATH = "resources"
   MAP_PATH = "maps"
   SETTINGS_FILE_PATH = "settings.txt"
@@ -5205,6 +7500,9 @@ class Game(object):
     
     self.frame_number = 0
     
+    self.simulation_time_accumulator = 0   ##< time in ms not yet simulated in fixed timestep mode
+    self.render_interpolation = 1.0        ##< where between the last two ticks to render the objects, see Renderer.render_map
+    
     self.player_key_maps = PlayerKeyMaps()
     
     self.settings = Settings(self.player_key_maps)
@@ -5244,7 +7542,12 @@ class Game(object):
     self.menu_controls = ControlsMenu(self.sound_player,self.player_key_maps,self)
     self.menu_results = ResultMenu(self.sound_player)
     
-    self.ais = []
+    self.simulation = None
+    
+    self.replay_recorder = None            ##< ReplayRecorder of the current game if replays are being recorded
+    self.record_replays_to = None          ##< if not None, each game is recorded into a file with this prefix
+    self.replay_player = None              ##< ReplayPlayer if a replay is being played instead of a game
+    self.replay_speed = 1.0                ##< speed multiplier of the replay playback
     
     self.state = Game.STATE_MENU_MAIN
 
@@ -5474,6 +7777,9 @@ class Game(object):
         pygame_events.append(event)
         
       self.player_key_maps.process_pygame_events(pygame_events,self.frame_number)
+      
+      if self.replay_player != None and self.state == Game.STATE_PLAYING:
+        self.process_replay_seeking(pygame_events)
 
       if self.state == Game.STATE_PLAYING:
         self.renderer.process_animation_events(self.game_map.get_and_clear_animation_events())
@@ -5481,17 +7787,38 @@ class Game(object):
         
         profiler.measure_start("map rend.")
         
-        self.screen.blit(self.renderer.render_map(self.game_map),(0,0)) 
+        self.screen.blit(self.renderer.render_map(self.game_map,self.render_interpolation),(0,0)) 
         
         profiler.measure_stop("map rend.")
         
         profiler.measure_start("sim.")
         
-        self.simulation_step(dt)
+        if self.replay_player != None:
+          self.replay_step(dt)
+        elif Game.FIXED_TIMESTEP:
+          self.simulation_time_accumulator += dt
+          ticks = 0
+          
+          while self.simulation_time_accumulator >= Game.SIMULATION_TICK_LENGTH and self.state == Game.STATE_PLAYING:
+            if ticks >= Game.MAX_TICKS_PER_FRAME:   # can't keep up, drop the rest
+              self.simulation_time_accumulator = 0
+              break
+            
+            self.simulation_step(Game.SIMULATION_TICK_LENGTH)
+            self.simulation_time_accumulator -= Game.SIMULATION_TICK_LENGTH
+            ticks += 1
+            
+          self.render_interpolation = self.simulation_time_accumulator / float(Game.SIMULATION_TICK_LENGTH)
+        else:
+          self.simulation_step(dt)
         
         profiler.measure_stop("sim.")
         
-        if self.game_map.get_state() == GameMap.STATE_GAME_OVER:
+        if self.replay_player != None:
+          if self.replay_player.is_finished():
+            self.state = Game.STATE_EXIT
+        elif self.game_map.get_state() == GameMap.STATE_GAME_OVER:
+          self.stop_recording_replay()
           self.game_number += 1
           
           if self.game_number > self.play_setup.get_number_of_games():
@@ -5506,6 +7833,8 @@ class Game(object):
           else:
             self.state = Game.STATE_GAME_STARTED   # new game
       elif self.state == Game.STATE_EXIT:
+        self.stop_recording_replay()
+        self.stop_playing_replay()
         break
       elif self.state == Game.STATE_GAME_STARTED:
         debug_log("starting game " + str(self.game_number))
@@ -5515,8 +7844,8 @@ class Game(object):
         if self.game_number != 1:
           previous_winner = self.game_map.get_winner_team()
         
-        kill_counts = [0 for i in range(10)]
-        win_counts = [0 for i in range(10)]
+        kill_counts = {}
+        win_counts = {}
         
         if self.game_map != None:
           for player in self.game_map.get_players():
@@ -5538,15 +7867,17 @@ class Game(object):
             if player_slots[i] != None and player_slots[i][0] >= 0:   # cheat: if not AI
               self.immortal_players_numbers.append(i)                 # make the player immortal
         
-        self.ais = []
+        self.simulation = Simulation(self.game_map,self.play_setup,self.immortal_players_numbers)
+        self.simulation_time_accumulator = 0
+        self.render_interpolation = 1.0
         
-        for i in range(len(player_slots)):
-          if player_slots[i] != None and player_slots[i][0] < 0:  # indicates AI
-            self.ais.append(AI(self.game_map.get_players_by_numbers()[i],self.game_map))
+        if self.record_replays_to != None:
+          self.stop_recording_replay()
+          self.replay_recorder = ReplayRecorder(self.record_replays_to + "_" + str(self.game_number) + ".replay",self.game_map,self.play_setup,self.immortal_players_numbers)
       
         for player in self.game_map.get_players():
-          player.set_kills(kill_counts[player.get_number()])
-          player.set_wins(win_counts[player.get_number()])
+          player.set_kills(kill_counts.get(player.get_number(),0))
+          player.set_wins(win_counts.get(player.get_number(),0))
         
         self.acknowledge_wins(previous_winner,self.game_map.get_players())    # add win counts
         
@@ -5608,27 +7939,76 @@ class Game(object):
         self.state = Game.STATE_MENU_PLAY
         return
     
-    profiler.measure_start("sim. AIs")
+    if Game.FIXED_TIMESTEP:
+      for positionable in self.game_map.get_players() + self.game_map.get_bombs():
+        positionable.start_tick()     # for render interpolation
     
-    for i in range(len(self.ais)):
-      actions_being_performed = actions_being_performed + self.ais[i].play()
-      
-    profiler.measure_stop("sim. AIs")
+    actions_being_performed = self.simulation.step(dt,actions_being_performed)
     
-    players = self.game_map.get_players()
+    if self.replay_recorder != None:
+      self.replay_recorder.record_tick(dt,actions_being_performed)
 
-    profiler.measure_start("sim. inputs")
+  #----------------------------------------------------------------------------
+
+  def stop_recording_replay(self):
+    if self.replay_recorder != None:
+      self.replay_recorder.close()
+      self.replay_recorder = None
+
+  #----------------------------------------------------------------------------
+
+  def stop_playing_replay(self):
+    if self.replay_player != None:
+      self.replay_player.close()
+      self.replay_player = None
+
+  #----------------------------------------------------------------------------
+
+  ## Plays the recorded ticks of the replay for dt ms of real time (multiplied by
+  #  the replay speed).
+
+  def replay_step(self, dt):
+    self.simulation_time_accumulator += dt * self.replay_speed
     
-    for player in players:
-      player.react_to_inputs(actions_being_performed,dt,self.game_map)
+    while self.simulation_time_accumulator > 0:
+      for positionable in self.game_map.get_players() + self.game_map.get_bombs():
+        positionable.start_tick()
       
-    profiler.measure_stop("sim. inputs")
+      tick_length = self.replay_player.step()
       
-    profiler.measure_start("sim. map update")
-    
-    self.game_map.update(dt,self.immortal_players_numbers)
+      if tick_length == None:
+        break
+      
+      self.simulation_time_accumulator -= tick_length
     
-    profiler.measure_stop("sim. map update")
+    self.render_interpolation = 1.0
+
+  #----------------------------------------------------------------------------
+
+  ## Moves the replay playback back or forward by REPLAY_SEEK_STEP when the left
+  #  or right arrow key is pressed.
+
+  def process_replay_seeking(self, pygame_events):
+    for event in pygame_events:
+      if event.type == pygame.KEYDOWN and event.key in (pygame.K_LEFT,pygame.K_RIGHT):
+        seek_step = Game.REPLAY_SEEK_STEP if event.key == pygame.K_RIGHT else -Game.REPLAY_SEEK_STEP
+        self.replay_player.seek(max(0,self.game_map.get_map_time() + seek_step))
+        self.game_map.get_and_clear_sound_events()        # don't play everything that happened in between
+        self.game_map.get_and_clear_animation_events()
+        self.simulation_time_accumulator = 0
+
+  #----------------------------------------------------------------------------
+
+  ## Sets up playing of given replay file (see ReplayPlayer) instead of a game, the
+  #  game exits when the replay ends.
+
+  def setup_replay(self, filename, speed=1.0):
+    self.replay_player = ReplayPlayer(filename,False)
+    self.replay_speed = speed
+    self.game_map = self.replay_player.get_map()
+    self.simulation_time_accumulator = 0
+    self.render_interpolation = 1.0
+    self.state = Game.STATE_PLAYING
 
   #----------------------------------------------------------------------------
 
@@ -5646,16 +8026,195 @@ class Game(object):
       self.game_number = 1
       self.state = Game.STATE_GAME_STARTED      
 
+  #----------------------------------------------------------------------------
+
+  ## Sets up a game of a large lobby of AI players (see PlaySetup.set_ai_lobby),
+  #  so that it can be started without the menus. The map is picked randomly out
+  #  of the maps that have enough free tiles for all the players.
+  
+  def setup_lobby(self, number_of_players, number_of_teams):
+    self.play_setup.set_ai_lobby(number_of_players,number_of_teams)
+    
+    map_names = []
+    
+    for map_name in self.menu_map_select.map_filenames:
+      with open(os.path.join(Game.MAP_PATH,map_name)) as map_file:
+        try:
+          GameMap(map_file.read(),self.play_setup,1,1,headless=True)
+          map_names.append(map_name)
+        except ValueError:             # not enough free tiles for the players
+          pass
+        
+    if len(map_names) == 0:
+      raise ValueError("no map has enough free tiles for " + str(number_of_players) + " players")
+    
+    self.map_name = random.choice(map_names)
+    self.random_map_selection = False
+    self.game_number = 1
+    self.state = Game.STATE_GAME_STARTED
+
 #==============================================================================
     
-if __name__ == "__main__":
-  profiler = Profiler()   # profiler object is global, for simple access
-  game = Game()
+## Plays one headless match of AI players for a Tournament, match_setup is a tuple
+#  (map name, seed). Returns a tuple (map name, seed, winner team (-1 = draw),
+#  map time, kills of each player). This is a module level function so that it
+#  can be run in the worker processes.
+
+def play_tournament_match(match_setup):
+  map_name, seed = match_setup
+  
+  with open(os.path.join(Game.MAP_PATH,map_name)) as map_file:
+    map_data = map_file.read()
+    
+  play_setup = PlaySetup()
+  play_setup.set_ai_lobby(Tournament.NUMBER_OF_PLAYERS,Tournament.NUMBER_OF_PLAYERS)
+  game_map = GameMap(map_data,play_setup,1,1,headless=True,seed=seed)
+  winner_team = Simulation(game_map,play_setup).run(Tournament.TICK_LENGTH,Tournament.MAX_MATCH_TIME,True)
+  
+  return (map_name,seed,winner_team,game_map.get_map_time(),tuple([player.get_kills() for player in game_map.get_players()]))
+
+#==============================================================================
+
+## Runs a number of headless matches of 10 AI players (like Game.setup_test_game(1),
+#  each on a random map) in parallel worker processes and collects their
+#  results. Match number i is played with seed first_seed + i, so the same
+#  tournament always has the same results.
+
+class Tournament(object):
+  NUMBER_OF_PLAYERS = 10       ##< each player is in a team of their own
+  TICK_LENGTH = 10
+  MAX_MATCH_TIME = 300000      ##< map time in ms after which an undecided match counts as a draw
+
+  #----------------------------------------------------------------------------
+
+  def __init__(self, number_of_matches, number_of_processes=None, first_seed=0):
+    map_names = sorted([filename for filename in os.listdir(Game.MAP_PATH) if os.path.isfile(os.path.join(Game.MAP_PATH,filename))])
+    
+    self.match_setups = [(SeededRandom(seed).choice(map_names),seed) for seed in range(first_seed,first_seed + number_of_matches)]
+    self.number_of_processes = number_of_processes if number_of_processes != None else multiprocessing.cpu_count()
+    self.results = []            ##< results of the matches in the format returned by play_tournament_match
+    self.run_time = 0            ##< real time in seconds the tournament took
+
+  #----------------------------------------------------------------------------
+
+  def run(self):
+    time_before = time.time()
+    
+    if self.number_of_processes <= 1:
+      self.results = [play_tournament_match(match_setup) for match_setup in self.match_setups]
+    else:
+      pool = multiprocessing.Pool(self.number_of_processes)
+      
+      try:
+        self.results = pool.map(play_tournament_match,self.match_setups,1)  # matches take different times, so hand them out one by one
+      finally:
+        pool.close()
+        pool.join()
+        
+    self.run_time = max(time.time() - time_before,0.001)
+
+  #----------------------------------------------------------------------------
+
+  def get_results(self):
+    return self.results
+
+  #----------------------------------------------------------------------------
+
+  def get_matches_per_second(self):
+    return len(self.results) / self.run_time
+
+  #----------------------------------------------------------------------------
+
+  ## Returns the aggregated results (wins of each team, kills of each player) and
+  #  the results of the individual matches as a human readable string.
+
+  def get_results_string(self):
+    wins = {}
+    kills = [0 for i in range(Tournament.NUMBER_OF_PLAYERS)]
+    
+    for map_name, seed, winner_team, map_time, match_kills in self.results:
+      wins[winner_team] = wins.get(winner_team,0) + 1
+      
+      for i in range(len(match_kills)):
+        kills[i] += match_kills[i]
+        
+    result = "matches: " + str(len(self.results)) + " in " + str(round(self.run_time,2)) + " s on " + str(self.number_of_processes) + " processes (" + str(round(self.get_matches_per_second(),2)) + " matches per second)\n"
+    result += "draws: " + str(wins.get(-1,0)) + "\n\nwins:\n"
+    
+    for team_number in sorted(wins):
+      if team_number >= 0:
+        result += "  " + Game.COLOR_NAMES[team_number] + ": " + str(wins[team_number]) + "\n"
+        
+    result += "\nkills:\n"
+    
+    for i in range(len(kills)):
+      result += "  player " + str(i) + ": " + str(kills[i]) + "\n"
+      
+    result += "\nmatches (map, seed, winner team, map time in ms):\n"
+    
+    for map_name, seed, winner_team, map_time, match_kills in self.results:
+      result += "  " + map_name + ", " + str(seed) + ", " + str(winner_team) + ", " + str(map_time) + "\n"
+      
+    return result
+
+  #----------------------------------------------------------------------------
+
+  def save_results(self, filename):
+    with open(filename,"w") as results_file:
+      results_file.write(self.get_results_string())
+
+#==============================================================================
 
-  if len(sys.argv) > 1: 
-    if "--test" in sys.argv:       # allows to quickly init a game
+## Returns the command line argument following given option, or default if the
+#  option isn't given.
+
+def get_command_line_value(option, default=None):
+  if option in sys.argv and sys.argv.index(option) + 1 < len(sys.argv):
+    return sys.argv[sys.argv.index(option) + 1]
+  
+  return default
+
+#==============================================================================
+    
+if __name__ == "__main__":
+  replay_filename = get_command_line_value("--replay")
+  
+  if get_command_line_value("--tournament") != None:                   # run AI matches on all cores, without a display
+    number_of_processes = get_command_line_value("--processes")
+    tournament = Tournament(int(get_command_line_value("--tournament")),int(number_of_processes) if number_of_processes != None else None,int(get_command_line_value("--seed",0)))
+    tournament.run()
+    results_filename = get_command_line_value("--results","tournament_results.txt")
+    tournament.save_results(results_filename)
+    
+    print(tournament.get_results_string().split("\n")[0])
+    print("results saved to " + results_filename)
+  elif replay_filename != None and "--headless" in sys.argv:   # play the replay as fast as possible, without a display
+    replay_player = ReplayPlayer(replay_filename)
+    time_before = time.time()
+    replay_player.run()
+    real_time = max(time.time() - time_before,0.001)
+    replay_player.close()
+    replay_map = replay_player.get_map()
+    
+    print("played " + str(replay_map.get_map_time()) + " ms of map time in " + str(round(real_time,2)) + " s (" + str(int(replay_map.get_map_time() / real_time / 1000)) + "x real time)")
+    print("winner team: " + str(replay_map.get_winner_team()) + ", state hash: " + ("%016x" % replay_map.get_state_hash()))
+    
+    if replay_player.get_out_of_sync_time() != None:
+      print("OUT OF SYNC with the recorded match from " + str(replay_player.get_out_of_sync_time()) + " ms")
+      sys.exit(1)
+  else:
+    game = Game()
+
+    if replay_filename != None:
+      game.setup_replay(replay_filename,float(get_command_line_value("--speed",1)))
+    elif "--test" in sys.argv:       # allows to quickly init a game
       game.setup_test_game(0)
     elif "--test2" in sys.argv:
       game.setup_test_game(1)
+    elif get_command_line_value("--lobby") != None:     # large lobby of AI players, e.g. --lobby 30 --teams 6
+      lobby_size = int(get_command_line_value("--lobby"))
+      game.setup_lobby(lobby_size,int(get_command_line_value("--teams",lobby_size)))
+      
+    game.record_replays_to = get_command_line_value("--record")
 
-  game.run()
+    game.run()
@@ -6,6 +6,7 @@
 import bombman
 import pygame
 import os
+import tempfile
 
 errors_total = 0
 
@@ -229,6 +230,7 @@ tile = (5,6)
 assertion("tile " + str(tile) + " - danger value = 0",test_map.get_danger_value(tile) == 0)
 tile = player2.get_tile_position()
 assertion("tile 1 up from player 2 danger value >= bom explosion time - dt",test_map.get_danger_value(tile) >= bombman.Bomb.BOMB_EXPLODES_IN - dt)
+assertion("danger value is given by the bomb's absolute explosion time",test_map.get_danger_value(tile) == test_map.bomb_on_tile(tile).explodes_at - test_map.get_map_time())
 
 for i in range(40):
   print("updating map, dt = " + str(dt))
@@ -246,6 +248,277 @@ for i in range(50):
 assertion("map state = STATE_GAME_OVER",test_map.get_state() == bombman.GameMap.STATE_GAME_OVER)
 assertion("map winning team = 3",test_map.get_winner_team() == 3)
 
+#       =========================
+#       headless simulation of AIs
+#       =========================
+
+print("setting up 10 AI players, simulating a headless match on \"classic\"")
+
+ai_play_setup = bombman.PlaySetup()
+ai_play_setup.player_slots = [(-1,i) for i in range(10)]
+
+headless_map = bombman.GameMap(map_data,ai_play_setup,0,0,headless=True)
+simulation = bombman.Simulation(headless_map,ai_play_setup)
+
+simulation.run(20,60000)
+
+assertion("headless map time advanced", headless_map.get_map_time() > 0)
+
+bombs_indexed_correctly = True
+players_indexed_correctly = True
+
+for y in range(bombman.GameMap.MAP_HEIGHT):
+  for x in range(bombman.GameMap.MAP_WIDTH):
+    expected_bombs = [b for b in headless_map.get_bombs() if b.movement != bombman.Bomb.BOMB_FLYING and b.get_tile_position() == (x,y)]
+    
+    if sorted(map(id,expected_bombs)) != sorted(map(id,headless_map.bombs_on_tile((x,y)))):
+      bombs_indexed_correctly = False
+      
+    expected_players = [p for p in headless_map.get_players() if not p.is_dead() and not p.is_in_air() and p.get_tile_position() == (x,y)]
+    
+    if sorted(map(id,expected_players)) != sorted(map(id,headless_map.get_players_at_tile((x,y)))):
+      players_indexed_correctly = False
+
+assertion("bomb tile index matches bomb positions", bombs_indexed_correctly)
+assertion("player tile index matches player positions", players_indexed_correctly)
+
+active_tiles = set([i for i in range(headless_map.tile_grid.get_number_of_tiles()) if len(headless_map.tile_grid.flames[i]) > 0 or headless_map.tile_grid.to_be_destroyed[i]])
+assertion("active tiles are exactly the tiles with flames or to be destroyed", active_tiles == headless_map.tile_grid.active_tiles)
+
+headless_grid = headless_map.tile_grid
+walkable_tiles = [i for i in range(headless_grid.get_number_of_tiles()) if (headless_grid.kinds[i] == bombman.MapTile.TILE_FLOOR or headless_grid.to_be_destroyed[i]) and len(headless_grid.bombs[i]) == 0]
+assertion("walkable bitmap matches the tiles", walkable_tiles == [i for i in range(headless_grid.get_number_of_tiles()) if headless_grid.tile_is_walkable(i)] and sum(headless_grid.walkable) == len(walkable_tiles))
+
+free_floor_tiles = [i for i in range(headless_grid.get_number_of_tiles()) if headless_grid.kinds[i] == bombman.MapTile.TILE_FLOOR and headless_grid.special_objects[i] == bombman.TileGrid.NO_VALUE and headless_grid.items[i] == bombman.TileGrid.NO_VALUE and len(headless_grid.players[i]) == 0]
+assertion("free floor tiles match the tiles", sorted(headless_grid.free_floor_tiles) == free_floor_tiles and all([headless_grid.free_floor_tiles[headless_grid.free_floor_positions[i]] == i for i in free_floor_tiles]))
+assertion("no sound events in headless mode", len(headless_map.get_and_clear_sound_events()) == 0)
+assertion("no animation events in headless mode", len(headless_map.get_and_clear_animation_events()) == 0)
+assertion("no display was needed", bombman.pygame.display.get_surface() == None)
+
+print("laying two bombs in a chain")
+
+chain_map = bombman.GameMap(map_data,ai_play_setup,0,0,headless=True)
+chain_player = chain_map.get_players()[0]
+chain_player.lay_bomb(chain_map,(0,0))
+chain_map.update(1000)
+chain_player.lay_bomb(chain_map,(1,0))
+
+assertion("danger value under the second bomb accounts for the chain reaction", chain_map.get_danger_value((1,1)) == bombman.Bomb.BOMB_EXPLODES_IN - 1000)
+
+print("giving player 0 a disease for 500 ms")
+
+chain_player.set_disease(bombman.Player.DISEASE_SLOW,500)
+chain_map.update(400)
+assertion("player 0 still has the disease after 400 ms", chain_player.get_disease() == bombman.Player.DISEASE_SLOW and chain_player.get_disease_time() == 100)
+chain_map.update(200)
+assertion("disease timer has ended the disease after 600 ms", chain_player.get_disease() == bombman.Player.DISEASE_NONE)
+
+chain_map.update(1500)
+assertion("both chained bombs have exploded", len(chain_map.get_bombs()) == 0 and chain_map.tile_has_flame((1,1)))
+chain_map.update(bombman.Flame.BURNING_TIME)
+assertion("flames are still burning", chain_map.tile_has_flame((0,0)) and chain_map.tile_has_flame((1,1)))
+chain_map.update(10)
+assertion("flames have burnt out", not chain_map.tile_has_flame((0,0)) and not chain_map.tile_has_flame((1,1)))
+
+print("checking flame rays")
+
+ray_map = bombman.GameMap(map_data,ai_play_setup,0,0,headless=True)
+ray_grid = ray_map.tile_grid
+
+assertion("flame ray from (0,0) to the right ends with block at (2,0)", ray_grid.get_flame_ray(0,1) == (1,2))
+ray_grid.block_destroyed(2)
+assertion("flame ray goes on after the block has been destroyed", ray_grid.get_flame_ray(0,1) == (1,2,3))
+assertion("flame ray from (0,0) up is empty", ray_grid.get_flame_ray(0,0) == ())
+
+def match_summary(game_map):
+  return ([(p.get_position(),p.get_state(),p.get_items()) for p in game_map.get_players()],
+    [[(tile.kind,tile.item) for tile in line] for line in game_map.get_tiles()],
+    [(b.get_position(),b.movement) for b in game_map.get_bombs()],
+    game_map.get_state_hash())
+
+def headless_match_summary(seed):
+  seeded_map = bombman.GameMap(map_data,ai_play_setup,0,0,headless=True,seed=seed)
+  bombman.Simulation(seeded_map,ai_play_setup).run(20,20000)
+  return match_summary(seeded_map)
+
+print("kicking a bomb and running a player towards a block with long time steps")
+
+step_map = bombman.GameMap(map_data,ai_play_setup,0,0,headless=True)
+step_player = step_map.get_players()[0]
+step_player.lay_bomb(step_map,(0,0))
+step_bomb = step_map.bomb_on_tile((0,0))
+step_bomb.movement = bombman.Bomb.BOMB_ROLLING_RIGHT
+step_map.update(1000)
+assertion("rolling bomb stops in front of the block at (2,0)", step_bomb.movement == bombman.Bomb.BOMB_NO_MOVEMENT and step_bomb.get_tile_position() == (1,0))
+
+step_player = step_map.get_players()[1]      # at (14,0), the block is at (14,2)
+step_player.speed = bombman.Player.MAX_SPEED
+step_map.update(4000)                        # to start the game
+
+for i in range(3):
+  step_player.react_to_inputs([(step_player.get_number(),bombman.PlayerKeyMaps.ACTION_DOWN)],100,step_map)
+
+assertion("fast player stops right at the block, not a tile before it", step_player.get_tile_position() == (14,1) and step_player.get_position()[1] > 1.5)
+
+print("simulating a headless match with seed 1 twice, stopping the first one as soon as it's decided")
+
+early_map = bombman.GameMap(map_data,ai_play_setup,0,0,headless=True,seed=1)
+early_winner = bombman.Simulation(early_map,ai_play_setup).run(20,120000,True)
+full_map = bombman.GameMap(map_data,ai_play_setup,0,0,headless=True,seed=1)
+full_winner = bombman.Simulation(full_map,ai_play_setup).run(20,120000)
+
+alive_teams = set([p.get_team_number() for p in early_map.get_players() if not p.is_dead()])
+assertion("team alive counts match the players alive", alive_teams == set(early_map.team_alive_counts) and sum(early_map.team_alive_counts.values()) == len([p for p in early_map.get_players() if not p.is_dead()]))
+assertion("early stopped match is decided with the same winner", early_map.get_state() == bombman.GameMap.STATE_FINISHING and early_winner == full_winner and early_map.get_map_time() < full_map.get_map_time())
+
+print("loading a 20 x 4 map with the size given in its header")
+
+wide_map = bombman.GameMap("env1:20x4;;;0" + "." * 78 + "1",ai_play_setup,0,0,headless=True)
+assertion("map size is taken from the header", (wide_map.get_width(),wide_map.get_height()) == (20,4))
+assertion("tile (19,3) is within the map, (15,0) is walkable", wide_map.tile_is_withing_map((19,3)) and not wide_map.tile_is_withing_map((20,0)) and wide_map.tile_is_walkable((15,0)))
+assertion("players start at (0,0) and (19,3)", [p.get_tile_position() for p in wide_map.get_players()[:2]] == [(0,0),(19,3)])
+
+def map_header_refused(map_data):
+  try:
+    bombman.GameMap(map_data,ai_play_setup,0,0,headless=True)
+  except ValueError:
+    return True
+  
+  return False
+
+assertion("map size not matching the tiles is refused", map_header_refused("env1:20x11;;;" + "." * 165) and map_header_refused("env1:10x11;;;" + "." * 165))
+assertion("map size out of range is refused", map_header_refused("env1:0x0;;;") and map_header_refused("env1:129x1;;;" + "." * 129))
+
+print("simulating a large lobby of 40 AI players in 8 teams on a 31 x 21 map")
+
+lobby_play_setup = bombman.PlaySetup()
+lobby_play_setup.set_ai_lobby(40,8)
+lobby_tiles = ["".join(["#" if x % 2 == 1 and y % 2 == 1 else "." for x in range(31)]) for y in range(21)]
+lobby_map = bombman.GameMap("env1:31x21;;;" + "".join(lobby_tiles),lobby_play_setup,0,0,headless=True,seed=2)
+lobby_start_tiles = [p.get_tile_position() for p in lobby_map.get_players()]
+assertion("40 players start on different floor tiles", len(set(lobby_start_tiles)) == 40 and all([lobby_map.tile_is_walkable(t) for t in lobby_start_tiles]))
+assertion("teams have distinct colors", len(set(bombman.Renderer.COLOR_RGB_VALUES[:bombman.GameMap.MAX_PLAYERS])) == bombman.GameMap.MAX_PLAYERS and len(bombman.Game.COLOR_NAMES) == bombman.GameMap.MAX_PLAYERS)
+bombman.Simulation(lobby_map,lobby_play_setup).run(20,20000)
+assertion("alive players are the players that aren't dead", lobby_map.get_alive_players() == [p for p in lobby_map.get_players() if not p.is_dead()])
+
+too_large_play_setup = bombman.PlaySetup()
+too_large_play_setup.set_ai_lobby(64,8)
+
+try:
+  bombman.GameMap(map_data,too_large_play_setup,0,0,headless=True,seed=2)
+  lobby_too_large = False
+except ValueError:
+  lobby_too_large = True
+
+assertion("lobby larger than the free tiles of the map is refused", lobby_too_large)
+
+clamped_play_setup = bombman.PlaySetup()
+clamped_play_setup.set_ai_lobby(12,0)
+assertion("lobby with 0 teams has all players in one team", set([slot[1] for slot in clamped_play_setup.player_slots]) == set([0]))
+clamped_play_setup.set_ai_lobby(3,50)
+assertion("lobby has at most one team per player", [slot[1] for slot in clamped_play_setup.player_slots if slot != None] == [0,1,2])
+
+print("taking a snapshot of a match with seed 3 after 10 s and simulating the following 10 s twice")
+
+rollback_map = bombman.GameMap(map_data,ai_play_setup,0,0,headless=True,seed=3)
+rollback_simulation = bombman.Simulation(rollback_map,ai_play_setup)
+rollback_simulation.run(10,10000)
+rollback_snapshot = rollback_simulation.snapshot()
+rollback_summary = match_summary(rollback_map)
+rollback_simulation.run(10,20000)
+first_summary = match_summary(rollback_map)
+rollback_simulation.restore(rollback_snapshot)
+assertion("restored map is the same as when the snapshot was taken", match_summary(rollback_map) == rollback_summary and rollback_map.get_map_time() == 10000)
+rollback_simulation.run(10,20000)
+assertion("match continues the same way after restoring", match_summary(rollback_map) == first_summary and first_summary != rollback_summary)
+assertion("incrementally updated hash of the tiles and flames is correct", rollback_map.tile_grid.state_hash == rollback_map.tile_grid.compute_state_hash())
+rollback_map.get_state_hash()
+assertion("incrementally updated hash of the players and bombs is correct", rollback_map.entity_hash == sum([e.get_hash_key() for e in rollback_map.get_players() + rollback_map.get_bombs()]) & bombman.StateHash.MASK)
+
+print("recording a headless match with seed 4 into a replay and playing it back")
+
+replay_filename = os.path.join(tempfile.gettempdir(),"bombman_test.replay")
+recorded_map = bombman.GameMap(map_data,ai_play_setup,0,0,headless=True,seed=4)
+recorded_simulation = bombman.Simulation(recorded_map,ai_play_setup)
+replay_recorder = bombman.ReplayRecorder(replay_filename,recorded_map,ai_play_setup)
+
+while recorded_map.get_state() != bombman.GameMap.STATE_GAME_OVER:
+  replay_recorder.record_tick(20,recorded_simulation.step(20))
+
+replay_recorder.close()
+replay_player = bombman.ReplayPlayer(replay_filename)
+replay_player.run()
+assertion("replay ends in the same state as the recorded match", replay_player.get_out_of_sync_time() == None and match_summary(replay_player.get_map()) == match_summary(recorded_map))
+assertion("replay has no AIs, only the recorded actions", len(replay_player.simulation.ais) == 0)
+replay_player.close()
+
+print("seeking in the replay to 12 s, back to 3 s and forward to the end")
+
+seeking_player = bombman.ReplayPlayer(replay_filename)
+assertion("replay has keyframes every 5 s", [keyframe[0] for keyframe in seeking_player.get_keyframes()] == list(range(5000,recorded_map.get_map_time(),5000)))
+seeking_player.seek(12000)
+assertion("seeking forward stops at the given time", seeking_player.get_map().get_map_time() == 12000)
+seeking_player.seek(3000)
+seeking_player.run()
+seeking_player.close()
+assertion("replay ends in the same state after seeking", seeking_player.get_out_of_sync_time() == None and match_summary(seeking_player.get_map()) == match_summary(recorded_map))
+
+print("opening an empty and a cut off replay file")
+
+replay_file = open(replay_filename,"rb")
+replay_data = replay_file.read()
+replay_file.close()
+
+def replay_file_refused(data):
+  damaged_file = open(replay_filename,"wb")
+  damaged_file.write(data)
+  damaged_file.close()
+  
+  try:
+    bombman.ReplayPlayer(replay_filename).close()
+  except ValueError:
+    return True
+  
+  return False
+
+assertion("empty replay file is refused", replay_file_refused(b""))
+assertion("replay file cut off in the header is refused", replay_file_refused(replay_data[:40]))
+os.remove(replay_filename)
+
+print("saving the state of the match with seed 4 and loading it into a new map")
+
+loaded_map = bombman.GameMap(map_data,ai_play_setup,0,0,headless=True,seed=7)
+saved_state = recorded_map.save_state()
+loaded_map.load_state(saved_state)
+assertion("loaded state is the same as the saved one", match_summary(loaded_map) == match_summary(recorded_map) and loaded_map.save_state() == saved_state)
+
+try:
+  loaded_map.load_state(saved_state[:-1])
+  damaged_state_refused = False
+except ValueError:
+  damaged_state_refused = True
+
+assertion("cut off state is refused", damaged_state_refused and match_summary(loaded_map) == match_summary(recorded_map))
+
+print("running a tournament of 2 matches in 2 processes")
+
+tournament = bombman.Tournament(2,2)
+tournament.run()
+assertion("matches played in worker processes give the same results as in this one", tournament.get_results() == [bombman.play_tournament_match(match_setup) for match_setup in tournament.match_setups])
+assertion("tournament results string lists the matches", len(tournament.get_results_string().split("map time in ms):")[1].strip().split("\n")) == 2)
+
+print("simulating headless matches with seeds 5, 5 and 6")
+
+summary_a = headless_match_summary(5)
+summary_b = headless_match_summary(5)
+summary_c = headless_match_summary(6)
+
+assertion("same seed gives the same match",summary_a == summary_b)
+assertion("different seed gives a different match",summary_a != summary_c)
+
+seeded_random = bombman.SeededRandom(1)
+assertion("seeded random numbers are the same on all Python versions",[seeded_random.randint(0,9) for i in range(5)] == [2,9,1,4,1] and seeded_random.choice("abcdef") == "d" and seeded_random.sample(range(20),4) == [14,16,0,9])
+
 #       =================
 #       test other things
 #       =================
@@ -253,6 +526,17 @@ assertion("map winning team = 3",test_map.get_winner_team() == 3)
 assertion("ACTION_DOWN is opposite of ACTION_UP",bombman.PlayerKeyMaps.get_opposite_action(bombman.PlayerKeyMaps.ACTION_UP) == bombman.PlayerKeyMaps.ACTION_DOWN)
 assertion("ACTION_LEFT is opposite of ACTION_RIGHT",bombman.PlayerKeyMaps.get_opposite_action(bombman.PlayerKeyMaps.ACTION_LEFT) == bombman.PlayerKeyMaps.ACTION_RIGHT)
 
+print("interpolating position between simulation ticks")
+positionable = bombman.Positionable()
+positionable.set_position((1.0,1.0))
+positionable.start_tick()
+positionable.set_position((1.5,1.0))
+assertion("position interpolated halfway",positionable.get_interpolated_position(0.5) == (1.25,1.0))
+positionable.set_position((5.0,1.0))
+assertion("jump longer than a tile is not interpolated",positionable.get_interpolated_position(0.5) == (5.0,1.0))
+positionable.set_position((2.3,4.7))
+assertion("position is stored in fixed point units",(positionable.x,positionable.y) == (2300,4700) and positionable.get_tile_position() == (2,4))
+
 print("init game")
 game = bombman.Game()
 